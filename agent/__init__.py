@@ -1,50 +1,53 @@
 """
 Agent package - chứa các chức năng chính của AI Agent
+
+Các submodule (và A2A / Gemini SDK phía sau) chỉ được import khi tên tương ứng
+được truy cập lần đầu (PEP 562), để script chỉ dùng agent.skills không phải
+tải toàn bộ server.
 """
 
-from .skills import create_chat_skill, create_weather_skill, get_all_skills
-from .cards import create_public_agent_card, create_extended_agent_card
-from .routes import chat_page
-from .app_factory import get_a2a_app, create_a2a_server, create_request_handler
-from .agent_executor_wrapper import AgentExecutorWrapper, wrap_agent_executor
+import importlib
+
+# Tên export -> module chứa nó
+_EXPORTS = {
+    'create_chat_skill': '.skills',
+    'create_weather_skill': '.skills',
+    'get_all_skills': '.skills',
+    'create_public_agent_card': '.cards',
+    'create_extended_agent_card': '.cards',
+    'chat_page': '.routes',
+    'get_a2a_app': '.app_factory',
+    'create_a2a_server': '.app_factory',
+    'create_request_handler': '.app_factory',
+    'AgentExecutorWrapper': '.agent_executor_wrapper',
+    'wrap_agent_executor': '.agent_executor_wrapper',
+    'RedisTaskStore': '.task_store',
+    # Conversation functions từ service package
+    'log_agent_response': 'service',
+    'get_conversation_history': 'service',
+    'get_session_summary': 'service',
+    'delete_session': 'service',
+    'get_conversation_stats': 'service',
+    # Database functions từ utils package
+    'db_execute': 'utils',
+    'db_fetch_all': 'utils',
+    'db_fetch_one': 'utils',
+    'redis_set': 'utils',
+    'redis_get': 'utils',
+    'redis_delete': 'utils',
+    'redis_exists': 'utils',
+}
 
-# Import conversation functions từ service package
-from service import (
-    log_agent_response,
-    get_conversation_history,
-    get_session_summary,
-    delete_session,
-    get_conversation_stats
-)
+__all__ = list(_EXPORTS)
 
-# Import database functions từ utils package
-from utils import (
-    db_execute, db_fetch_all, db_fetch_one,
-    redis_set, redis_get, redis_delete, redis_exists
-)
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __package__), name)
+    # Cache lại để lần truy cập sau không đi qua __getattr__
+    globals()[name] = value
+    return value
 
-__all__ = [
-    'create_chat_skill',
-    'create_weather_skill', 
-    'get_all_skills',
-    'create_public_agent_card',
-    'create_extended_agent_card',
-    'chat_page',
-    'get_a2a_app',
-    'create_a2a_server',
-    'create_request_handler',
-    'AgentExecutorWrapper',
-    'wrap_agent_executor',
-    'log_agent_response',
-    'get_conversation_history',
-    'get_session_summary',
-    'delete_session',
-    'get_conversation_stats',
-    'db_execute',
-    'db_fetch_all', 
-    'db_fetch_one',
-    'redis_set',
-    'redis_get',
-    'redis_delete',
-    'redis_exists'
-]
+def __dir__():
+    return sorted(list(globals()) + __all__)
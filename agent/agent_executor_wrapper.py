@@ -5,16 +5,136 @@ Agent Executor Wrapper - Tự động log conversation khi agent sinh ra kết q
 import time
 import logging
 import inspect
-from typing import Dict, Any, Optional, List
-from service import log_agent_response
+from typing import Dict, Any, Optional, List, Tuple
+from service import enqueue_log
+
+try:
+    from a2a.types import Message, Part, TextPart, TaskStatusUpdateEvent  # type: ignore[import-not-found]
+except ImportError:
+    # Không có a2a: không type nào khớp -> chỉ còn đường probe tổng quát
+    Message = Part = TextPart = TaskStatusUpdateEvent = ()  # type: ignore[assignment,misc]
 
 logger = logging.getLogger(__name__)
 
+# Các key có thể chứa thông tin skill / response trong kết quả của agent
+_SKILL_KEYS = ('skill', 'skill_used', 'intent', 'action', 'type')
+_RESPONSE_KEYS = ('response', 'answer', 'content', 'text', 'message', 'output')
+# Key -> độ ưu tiên (nhỏ hơn = ưu tiên hơn) để duyệt result chỉ một lần
+_SKILL_RANK = {key: i for i, key in enumerate(_SKILL_KEYS)}
+_RESPONSE_RANK = {key: i for i, key in enumerate(_RESPONSE_KEYS)}
+
+def _extract_part_text(part: Any) -> Optional[str]:
+    """Lấy text từ một part: attribute -> Pydantic export -> dict -> str ngắn"""
+    # Direct attribute
+    text_val = getattr(part, 'text', None)
+    # Pydantic/BaseModel export
+    if text_val is None:
+        try:
+            if hasattr(part, 'model_dump'):
+                data = part.model_dump()
+                text_val = data.get('text') or data.get('content')
+            elif hasattr(part, 'dict'):
+                data = part.dict()  # type: ignore[attr-defined]
+                text_val = data.get('text') or data.get('content')
+        except Exception:
+            pass
+    # Dict
+    if text_val is None and isinstance(part, dict):
+        text_val = part.get('text') or part.get('content') or part.get('message')
+    # Fallback: string cast if short
+    if text_val is None:
+        try:
+            s = str(part)
+            if s and len(s) < 500 and 'TaskStatusUpdateEvent' not in s:
+                text_val = s
+        except Exception:
+            pass
+    return text_val
+
+def _extract_event_texts(evt: Any, texts: List[str]):
+    """Trích xuất các đoạn text của một event và thêm vào texts"""
+    # Fast path cho các kiểu A2A thường gặp
+    evt_type = type(evt)
+    if evt_type is Message:
+        for part in evt.parts:
+            root = part.root if type(part) is Part else part
+            if type(root) is TextPart:
+                if root.text:
+                    texts.append(root.text)
+            else:
+                text_val = _extract_part_text(root)
+                if text_val:
+                    texts.append(str(text_val))
+        return
+    if evt_type is TaskStatusUpdateEvent:
+        # Status update (vd: canceled) không mang nội dung trả lời
+        return
+
+    # Slow path: event không rõ kiểu
+    parts = getattr(evt, 'parts', None)
+    if not parts or not isinstance(parts, list):
+        # Try direct text-like attributes
+        for attr in ("text", "message", "content"):
+            val = getattr(evt, attr, None)
+            if val:
+                texts.append(str(val))
+                break
+        # Try dict-like event
+        if hasattr(evt, 'get'):
+            for key in ("text", "message", "content"):
+                try:
+                    val = evt.get(key)
+                    if val:
+                        texts.append(str(val))
+                        break
+                except Exception:
+                    pass
+        # As last resort, use string repr if looks short
+        try:
+            s = str(evt)
+            if s and len(s) < 500 and 'TaskStatusUpdateEvent' not in s:
+                texts.append(s)
+        except Exception:
+            pass
+        return
+    for part in parts:
+        text_val = _extract_part_text(part)
+        if text_val:
+            texts.append(str(text_val))
+
+class _DummyContext:
+    """Request context giả cho executor kiểu A2A (context, event_queue)"""
+    __slots__ = ('_text', 'context_id', 'task_id')
+    def __init__(self, text: str, context_id: str):
+        self._text = text
+        self.context_id = context_id
+        self.task_id = None
+    def get_user_input(self):
+        return self._text
+
+class _ExtractingQueue:
+    """Event queue giả: trích xuất text ngay khi nhận event rồi bỏ event đi"""
+    __slots__ = ('texts',)
+    def __init__(self):
+        self.texts: List[str] = []
+    async def enqueue_event(self, evt):
+        try:
+            _extract_event_texts(evt, self.texts)
+        except Exception as ex:
+            logger.warning(f"Could not extract agent text from event: {ex}")
+
 class AgentExecutorWrapper:
     """Wrapper cho agent executor để tự động log conversation"""
     
     def __init__(self, agent_executor):
         self.agent_executor = agent_executor
+        # Signature của executor không đổi -> chỉ cần xét một lần
+        # Note: bound method có 'self' trong co_argcount -> trừ 1, expect 2 params (context, event_queue)
+        fn = getattr(agent_executor, 'execute', None)
+        code = getattr(fn, '__code__', None)
+        self._is_a2a_style = bool(
+            code and code.co_argcount - (1 if inspect.ismethod(fn) else 0) >= 2
+        )
     
     async def execute(self, session_id: str, user_message: str, **kwargs) -> Dict[str, Any]:
         """
@@ -25,112 +145,24 @@ class AgentExecutorWrapper:
             user_message: Tin nhắn của user
             **kwargs: Các tham số khác cho agent executor
         """
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         try:
             # Thực thi agent
             result: Dict[str, Any]
 
-            # Detect underlying executor signature. If it expects (context, event_queue), adapt.
-            sig = None
-            try:
-                sig = inspect.signature(self.agent_executor.execute)
-            except Exception:
-                sig = None
-
-            # Note: for bound methods, 'self' is not included -> expect 2 params (context, event_queue)
-            # For unbound methods, it may be 3 (self, context, event_queue)
-            if sig and len(sig.parameters) >= 2:
+            # If underlying executor expects (context, event_queue), adapt.
+            if self._is_a2a_style:
                 # Minimal shims to run A2A-style executors and capture output
-                class _DummyEventQueue:
-                    def __init__(self):
-                        self.events: List[Any] = []
-                    async def enqueue_event(self, evt):
-                        self.events.append(evt)
-                class _DummyContext:
-                    def __init__(self, text: str, context_id: str):
-                        self._text = text
-                        self.context_id = context_id
-                        self.task_id = None
-                    def get_user_input(self):
-                        return self._text
-                q = _DummyEventQueue()
+                q = _ExtractingQueue()
                 ctx = _DummyContext(user_message, session_id)
                 await self.agent_executor.execute(ctx, q)  # type: ignore[arg-type]
-                # Extract all agent texts from queued events if available
-                collected_texts: List[str] = []
-                try:
-                    logger.debug(f"Agent event queue length: {len(q.events)}")
-                    for evt in q.events:
-                        logger.debug(f"Event type: {type(evt)}; has parts: {hasattr(evt, 'parts')}")
-                        parts = getattr(evt, 'parts', None)
-                        if not parts or not isinstance(parts, list):
-                            # Try direct text-like attributes
-                            for attr in ("text", "message", "content"):
-                                val = getattr(evt, attr, None)
-                                if val:
-                                    collected_texts.append(str(val))
-                                    break
-                            # Try dict-like event
-                            if hasattr(evt, 'get'):
-                                for key in ("text", "message", "content"):
-                                    try:
-                                        val = evt.get(key)
-                                        if val:
-                                            collected_texts.append(str(val))
-                                            break
-                                    except Exception:
-                                        pass
-                            # As last resort, use string repr if looks short
-                            try:
-                                s = str(evt)
-                                if s and len(s) < 500 and 'TaskStatusUpdateEvent' not in s:
-                                    collected_texts.append(s)
-                            except Exception:
-                                pass
-                            continue
-                        for part in parts:
-                            text_val = None
-                            # Direct attribute
-                            text_val = getattr(part, 'text', None)
-                            # Pydantic/BaseModel export
-                            if text_val is None:
-                                try:
-                                    if hasattr(part, 'model_dump'):
-                                        data = part.model_dump()
-                                        text_val = data.get('text') or data.get('content')
-                                    elif hasattr(part, 'dict'):
-                                        data = part.dict()  # type: ignore[attr-defined]
-                                        text_val = data.get('text') or data.get('content')
-                                except Exception:
-                                    pass
-                            # Dict
-                            if text_val is None and isinstance(part, dict):
-                                text_val = part.get('text') or part.get('content') or part.get('message')
-                            # Fallback: string cast if short
-                            if text_val is None:
-                                try:
-                                    s = str(part)
-                                    if s and len(s) < 500 and 'TaskStatusUpdateEvent' not in s:
-                                        text_val = s
-                                except Exception:
-                                    pass
-                            if text_val:
-                                collected_texts.append(str(text_val))
-                    agent_text = "\n".join(collected_texts).strip()
-                except Exception as ex:
-                    logger.warning(f"Could not extract agent text from events: {ex}")
-                    agent_text = ""
+                # Text đã được trích xuất ngay khi event được enqueue
+                agent_text = "\n".join(q.texts).strip()
                 if not agent_text:
                     logger.warning("No agent text extracted from events; returning fallback message.")
-                # Try to extract skill/intent from underlying executor if available
-                skill = None
-                try:
-                    underlying = getattr(self, 'agent_executor', None)
-                    # IntentRouterAgentExecutor exposes last_intent
-                    skill = getattr(underlying, 'last_intent', None)
-                except Exception:
-                    pass
+                # IntentRouterAgentExecutor exposes last_intent
+                skill = getattr(self.agent_executor, 'last_intent', None)
                 result = {
                     "response": agent_text or "Không có nội dung phản hồi.",
                     "skill_used": skill or "unknown",
@@ -140,31 +172,29 @@ class AgentExecutorWrapper:
                 result = await self.agent_executor.execute(user_message, **kwargs)  # type: ignore[misc]
             
             # Tính thời gian xử lý
-            processing_time = time.time() - start_time
-            
-            # Lấy thông tin skill được sử dụng
-            skill_used = self._extract_skill_used(result)
+            processing_time = time.perf_counter() - start_time
             
-            # Lấy response của agent
-            agent_response = self._extract_agent_response(result)
+            # Lấy skill được sử dụng và response của agent trong một lượt duyệt
+            skill_used, agent_response = self._extract(result)
             
-            # Metadata bổ sung
+            # Metadata bổ sung (result_keys / kwargs chỉ ghi khi bật DEBUG)
+            debug = logger.isEnabledFor(logging.DEBUG)
             metadata = {
                 "executor_type": type(self.agent_executor).__name__,
                 "processing_time": processing_time,
-                "result_keys": list(result.keys()) if isinstance(result, dict) else None,
-                "kwargs": kwargs
+                "result_keys": list(result) if (debug and isinstance(result, dict)) else None,
+                "kwargs": kwargs if debug else None
             }
             
-            # Log conversation
-            await log_agent_response(
-                session_id=session_id,
-                user_message=user_message,
-                agent_response=agent_response,
-                skill_used=skill_used,
-                processing_time=processing_time,
-                metadata=metadata
-            )
+            # Đưa vào hàng đợi, log batcher sẽ ghi theo lô ở background
+            enqueue_log({
+                "session_id": session_id,
+                "user_message": user_message,
+                "agent_response": agent_response,
+                "skill_used": skill_used,
+                "processing_time": processing_time,
+                "metadata": metadata
+            })
             
             logger.info(f"Agent executed successfully for session {session_id}, skill: {skill_used}")
             
@@ -172,65 +202,57 @@ class AgentExecutorWrapper:
             
         except Exception as e:
             # Log lỗi
-            processing_time = time.time() - start_time
+            processing_time = time.perf_counter() - start_time
             error_response = f"Error: {str(e)}"
             
-            await log_agent_response(
-                session_id=session_id,
-                user_message=user_message,
-                agent_response=error_response,
-                skill_used="error",
-                processing_time=processing_time,
-                metadata={
+            enqueue_log({
+                "session_id": session_id,
+                "user_message": user_message,
+                "agent_response": error_response,
+                "skill_used": "error",
+                "processing_time": processing_time,
+                "metadata": {
                     "error": str(e),
                     "error_type": type(e).__name__,
                     "executor_type": type(self.agent_executor).__name__
                 }
-            )
+            })
             
             logger.error(f"Agent execution failed for session {session_id}: {str(e)}")
             raise
     
-    def _extract_skill_used(self, result: Dict[str, Any]) -> Optional[str]:
-        """Trích xuất skill được sử dụng từ kết quả"""
-        try:
-            if isinstance(result, dict):
-                # Kiểm tra các key có thể chứa thông tin skill
-                skill_keys = ['skill', 'skill_used', 'intent', 'action', 'type']
-                for key in skill_keys:
-                    if key in result:
-                        return str(result[key])
-                
-                # Kiểm tra trong metadata
-                if 'metadata' in result and isinstance(result['metadata'], dict):
-                    for key in skill_keys:
-                        if key in result['metadata']:
-                            return str(result['metadata'][key])
-            
-            return None
-            
-        except Exception as e:
-            logger.warning(f"Could not extract skill used: {str(e)}")
-            return None
-    
-    def _extract_agent_response(self, result: Dict[str, Any]) -> str:
-        """Trích xuất response của agent từ kết quả"""
-        try:
-            if isinstance(result, dict):
-                # Thử các key có thể chứa response
-                response_keys = ['response', 'answer', 'content', 'text', 'message', 'output']
-                for key in response_keys:
-                    if key in result and result[key]:
-                        return str(result[key])
-                
-                # Nếu không tìm thấy, chuyển toàn bộ result thành string
-                return str(result)
-            
-            return str(result)
-            
-        except Exception as e:
-            logger.warning(f"Could not extract agent response: {str(e)}")
-            return str(result)
+    def _extract(self, result: Dict[str, Any]) -> Tuple[Optional[str], str]:
+        """Trích xuất (skill được sử dụng, response của agent) từ kết quả"""
+        if not isinstance(result, dict):
+            return None, str(result)
+        
+        skill = None
+        skill_rank = len(_SKILL_KEYS)
+        response = None
+        response_rank = len(_RESPONSE_KEYS)
+        for key, value in result.items():
+            rank = _SKILL_RANK.get(key)
+            if rank is not None and rank < skill_rank and value is not None:
+                skill, skill_rank = value, rank
+            rank = _RESPONSE_RANK.get(key)
+            if rank is not None and rank < response_rank and value:
+                response, response_rank = value, rank
+        
+        # Kiểm tra skill trong metadata
+        if skill is None:
+            metadata = result.get('metadata')
+            if isinstance(metadata, dict):
+                for key in _SKILL_KEYS:
+                    value = metadata.get(key)
+                    if value is not None:
+                        skill = value
+                        break
+        
+        # Nếu không tìm thấy response, chuyển toàn bộ result thành string
+        return (
+            str(skill) if skill is not None else None,
+            str(response) if response else str(result),
+        )
 
 def wrap_agent_executor(agent_executor) -> AgentExecutorWrapper:
     """Wrap agent executor để tự động log conversation"""
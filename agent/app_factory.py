@@ -1,17 +1,18 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from functools import lru_cache
 from a2a.server.apps import A2AStarletteApplication
 from a2a.server.request_handlers import DefaultRequestHandler
-from a2a.server.tasks import InMemoryTaskStore
 from agent_executor import IntentRouterAgentExecutor  # type: ignore[import-untyped]
 
 from .cards import create_public_agent_card, create_extended_agent_card
 from .agent_executor_wrapper import wrap_agent_executor
-from agent_executor import WeatherAgentExecutor
+from .task_store import RedisTaskStore
 
+@lru_cache(maxsize=1)
 def create_request_handler() -> DefaultRequestHandler:
-    """Tạo request handler cho agent với conversation logging"""
+    """Tạo request handler cho agent với conversation logging
+
+    Tạo một lần cho cả process: A2A app và chat routes dùng chung executor.
+    """
     # Tạo agent executor gốc
     original_executor = IntentRouterAgentExecutor()
     
@@ -20,7 +21,7 @@ def create_request_handler() -> DefaultRequestHandler:
     
     return DefaultRequestHandler(
         agent_executor=wrapped_executor,
-        task_store=InMemoryTaskStore(),
+        task_store=RedisTaskStore(),
     )
 
 def create_a2a_server() -> A2AStarletteApplication:
@@ -1,6 +1,8 @@
+from functools import lru_cache
 from a2a.types import AgentCapabilities, AgentCard
 from .skills import get_all_skills
 
+@lru_cache(maxsize=1)
 def create_public_agent_card() -> AgentCard:
     """Tạo public-facing agent card"""
     return AgentCard(
@@ -11,10 +13,11 @@ def create_public_agent_card() -> AgentCard:
         default_input_modes=['text'],
         default_output_modes=['text'],
         capabilities=AgentCapabilities(streaming=True),
-        skills=get_all_skills(),
+        skills=list(get_all_skills()),
         supports_authenticated_extended_card=True,
     )
 
+@lru_cache(maxsize=1)
 def create_extended_agent_card() -> AgentCard:
     """Tạo authenticated extended agent card"""
     public_card = create_public_agent_card()
@@ -23,6 +26,6 @@ def create_extended_agent_card() -> AgentCard:
             'name': 'Router Agent - Extended',
             'description': 'Phiên bản đầy đủ cho người dùng xác thực',
             'version': '1.0.1',
-            'skills': get_all_skills(),
+            'skills': list(get_all_skills()),
         }
     )
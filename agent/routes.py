@@ -1,11 +1,35 @@
+import hashlib
+import os
 from fastapi import Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 
-async def chat_page(request: Request) -> HTMLResponse:
-    """Route handler cho trang chat"""
+_CHAT_HTML_PATH = "chat.html"
+_CHAT_HTML_FALLBACK = "<!doctype html><html><body><p>chat.html not found.</p></body></html>"
+
+def _load_chat_html() -> bytes:
+    """Đọc nội dung chat.html (dạng bytes UTF-8)"""
     try:
-        with open("chat.html", "r", encoding="utf-8") as f:
-            html = f.read()
+        with open(_CHAT_HTML_PATH, "rb") as f:
+            return f.read()
     except Exception:
-        html = "<!doctype html><html><body><p>chat.html not found.</p></body></html>"
-    return HTMLResponse(html)
+        return _CHAT_HTML_FALLBACK.encode("utf-8")
+
+def _etag(content: bytes) -> str:
+    return f'"{hashlib.blake2b(content, digest_size=8).hexdigest()}"'
+
+# Đọc một lần khi import, không đọc file trên mỗi request
+_CHAT_HTML_BYTES = _load_chat_html()
+_CHAT_HTML_ETAG = _etag(_CHAT_HTML_BYTES)
+
+async def chat_page(request: Request) -> Response:
+    """Route handler cho trang chat"""
+    # DEV_RELOAD=1 để đọc lại file mỗi lần khi đang phát triển giao diện
+    if os.environ.get("DEV_RELOAD"):
+        content = _load_chat_html()
+        etag = _etag(content)
+    else:
+        content, etag = _CHAT_HTML_BYTES, _CHAT_HTML_ETAG
+    # Trình duyệt đã có bản hiện tại -> 304, không gửi lại nội dung
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return HTMLResponse(content=content, headers={"ETag": etag})
@@ -1,5 +1,7 @@
+from functools import lru_cache
 from a2a.types import AgentSkill
 
+@lru_cache(maxsize=1)
 def create_chat_skill() -> AgentSkill:
     """Tạo skill chat tổng quát sử dụng Gemini"""
     return AgentSkill(
@@ -10,6 +12,7 @@ def create_chat_skill() -> AgentSkill:
         examples=['Xin chào', 'giải thích về AI'],
     )
 
+@lru_cache(maxsize=1)
 def create_weather_skill() -> AgentSkill:
     """Tạo skill thời tiết theo tỉnh/thành"""
     return AgentSkill(
@@ -20,6 +23,7 @@ def create_weather_skill() -> AgentSkill:
         examples=['Thời tiết Hà Nội', 'Thời tiết ở Đà Nẵng hôm nay'],
     )
 
-def get_all_skills() -> list[AgentSkill]:
-    """Lấy tất cả các skill có sẵn"""
-    return [create_chat_skill(), create_weather_skill()]
+@lru_cache(maxsize=1)
+def get_all_skills() -> tuple[AgentSkill, ...]:
+    """Lấy tất cả các skill có sẵn (tuple bất biến vì kết quả được cache)"""
+    return (create_chat_skill(), create_weather_skill())
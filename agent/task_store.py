@@ -0,0 +1,65 @@
+"""
+Task Store - Lưu A2A Task trong Redis để nhiều worker dùng chung trạng thái task
+"""
+
+import logging
+import os
+from typing import Optional
+
+from a2a.server.context import ServerCallContext
+from a2a.server.tasks import TaskStore, InMemoryTaskStore
+from a2a.types import Task
+
+logger = logging.getLogger(__name__)
+
+TASK_KEY_PREFIX = "a2a:task:"
+TASK_TTL = int(os.getenv('A2A_TASK_TTL', 86400))
+
+class RedisTaskStore(TaskStore):
+    """
+    TaskStore lưu Task dạng JSON trong Redis
+
+    Dùng lại Redis client (và connection pool) do initialize tạo ra thay vì mở
+    pool riêng. Khi Redis chưa được khởi tạo (chạy không có services) thì
+    fallback sang InMemoryTaskStore để server vẫn hoạt động.
+    """
+
+    def __init__(self, ttl: int = TASK_TTL):
+        self.ttl = ttl
+        self._fallback = InMemoryTaskStore()
+        self._warned = False
+
+    def _client(self):
+        """Lấy Redis client, trả về None nếu services chưa được khởi tạo"""
+        try:
+            from initialize import get_redis_client
+            return get_redis_client()
+        except RuntimeError:
+            if not self._warned:
+                logger.warning("Redis not initialized, using in-memory task store")
+                self._warned = True
+            return None
+
+    async def save(self, task: Task, context: Optional[ServerCallContext] = None) -> None:
+        """Lưu hoặc cập nhật task"""
+        client = self._client()
+        if client is None:
+            return await self._fallback.save(task, context)
+        await client.set(f"{TASK_KEY_PREFIX}{task.id}", task.model_dump_json(), ex=self.ttl)
+
+    async def get(self, task_id: str, context: Optional[ServerCallContext] = None) -> Optional[Task]:
+        """Lấy task theo ID"""
+        client = self._client()
+        if client is None:
+            return await self._fallback.get(task_id, context)
+        data = await client.get(f"{TASK_KEY_PREFIX}{task_id}")
+        if data is None:
+            return None
+        return Task.model_validate_json(data)
+
+    async def delete(self, task_id: str, context: Optional[ServerCallContext] = None) -> None:
+        """Xóa task theo ID"""
+        client = self._client()
+        if client is None:
+            return await self._fallback.delete(task_id, context)
+        await client.delete(f"{TASK_KEY_PREFIX}{task_id}")
@@ -1,11 +1,21 @@
+import atexit
+import hashlib
+import logging
 import inspect
+import itertools
 import os
-from uuid import uuid4
-from typing import Optional, Dict, List
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from secrets import token_hex
+from typing import Any, Awaitable, Callable, Deque, Optional, Dict, List
 from datetime import datetime, timezone
+from functools import lru_cache
 import asyncio
 
 import httpx  # type: ignore[import-not-found]
+from utils.cache_utils import TTLCache, MISSING as _MISSING
+from utils.json_utils import json_dumps, json_loads
 from a2a.server.agent_execution import (  # type: ignore[import-not-found]
     AgentExecutor,
     RequestContext,
@@ -38,70 +48,735 @@ except ImportError:
     LANGCHAIN_AVAILABLE = False
     print("LangChain not available, using fallback memory system")
 
+logger = logging.getLogger(__name__)
+
 _gemini_model = None
+# Hàm sinh nội dung đã resolve sẵn cho _gemini_model (async native hoặc chạy qua thread pool)
+_gemini_generate: Optional[Callable[[str], Awaitable[Any]]] = None
+# Hàm gọi model phân loại intent (system instruction = STATIC_INTENT_SYSTEM)
+_intent_generate: Optional[Callable[[str], Awaitable[Any]]] = None
+# Hàm phân loại intent theo lô (system instruction = _BATCH_INTENT_PROMPT)
+_intent_batch_generate: Optional[Callable[[str], Awaitable[Any]]] = None
+
+# Thread pool riêng cho các lời gọi Gemini sync (khi SDK không có API async),
+# không tranh chấp default executor với các tác vụ khác trong process
+_GEMINI_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('GEMINI_POOL', '16')),
+    thread_name_prefix='gemini',
+)
+atexit.register(_GEMINI_POOL.shutdown)
+
+# Giới hạn số lời gọi Gemini đồng thời (intent, chat, chuẩn hóa địa danh dùng chung).
+# Khi đầy, request mới chờ ở đây thay vì dồn thêm tải lên Gemini/rate limit.
+_GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', os.environ.get('GEMINI_POOL', '16')))
+_gemini_semaphore = asyncio.Semaphore(_GEMINI_MAX_CONCURRENCY)
+
+def _create_gemini_model():
+    """Configure Gemini SDK và tạo model dùng chung cho toàn process.
+
+    genai giữ một client (và kết nối keep-alive của nó) cho mỗi lần configure,
+    vì vậy chat, intent và chuẩn hóa địa danh đều phải dùng chung model này
+    thay vì configure/tạo model riêng.
+    """
+    import google.generativeai as genai  # type: ignore[import-not-found]
+
+    api_key = os.environ.get('GOOGLE_API_KEY') or os.environ.get('GEMINI_API_KEY')
+    if not api_key:
+        raise RuntimeError('Missing GOOGLE_API_KEY (or GEMINI_API_KEY)')
+    configure_kwargs = {'api_key': api_key}
+    # GEMINI_TRANSPORT: 'grpc_asyncio' | 'grpc' | 'rest' (mặc định theo SDK)
+    transport = os.environ.get('GEMINI_TRANSPORT')
+    if transport:
+        configure_kwargs['transport'] = transport
+    genai.configure(**configure_kwargs)
+    model_name = os.environ.get('GEMINI_MODEL', 'gemini-2.5-flash')
+    return genai.GenerativeModel(model_name)
+
+# Phần cố định của prompt phân loại intent. Đặt làm system instruction (hoặc đầu
+# prompt) để mọi request phân loại có chung prefix -> provider cache được prefix này;
+# phần thay đổi (ngữ cảnh + câu hỏi) luôn nằm ở cuối.
+STATIC_INTENT_SYSTEM = """Bạn là bộ phân loại intent thông minh.
+
+Intent hợp lệ: [weather, chat]
+
+Quy tắc phân loại:
+- Nếu câu hỏi liên quan đến thời tiết, nhiệt độ, khí hậu, dự báo, mưa, nắng, gió, bão → trả "weather"
+- Nếu câu hỏi về địa danh, tỉnh, thành phố mà có thể liên quan đến thời tiết → trả "weather"
+- Nếu câu hỏi chung chung, không liên quan thời tiết → trả "chat"
+- Nếu câu hỏi tiếp tục cuộc trò chuyện trước đó → trả "chat"
+
+Chỉ trả đúng 1 từ (weather hoặc chat).
+"""
+
+# Câu trả lời phân loại chỉ là 1 từ -> giới hạn số token sinh ra, nhiệt độ 0.
+# gemini-2.5-* là model "thinking": token suy nghĩ tính vào max_output_tokens, nên
+# REST tắt thinking (thinkingBudget=0) và giới hạn để dư chỗ cho nhãn; SDK
+# google-generativeai không có thinking_config nên chỉ dựa vào giới hạn này
+_INTENT_GENERATION_CONFIG = {
+    'max_output_tokens': int(os.environ.get('INTENT_MAX_OUTPUT_TOKENS', '10')),
+    'temperature': 0.0,
+}
+_INTENT_THINKING_BUDGET = int(os.environ.get('INTENT_THINKING_BUDGET', '0'))
+_INTENT_LABELS = ('weather', 'chat')
+
+_GEMINI_STREAM_URL = 'https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent'
+
+def _create_intent_generate(model, system: str = STATIC_INTENT_SYSTEM,
+                            generation_config: Optional[Dict[str, Any]] = None,
+                            stop_at_label: bool = True) -> Callable[[str], Awaitable[Any]]:
+    """Tạo hàm gọi model phân loại intent với system làm system instruction.
+
+    Mặc định gọi thẳng REST API qua HTTP client async dùng chung (không qua thread
+    pool của SDK). GEMINI_INTENT_TRANSPORT=sdk thì dùng model của SDK, chung cấu hình
+    genai với model chính; SDK không hỗ trợ system_instruction thì ghép phần cố
+    định vào đầu prompt. stop_at_label=False (phân loại theo lô) đọc hết câu trả lời.
+    """
+    generation_config = generation_config or _INTENT_GENERATION_CONFIG
+    api_key = os.environ.get('GOOGLE_API_KEY') or os.environ.get('GEMINI_API_KEY')
+    if api_key and os.environ.get('GEMINI_INTENT_TRANSPORT', 'rest') == 'rest':
+        return _bind_rest_intent(os.environ.get('GEMINI_MODEL', 'gemini-2.5-flash'), api_key,
+                                 system, generation_config, stop_at_label)
+    try:
+        import google.generativeai as genai  # type: ignore[import-not-found]
+        intent_model = genai.GenerativeModel(
+            getattr(model, 'model_name', None) or os.environ.get('GEMINI_MODEL', 'gemini-2.5-flash'),
+            system_instruction=system,
+            generation_config=generation_config,
+        )
+    except (ImportError, TypeError):
+        generate = _bind_generate(model)
+
+        async def _generate_with_prefix(prompt: str):
+            return await generate(system + '\n' + prompt)
+        return _generate_with_prefix
+    return _bind_stream_intent(intent_model, stop_at_label)
+
+def _bind_stream_intent(model, stop_at_label: bool = True) -> Callable[[str], Awaitable[Any]]:
+    """Gọi model intent dạng stream, dừng ngay khi đã thấy nhãn (weather/chat).
+
+    Trả về text đã nhận được; SDK không có API async thì gọi thường trong thread pool.
+    """
+    generate_content_async = getattr(model, 'generate_content_async', None)
+    if not callable(generate_content_async):
+        return _bind_generate(model)
+
+    async def _stream(prompt: str) -> str:
+        resp = await generate_content_async(prompt, stream=True)
+        received = ''
+        async for chunk in resp:
+            received += getattr(chunk, 'text', '') or ''
+            if stop_at_label and _has_intent_label(received):
+                break
+        return received
+    return _stream
+
+def _has_intent_label(text: str) -> bool:
+    lowered = text.lower()
+    return any(label in lowered for label in _INTENT_LABELS)
+
+def _bind_rest_intent(model_name: str, api_key: str, system: str = STATIC_INTENT_SYSTEM,
+                      generation_config: Optional[Dict[str, Any]] = None,
+                      stop_at_label: bool = True) -> Callable[[str], Awaitable[str]]:
+    """Gọi streamGenerateContent (SSE) bằng httpx, dừng ngay khi đã thấy nhãn intent
+    (trừ khi stop_at_label=False)."""
+    generation_config = generation_config or _INTENT_GENERATION_CONFIG
+    url = _GEMINI_STREAM_URL.format(model=model_name.removeprefix('models/'))
+    headers = {'x-goog-api-key': api_key, 'content-type': 'application/json'}
+    params = {'alt': 'sse'}
+    # Phần cố định của body (system instruction + config) serialize sẵn một lần
+    body_prefix = json_dumps({
+        'systemInstruction': {'parts': [{'text': system}]},
+        'generationConfig': {
+            'maxOutputTokens': generation_config['max_output_tokens'],
+            'temperature': generation_config['temperature'],
+            'thinkingConfig': {'thinkingBudget': _INTENT_THINKING_BUDGET},
+        },
+    })[:-1]
+
+    async def _stream(prompt: str) -> str:
+        contents = json_dumps([{'role': 'user', 'parts': [{'text': prompt}]}])
+        body = f'{body_prefix},"contents":{contents}}}'
+        received = ''
+        finish_reason = None
+        async with _get_http_client().stream('POST', url, params=params, headers=headers,
+                                             content=body.encode()) as r:
+            if r.status_code != 200:
+                await r.aread()
+                raise RuntimeError(f'Gemini HTTP {r.status_code}: {r.text[:200]}')
+            async for line in r.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                text, reason = _parse_intent_chunk(json_loads(line[5:]))
+                received += text
+                finish_reason = reason or finish_reason
+                if stop_at_label and _has_intent_label(received):
+                    break
+        if not received.strip() and finish_reason == 'MAX_TOKENS':
+            # Hết token trước khi sinh nhãn (thường do thinking) -> caller coi như lỗi
+            logger.warning("Intent classification hit MAX_TOKENS with empty output")
+        return received
+    return _stream
+
+def _parse_intent_chunk(payload: Dict[str, Any]) -> tuple:
+    """Lấy (text, finishReason) từ một chunk SSE của streamGenerateContent.
+
+    Candidate có thể không có content/parts (ví dụ finishReason MAX_TOKENS khi hết
+    token) -> text rỗng, không lỗi.
+    """
+    text = ''
+    finish_reason = None
+    for candidate in payload.get('candidates') or ():
+        for part in (candidate.get('content') or {}).get('parts') or ():
+            text += part.get('text') or ''
+        finish_reason = candidate.get('finishReason') or finish_reason
+    return text, finish_reason
+
+_gemini_init_lock = asyncio.Lock()
+# Lỗi cấu hình lần khởi tạo đầu (thiếu API key / SDK): cấu hình chỉ đổi khi restart,
+# nên các request sau báo lỗi ngay thay vì import + configure lại mỗi lần
+_gemini_init_error: Optional[str] = None
+
+async def get_gemini_model():
+    """Lấy model Gemini dùng chung, khởi tạo một lần kể cả khi nhiều request đến cùng lúc.
+
+    Raises lỗi cấu hình (vd: thiếu API key) cho caller tự xử lý.
+    """
+    global _gemini_model, _gemini_generate, _intent_generate, _intent_batch_generate
+    global _gemini_init_error
+    if _gemini_model is None:
+        async with _gemini_init_lock:
+            # Double-check: coroutine khác có thể đã khởi tạo trong lúc chờ lock
+            if _gemini_model is None:
+                if _gemini_init_error is not None:
+                    raise RuntimeError(_gemini_init_error)
+                try:
+                    # Import SDK + configure mất hàng trăm ms -> chạy ngoài event loop
+                    model = await asyncio.to_thread(_create_gemini_model)
+                except (ImportError, RuntimeError) as e:
+                    _gemini_init_error = str(e)
+                    raise
+                _gemini_generate = _bind_generate(model)
+                _intent_generate = _create_intent_generate(model)
+                _intent_batch_generate = _create_intent_generate(
+                    model, _BATCH_INTENT_PROMPT, _INTENT_BATCH_GENERATION_CONFIG, stop_at_label=False,
+                )
+                _gemini_model = model
+    return _gemini_model
+
+def _bind_generate(model) -> Callable[[str], Awaitable[Any]]:
+    """Chọn một lần cách gọi model: API async nếu có, nếu không thì chạy sync trong thread pool."""
+    generate_content_async = getattr(model, 'generate_content_async', None)
+    if callable(generate_content_async):
+        return generate_content_async
+    generate_content = model.generate_content
+
+    async def _generate_in_pool(prompt: str):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_GEMINI_POOL, generate_content, prompt)
+    return _generate_in_pool
+
+# Prompt -> [task đang gọi Gemini cho prompt đó, số caller đang chờ] (single-flight)
+_inflight_prompts: Dict[str, list] = {}
+
+# Cache câu trả lời theo hash của prompt: prompt đã gồm history của phiên, nên chỉ
+# trúng khi cùng ngữ cảnh + cùng câu hỏi (vd: người dùng gửi lại, phân loại intent lặp lại)
+_RESPONSE_CACHE = TTLCache(
+    maxsize=int(os.getenv('GEMINI_CACHE_SIZE', 256)),
+    ttl=float(os.getenv('GEMINI_CACHE_TTL', 600)),
+)
+
+def _prompt_key(prompt: str) -> bytes:
+    return hashlib.blake2b(prompt.encode(), digest_size=16).digest()
+
+async def _send_chat(history: List[Dict], message: str):
+    """Gửi message trong một chat session mới có sẵn history (start_chat không gọi mạng)."""
+    chat = _gemini_model.start_chat(history=history)
+    send_message_async = getattr(chat, 'send_message_async', None)
+    if callable(send_message_async):
+        return await send_message_async(message)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_GEMINI_POOL, chat.send_message, message)
+
+async def _call_gemini(prompt: str, history: Optional[List[Dict]], key: str,
+                       generate: Optional[Callable[[str], Awaitable[Any]]] = None) -> Optional[str]:
+    async with _gemini_semaphore:
+        if history:
+            resp = await _send_chat(history, prompt)
+        else:
+            resp = await (generate or _gemini_generate)(prompt)
+    # Lời gọi stream (intent) trả về text trực tiếp
+    text = resp if isinstance(resp, str) else getattr(resp, 'text', None) if resp else None
+    if text:
+        _RESPONSE_CACHE.set(_prompt_key(key), text)
+    return text
+
+def _forget_inflight(prompt: str, task: asyncio.Task) -> None:
+    _inflight_prompts.pop(prompt, None)
+    # Đánh dấu exception đã được lấy nếu mọi caller đều đã bị huỷ
+    if not task.cancelled():
+        task.exception()
+
+async def _generate_text(prompt: str, history: Optional[List[Dict]] = None,
+                         intent: bool = False) -> Optional[str]:
+    """Gọi Gemini model dùng chung và trả về text, lỗi được raise cho caller.
+
+    Gemini không có API batch cho generate_content, nên thay vì gom lô theo cửa sổ
+    thời gian, các request đồng thời có cùng prompt (vd: nhiều phiên mới cùng hỏi
+    một câu) dùng chung một lời gọi. Model phải được khởi tạo trước qua
+    get_gemini_model().
+
+    history (các lượt trước theo format của start_chat) được gửi thành chat session
+    thay vì ghép vào prompt, để phần đầu request giữ ổn định giữa các lượt.
+    intent=True gọi model phân loại intent (prompt chỉ là phần thay đổi).
+    """
+    if intent:
+        key = '\0intent\0' + prompt
+    else:
+        key = json_dumps([history, prompt]) if history else prompt
+    cached = _RESPONSE_CACHE.get(_prompt_key(key))
+    if cached is not _MISSING:
+        return cached
+    entry = _inflight_prompts.get(key)
+    if entry is None:
+        task = asyncio.ensure_future(
+            _call_gemini(prompt, history, key, _intent_generate if intent else None)
+        )
+        entry = _inflight_prompts[key] = [task, 0]
+        task.add_done_callback(lambda t, k=key: _forget_inflight(k, t))
+    task = entry[0]
+    entry[1] += 1
+    try:
+        # shield: một caller bị huỷ không huỷ lời gọi mà caller khác đang chờ
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # Caller cuối cùng bị huỷ -> huỷ luôn lời gọi Gemini, không tốn quota vô ích
+        if entry[1] == 1 and not task.done():
+            task.cancel()
+        raise
+    finally:
+        entry[1] -= 1
+
+# HTTP client dùng chung cho Open-Meteo: giữ kết nối keep-alive (TCP + TLS)
+# giữa các request thay vì handshake lại mỗi lần geocode / lấy thời tiết
+_http_client: Optional[httpx.AsyncClient] = None
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Lấy (hoặc tạo lần đầu) AsyncClient dùng chung.
+
+    Không có await giữa bước kiểm tra và gán nên không cần lock trong event loop.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        try:
+            import h2  # type: ignore[import-not-found]  # noqa: F401
+            http2 = True
+        except ImportError:
+            http2 = False
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0),
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+            http2=http2,
+        )
+    return _http_client
+
+# Kết quả geocode gần như cố định -> cache lâu; lookup thất bại cache ngắn để
+# không gọi API liên tục khi người dùng gõ sai. Thời tiết cache theo toạ độ làm tròn.
+_GEOCODE_CACHE = TTLCache(maxsize=1024, ttl=30 * 24 * 3600)
+_GEOCODE_NEGATIVE_TTL = 300
+# Tên địa danh -> tên đã được LLM chuẩn hóa (chỉ lưu khi LLM trả lời thành công)
+_NORM_CACHE = TTLCache(maxsize=2048, ttl=7 * 24 * 3600)
+# Số request geocode song song tối đa khi nạp danh sách tỉnh/thành
+_PROVINCE_FETCH_CONCURRENCY = 8
+_WEATHER_CACHE = TTLCache(maxsize=1024, ttl=300)
+# (context_id, câu hỏi đã chuẩn hóa) -> intent. Intent chỉ là weather/chat nên câu hỏi
+# lặp lại trong cùng phiên không cần gọi Gemini phân loại lại
+_INTENT_CACHE = TTLCache(
+    maxsize=int(os.getenv('INTENT_CACHE_SIZE', 4096)),
+    ttl=float(os.getenv('INTENT_CACHE_TTL', 600)),
+)
+# Số lần trúng/trượt _INTENT_CACHE (đọc khi cần kiểm tra hiệu quả cache)
+INTENT_CACHE_STATS: Dict[str, int] = {'hits': 0, 'misses': 0}
+
+# Regex dùng cho _extract_location, compile một lần khi load module
+# IGNORECASE: so khớp trực tiếp trên text gốc, không cần .lower() cả câu
+_WEATHER_KW_RE = re.compile(r'th[ờo]i\s*ti[ếe]t|weather|nhi[ệe]t\s*[đd][ộo]', re.IGNORECASE)
+_PUNCT_RE = re.compile(r'[\.,!?;:]+')
+# Tách nhiều địa danh trong một câu hỏi: "Hà Nội, Huế và Đà Nẵng"
+_LOCATION_SEP_RE = re.compile(r'\s*(?:[,;&]|\bvà\b|\band\b)\s*', re.IGNORECASE)
+_TIME_WORDS_RE = re.compile(r'\b(hôm nay|hom nay|hiện tại|hien tai)\b', re.IGNORECASE)
+# Pre-filter intent cho router: chỉ một bên khớp -> quyết định luôn, không gọi Gemini.
+# Cả hai cùng khớp hoặc không bên nào khớp thì mới hỏi Gemini.
+_INTENT_WEATHER_RE = re.compile(
+    r'\b(?:th[ờo]i\s*ti[ếe]t|mưa|nắng|nhi[ệe]t\s*[đd][ộo]|dự\s*báo|du\s*bao|gió|bão|'
+    r'kh[íi]\s*h[ậa]u|forecast|weather|rain|temperature)\b',
+    re.IGNORECASE,
+)
+_INTENT_CHAT_RE = re.compile(
+    r'^\s*(?:xin\s*ch[àa]o|ch[àa]o|hi|hello|hey|c[ảa]m\s*[ơo]n|thanks?|thank\s+you|'
+    r'bạn\s+là\s+ai|ban\s+la\s+ai|tạm\s*biệt|bye)\b',
+    re.IGNORECASE,
+)
+
+def _build_ascii_table() -> dict:
+    """Bảng str.translate bỏ dấu cho chữ Latin (gồm tiếng Việt), build một lần khi import."""
+    table = {}
+    for cp in (*range(0x00C0, 0x0250), *range(0x1E00, 0x1F00)):
+        ch = chr(cp)
+        base = ''.join(c for c in unicodedata.normalize('NFKD', ch) if not unicodedata.combining(c))
+        if base and base != ch:
+            table[cp] = base
+    # đ/Đ không tách được bằng NFKD
+    table[ord('đ')] = 'd'
+    table[ord('Đ')] = 'D'
+    # Dấu rời (input dạng decomposed) -> bỏ đi
+    for cp in range(0x0300, 0x0370):
+        table[cp] = None
+    return table
+
+_VN_ASCII_TABLE = _build_ascii_table()
+
+# Mô tả mã thời tiết WMO (0-99) của Open-Meteo, index trực tiếp theo mã
+_WEATHER_CODE_DESC: tuple[Optional[str], ...] = tuple(
+    {
+        0: 'Trời quang',
+        1: 'Trời quang phần lớn',
+        2: 'Có mây rải rác',
+        3: 'Nhiều mây',
+        45: 'Sương mù',
+        51: 'Mưa phùn nhẹ',
+        61: 'Mưa nhẹ',
+        63: 'Mưa vừa',
+        65: 'Mưa to',
+        71: 'Tuyết nhẹ',
+        80: 'Mưa rào nhẹ',
+        95: 'Dông',
+    }.get(i) for i in range(100)
+)
+
+def _weather_code_desc(code) -> str:
+    """Mô tả mã thời tiết, mã chưa map thì hiển thị số mã."""
+    if type(code) is int and 0 <= code < 100:
+        desc = _WEATHER_CODE_DESC[code]
+        if desc is not None:
+            return desc
+    return f'Mã thời tiết {code}'
+
+@lru_cache(maxsize=4096)
+def _strip_diacritics(s: str) -> str:
+    """Bỏ dấu tiếng Việt; input là tập địa danh nhỏ, lặp lại nhiều nên memoize."""
+    return s.translate(_VN_ASCII_TABLE)
+
+@lru_cache(maxsize=1024)
+def _normalize_key(location: str) -> tuple[str, str]:
+    """Key tra cứu địa danh: (chữ thường, chữ thường không dấu)."""
+    lowered = location.lower().strip()
+    return lowered, _strip_diacritics(lowered)
+
+def _last_weather_keyword(text: str) -> Optional[re.Match]:
+    """Quét text một lần, trả về match của từ khóa thời tiết cuối cùng.
+
+    _extract_location cắt địa danh sau match này; router chỉ cần biết có từ khóa
+    hay không nên dùng thẳng _WEATHER_KW_RE.search (dừng ở match đầu tiên).
+    """
+    last = None
+    for last in _WEATHER_KW_RE.finditer(text):
+        pass
+    return last
+
+def _prefilter_intent(text: str) -> Optional[str]:
+    """Phân loại intent bằng regex; None nếu không rõ ràng (cần hỏi Gemini)."""
+    is_weather = _INTENT_WEATHER_RE.search(text) is not None
+    is_chat = _INTENT_CHAT_RE.search(text) is not None
+    if is_weather == is_chat:
+        return None
+    return "weather" if is_weather else "chat"
+
+async def aclose_http_client() -> None:
+    """Đóng HTTP client dùng chung (gọi khi shutdown)."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+# File lưu danh sách tỉnh/thành đã geocode, để process khởi động lại không phải gọi API
+_LOCATIONS_FILE = os.path.expanduser(
+    os.getenv('VN_LOCATIONS_CACHE', os.path.join('~', '.cache', 'agent', 'vn_locations.json'))
+)
+
+def _load_locations_file(path: str, max_age: float) -> Optional[Dict[str, tuple]]:
+    """Đọc danh sách địa danh từ file nếu file còn hạn, lỗi hoặc hết hạn -> None."""
+    try:
+        if time.time() - os.path.getmtime(path) >= max_age:
+            return None
+        with open(path, 'rb') as f:
+            data = json_loads(f.read())
+        return {key: tuple(value) for key, value in data.items()}
+    except Exception:
+        return None
+
+def _save_locations_file(path: str, locations: Dict[str, tuple]) -> None:
+    """Ghi danh sách địa danh ra file (ghi file tạm rồi rename để không bị ghi dở)."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json_dumps(locations))
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.debug("Could not save locations cache to %s: %s", path, e)
+
+# Toạ độ dự phòng cho các thành phố lớn (dùng khi API lỗi), build một lần khi import
+_FALLBACK_LOCATIONS: Dict[str, tuple] = {
+    'hà nội': (21.0285, 105.8542, 'Hà Nội'),
+    'ha noi': (21.0285, 105.8542, 'Hà Nội'),
+    'hồ chí minh': (10.8231, 106.6297, 'Hồ Chí Minh'),
+    'ho chi minh': (10.8231, 106.6297, 'Hồ Chí Minh'),
+    'tp hcm': (10.8231, 106.6297, 'Hồ Chí Minh'),
+    'đà nẵng': (16.0544, 108.2022, 'Đà Nẵng'),
+    'da nang': (16.0544, 108.2022, 'Đà Nẵng'),
+    'hải phòng': (20.8449, 106.6881, 'Hải Phòng'),
+    'hai phong': (20.8449, 106.6881, 'Hải Phòng'),
+    'cần thơ': (10.0452, 105.7469, 'Cần Thơ'),
+    'can tho': (10.0452, 105.7469, 'Cần Thơ'),
+    'quảng nam': (15.5394, 108.0191, 'Quảng Nam'),
+    'quang nam': (15.5394, 108.0191, 'Quảng Nam'),
+    'thừa thiên huế': (16.4637, 107.5909, 'Thừa Thiên Huế'),
+    'thua thien hue': (16.4637, 107.5909, 'Thừa Thiên Huế'),
+    'huế': (16.4637, 107.5909, 'Thừa Thiên Huế'),
+    'hue': (16.4637, 107.5909, 'Thừa Thiên Huế'),
+    'khánh hòa': (12.2388, 109.1967, 'Khánh Hòa'),
+    'khanh hoa': (12.2388, 109.1967, 'Khánh Hòa'),
+    'nha trang': (12.2388, 109.1967, 'Nha Trang'),
+    'lâm đồng': (11.9404, 108.4583, 'Lâm Đồng'),
+    'lam dong': (11.9404, 108.4583, 'Lâm Đồng'),
+    'đà lạt': (11.9404, 108.4583, 'Đà Lạt'),
+    'da lat': (11.9404, 108.4583, 'Đà Lạt'),
+    'bình dương': (11.1696, 106.6667, 'Bình Dương'),
+    'binh duong': (11.1696, 106.6667, 'Bình Dương'),
+    'đồng nai': (10.9574, 106.8426, 'Đồng Nai'),
+    'dong nai': (10.9574, 106.8426, 'Đồng Nai'),
+    'bà rịa vũng tàu': (10.5411, 107.2420, 'Bà Rịa Vũng Tàu'),
+    'ba ria vung tau': (10.5411, 107.2420, 'Bà Rịa Vũng Tàu'),
+    'vũng tàu': (10.3459, 107.0843, 'Vũng Tàu'),
+    'vung tau': (10.3459, 107.0843, 'Vũng Tàu'),
+}
 
 class FallbackMemory:
     """Fallback memory system khi không có LangChain."""
     
     def __init__(self, k: int = 5):
         self.k = k
-        self.messages: List[Dict] = []
+        # Ring buffer k lượt hội thoại: append tự bỏ tin nhắn cũ nhất
+        self.messages: Deque[Dict] = deque(maxlen=k * 2)
+        # Dòng history đã render sẵn của từng tin nhắn (song song với messages)
+        self._lines: Deque[str] = deque(maxlen=k * 2)
+        # History đã render, chỉ join lại sau khi có tin nhắn mới
+        self._rendered: Optional[str] = None
     
+    def _append(self, role: str, content: str, now: float) -> None:
+        self.messages.append({
+            'role': role,
+            'content': content,
+            'timestamp': now
+        })
+        self._lines.append(f"{'Người dùng' if role == 'user' else 'Assistant'}: {content}")
+
     def save_context(self, inputs: Dict, outputs: Dict):
         """Lưu context."""
+        now = time.monotonic()
         if 'input' in inputs:
-            self.messages.append({
-                'role': 'user',
-                'content': inputs['input'],
-                'timestamp': asyncio.get_event_loop().time()
-            })
+            self._append('user', inputs['input'], now)
         
         if 'output' in outputs:
-            self.messages.append({
-                'role': 'assistant', 
-                'content': outputs['output'],
-                'timestamp': asyncio.get_event_loop().time()
-            })
+            self._append('assistant', outputs['output'], now)
         
-        # Giữ chỉ k tin nhắn gần nhất
-        if len(self.messages) > self.k * 2:
-            self.messages = self.messages[-self.k * 2:]
+        self._rendered = None
     
     def load_memory_variables(self, inputs: Dict) -> Dict:
         """Load memory variables."""
-        if not self.messages:
-            return {'history': ''}
-        
-        history_lines = []
-        for msg in self.messages[-self.k * 2:]:
-            role = "Người dùng" if msg['role'] == 'user' else "Assistant"
-            history_lines.append(f"{role}: {msg['content']}")
-        
-        return {'history': '\n'.join(history_lines)}
+        return {'history': self.history_text()}
+
+    def history_text(self) -> str:
+        """History dạng text (k lượt gần nhất), cache đến lần ghi tiếp theo."""
+        if self._rendered is None:
+            self._rendered = '\n'.join(self._lines)
+        return self._rendered
     
     def clear(self):
         """Xóa memory."""
         self.messages.clear()
+        self._lines.clear()
+        self._rendered = None
 
-# Global memory store
-_memory_store: Dict[str, any] = {}
+def _history_text(memory) -> str:
+    """History dạng text của phiên cho prompt phân loại intent.
+
+    FallbackMemory trả về chuỗi đã render sẵn; LangChain window memory
+    (return_messages=True) trả về list message nên dùng buffer_as_str (k lượt gần nhất).
+    """
+    history_text = getattr(memory, 'history_text', None)
+    if history_text is not None:
+        return history_text()
+    buffer_as_str = getattr(memory, 'buffer_as_str', None)
+    if isinstance(buffer_as_str, str):
+        return buffer_as_str
+    history = memory.load_memory_variables({})['history']
+    return history if isinstance(history, str) else ''
+
+# Global memory store: LRU có giới hạn, phiên lâu không dùng bị bỏ để không giữ memory mãi
+_MEMORY_STORE_SIZE = int(os.getenv('MEMORY_STORE_SIZE', 1024))
+_memory_store: "OrderedDict[str, Any]" = OrderedDict()
 
 def get_or_create_memory(context_id: str):
     """Lấy hoặc tạo memory system."""
-    if context_id not in _memory_store:
-        if LANGCHAIN_AVAILABLE:
-            # Sử dụng LangChain memory
-            _memory_store[context_id] = ConversationBufferWindowMemory(
-                k=5,  # Giữ 5 cặp Q&A
-                return_messages=True,
-                memory_key="history"
-            )
-        else:
-            # Fallback memory
-            _memory_store[context_id] = FallbackMemory(k=5)
-    
-    return _memory_store[context_id]
+    memory = _memory_store.get(context_id)
+    if memory is not None:
+        _memory_store.move_to_end(context_id)
+        return memory
+
+    if LANGCHAIN_AVAILABLE:
+        # Sử dụng LangChain memory
+        memory = ConversationBufferWindowMemory(
+            k=5,  # Giữ 5 cặp Q&A
+            return_messages=True,
+            memory_key="history"
+        )
+    else:
+        # Fallback memory
+        memory = FallbackMemory(k=5)
+    _memory_store[context_id] = memory
+    if len(_memory_store) > _MEMORY_STORE_SIZE:
+        _memory_store.popitem(last=False)
+    return memory
+
+
+# Kiểu queue -> enqueue_event có phải async def không (xác định một lần cho mỗi kiểu)
+_ENQUEUE_IS_ASYNC: Dict[type, bool] = {}
+
+async def _enqueue(event_queue: EventQueue, evt) -> None:
+    """Đưa event vào queue, hỗ trợ cả queue sync lẫn async."""
+    queue_type = type(event_queue)
+    is_async = _ENQUEUE_IS_ASYNC.get(queue_type)
+    if is_async is None:
+        is_async = _ENQUEUE_IS_ASYNC[queue_type] = inspect.iscoroutinefunction(event_queue.enqueue_event)
+    maybe_awaitable = event_queue.enqueue_event(evt)
+    # Queue sync hiếm gặp vẫn có thể trả về awaitable -> chỉ khi đó mới phải kiểm tra
+    if is_async or inspect.isawaitable(maybe_awaitable):
+        await maybe_awaitable
+
+# messageId chỉ cần duy nhất: prefix ngẫu nhiên theo process + bộ đếm tăng dần,
+# không phải lấy entropy từ OS cho mỗi message
+_MSG_ID_PREFIX = token_hex(8)
+_MSG_COUNTER = itertools.count()
+
+def _reset_msg_ids() -> None:
+    """Process con (fork) phải có prefix riêng để không trùng messageId với process cha."""
+    global _MSG_ID_PREFIX, _MSG_COUNTER
+    _MSG_ID_PREFIX = token_hex(8)
+    _MSG_COUNTER = itertools.count()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_msg_ids)
+
+def _agent_text_message(text: str, task_id: Optional[str], context_id: Optional[str]) -> Message:
+    """Tạo Message text của agent.
+
+    Giữ constructor có validate: với pydantic-core hiện tại nó nhanh hơn
+    model_construct (model_construct chạy bằng Python thuần).
+    """
+    return Message(
+        messageId=f"{_MSG_ID_PREFIX}-{next(_MSG_COUNTER):x}",
+        role=Role.agent,
+        parts=[TextPart(text=text)],
+        taskId=task_id,
+        contextId=context_id,
+    )
+
+def _canceled_event(task_id: Optional[str], context_id: Optional[str]) -> TaskStatusUpdateEvent:
+    """Tạo status update 'canceled' (final) theo contract A2A."""
+    return TaskStatusUpdateEvent(
+        taskId=task_id or '',
+        contextId=context_id or '',
+        status=TaskStatus(state=TaskState.canceled),
+        final=True,
+    )
+
+async def _emit(event_queue: EventQueue, task_id: Optional[str], context_id: Optional[str], text: str) -> None:
+    """Gửi một Message text của agent cho task/context hiện tại."""
+    await _enqueue(event_queue, _agent_text_message(text, task_id, context_id))
+
+def _context_ids(context: RequestContext) -> tuple[Optional[str], Optional[str]]:
+    """Đọc (task_id, context_id) của request một lần."""
+    return context.task_id, context.context_id
+
+
+def _user_input(context: RequestContext) -> str:
+    """Đọc text người dùng của request, None -> chuỗi rỗng."""
+    return context.get_user_input() or ''
+
+
+_GREETING_REPLY = 'Xin chào! Bạn cần hỗ trợ gì?'
+_CANNED_REPLIES = {
+    'hi': _GREETING_REPLY,
+    'hello': _GREETING_REPLY,
+    'hey': _GREETING_REPLY,
+    'chào': _GREETING_REPLY,
+    'chao': _GREETING_REPLY,
+    'xin chào': _GREETING_REPLY,
+    'xin chao': _GREETING_REPLY,
+    'ping': 'pong',
+}
+
+def _canned_reply(text: str) -> Optional[str]:
+    """Câu trả lời có sẵn cho input rỗng hoặc lời chào, None nếu cần gọi Gemini.
+
+    Input một ký tự (vd: "?", "1", "好") vẫn là câu hỏi thật -> gửi Gemini.
+    """
+    if not text or text.isspace():
+        return _GREETING_REPLY
+    if len(text) > 12:
+        return None
+    return _CANNED_REPLIES.get(text.lower().rstrip('!.?'))
+
+
+def _chat_history(memory, user_text: str) -> Optional[List[Dict]]:
+    """Chuyển memory thành history cho start_chat: [{'role': 'user'|'model', 'parts': [...]}].
 
+    Trả về None nếu memory không liệt kê được từng lượt. Bỏ lượt rỗng và lượt user
+    trùng câu hỏi hiện tại; gộp các lượt liên tiếp cùng role (bỏ bản trùng).
+    """
+    messages = getattr(memory, 'messages', None)
+    if messages is None:
+        messages = getattr(memory, 'buffer_as_messages', None)  # LangChain window memory
+    if messages is None:
+        return None
+    history: List[Dict] = []
+    for msg in messages:
+        if isinstance(msg, dict):
+            role, content = msg.get('role'), msg.get('content')
+        else:
+            role, content = getattr(msg, 'type', None), getattr(msg, 'content', None)
+        if not content:
+            continue
+        role = 'user' if role in ('user', 'human') else 'model'
+        if history and history[-1]['role'] == role:
+            # Cùng role liên tiếp với nội dung trùng -> bỏ bản trùng
+            if history[-1]['parts'][-1] != content:
+                history[-1]['parts'].append(content)
+        else:
+            history.append({'role': role, 'parts': [content]})
+    if history and history[-1]['role'] == 'user' and history[-1]['parts'][-1].strip() == user_text:
+        history[-1]['parts'].pop()
+        if not history[-1]['parts']:
+            history.pop()
+    return history
+
+async def _generate_or_error(prompt: str, history: Optional[List[Dict]] = None) -> Optional[str]:
+    """Gọi Gemini, lỗi được chuyển thành text thông báo thay vì raise (dùng trong TaskGroup)"""
+    try:
+        return await _generate_text(prompt, history)
+    except Exception as e:
+        return f"Gemini call failed: {e}"
 
 class GeminiAgentExecutor(AgentExecutor):
     """Gemini-backed Agent.
@@ -110,84 +785,79 @@ class GeminiAgentExecutor(AgentExecutor):
     the user's input extracted from the RequestContext.
     """
 
+    def __init__(self) -> None:
+        # task_id -> lời gọi Gemini đang chạy, để cancel() huỷ được ngay
+        self._inflight: Dict[str, asyncio.Task] = {}
+
     async def invoke(self) -> str:
         # Fallback text if invoked without context (should not happen in server flow)
         return 'Hello from Gemini Agent'
 
     async def execute(self, context: RequestContext, event_queue: EventQueue) -> None:
-        global _gemini_model
+        await self._execute_with_text(_user_input(context), context, event_queue)
 
-        # Extract user text input
-        try:
-            user_text = context.get_user_input() if hasattr(context, 'get_user_input') else ''
-        except Exception:
-            user_text = ''
-        if not user_text:
-            user_text = 'Hello'
+    async def _execute_with_text(self, user_text: str, context: RequestContext, event_queue: EventQueue) -> None:
+        """Xử lý request với text người dùng đã được đọc sẵn (router truyền vào)."""
+        task_id, context_id = _context_ids(context)
+        user_text = user_text.strip()
 
         # Lấy context cho phiên này
-        context_id = getattr(context, 'context_id', 'default')
-        memory = get_or_create_memory(context_id)
+        memory = get_or_create_memory(context_id if context_id is not None else 'default')
         
-        # Không lưu tin nhắn người dùng nữa vì đã lưu trong router
-        # Chỉ cần lưu phản hồi của bot sau khi xử lý
+        # Lượt hỏi-đáp được lưu một lần (cả input lẫn output) khi đã có câu trả lời
 
-        # Configure Gemini model lazily
-        if _gemini_model is None:
-            try:
-                import google.generativeai as genai  # type: ignore[import-not-found]
-
-                api_key = os.environ.get('GOOGLE_API_KEY') or os.environ.get('GEMINI_API_KEY')
-                if not api_key:
-                    raise RuntimeError('Missing GOOGLE_API_KEY (or GEMINI_API_KEY)')
-                genai.configure(api_key=api_key)
-                model_name = os.environ.get('GEMINI_MODEL', 'gemini-2.5-flash')
-                _gemini_model = genai.GenerativeModel(model_name)
-            except Exception as e:
-                # On configuration error, emit a friendly message
-                text = f"Gemini configuration error: {e}"
-                msg = Message(
-                    messageId=str(uuid4()),
-                    role=Role.agent,
-                    parts=[TextPart(text=text)],
-                    taskId=getattr(context, 'task_id', None),
-                    contextId=getattr(context, 'context_id', None),
-                )
-                maybe_awaitable = event_queue.enqueue_event(msg)
-                if inspect.isawaitable(maybe_awaitable):
-                    await maybe_awaitable
-                return
+        # Input rỗng / lời chào đơn giản -> trả lời ngay, không gọi Gemini
+        canned = _canned_reply(user_text)
+        if canned is not None:
+            memory.save_context({"input": user_text}, {"output": canned})
+            await _emit(event_queue, task_id, context_id, canned)
+            return
+
+        # Configure Gemini model lazily (thường đã được warm up lúc startup)
+        try:
+            if _gemini_model is None:
+                await get_gemini_model()
+        except Exception as e:
+            # On configuration error, emit a friendly message
+            text = f"Gemini configuration error: {e}"
+            await _emit(event_queue, task_id, context_id, text)
+            return
 
         # Call Gemini với context
         try:
-            # Tạo prompt với context
-            history_text = memory.load_memory_variables({"input": user_text})['history']
-            if history_text:
-                enhanced_prompt = f"""Ngữ cảnh trước đó:
+            # Gửi các lượt trước dưới dạng chat history (phần đầu request không đổi giữa
+            # các lượt -> provider cache được prefix); model không có start_chat thì
+            # ghép history vào prompt như cũ
+            history = _chat_history(memory, user_text) if hasattr(_gemini_model, 'start_chat') else None
+            if history is not None:
+                enhanced_prompt = user_text
+            else:
+                history_text = _history_text(memory)
+                if history_text:
+                    enhanced_prompt = f"""Ngữ cảnh trước đó:
 {history_text}
 
 Câu hỏi hiện tại: {user_text}
 
 Hãy trả lời dựa trên ngữ cảnh và câu hỏi hiện tại."""
-            else:
-                enhanced_prompt = user_text
-
-            # Prefer async API if available
-            response_text = None
-            try:
-                generate_content_async = getattr(_gemini_model, 'generate_content_async', None)
-                if callable(generate_content_async):
-                    resp = await generate_content_async(enhanced_prompt)
-                    response_text = getattr(resp, 'text', None) if resp else None
                 else:
-                    # Fallback to sync call in a thread if async not available
-                    import asyncio
+                    enhanced_prompt = user_text
 
-                    loop = asyncio.get_running_loop()
-                    resp = await loop.run_in_executor(None, _gemini_model.generate_content, enhanced_prompt)
-                    response_text = getattr(resp, 'text', None) if resp else None
-            except Exception as e:
-                response_text = f"Gemini call failed: {e}"
+            # TaskGroup sở hữu lời gọi Gemini: execute() bị huỷ thì lời gọi bị huỷ theo,
+            # không còn task mồ côi chạy tiếp sau khi request đã kết thúc
+            call = None
+            try:
+                async with asyncio.TaskGroup() as tg:
+                    call = tg.create_task(_generate_or_error(enhanced_prompt, history))
+                    if task_id is not None:
+                        self._inflight[task_id] = call
+            finally:
+                if task_id is not None and call is not None and self._inflight.get(task_id) is call:
+                    del self._inflight[task_id]
+            if call.cancelled():
+                # cancel() đã huỷ lời gọi (và đã phát status 'canceled') -> dừng ở đây
+                return
+            response_text = call.result()
 
             if not response_text:
                 response_text = 'No response from Gemini.'
@@ -195,44 +865,20 @@ Hãy trả lời dựa trên ngữ cảnh và câu hỏi hiện tại."""
             # Thêm phản hồi của bot vào context
             memory.save_context({"input": user_text}, {"output": response_text})
 
-            msg = Message(
-                messageId=str(uuid4()),
-                role=Role.agent,
-                parts=[TextPart(text=response_text)],
-                taskId=getattr(context, 'task_id', None),
-                contextId=getattr(context, 'context_id', None),
-            )
-            maybe_awaitable = event_queue.enqueue_event(msg)
-            if inspect.isawaitable(maybe_awaitable):
-                await maybe_awaitable
+            await _emit(event_queue, task_id, context_id, response_text)
 
         except Exception as e:
             # Emit a failure message
-            msg = Message(
-                messageId=str(uuid4()),
-                role=Role.agent,
-                parts=[TextPart(text=f'Error: {e}')],
-                taskId=getattr(context, 'task_id', None),
-                contextId=getattr(context, 'context_id', None),
-            )
-            maybe_awaitable = event_queue.enqueue_event(msg)
-            if inspect.isawaitable(maybe_awaitable):
-                await maybe_awaitable
+            await _emit(event_queue, task_id, context_id, f'Error: {e}')
 
     async def cancel(self, context: RequestContext, event_queue: EventQueue) -> None:
+        task_id, context_id = _context_ids(context)
+        # Huỷ lời gọi Gemini đang chạy cho task này (nếu có)
+        call = self._inflight.pop(task_id, None) if task_id is not None else None
+        if call is not None and not call.done():
+            call.cancel()
         # Emit a canceled status update per A2A contract
-        task_id = getattr(context, 'task_id', None)
-        context_id = getattr(context, 'context_id', None) or ''
-        status = TaskStatus(state=TaskState.canceled)
-        evt = TaskStatusUpdateEvent(
-            taskId=task_id or '',
-            contextId=context_id,
-            status=status,
-            final=True,
-        )
-        maybe_awaitable = event_queue.enqueue_event(evt)
-        if inspect.isawaitable(maybe_awaitable):
-            await maybe_awaitable
+        await _enqueue(event_queue, _canceled_event(task_id, context_id))
 
 
 class WeatherAgentExecutor(AgentExecutor):
@@ -252,48 +898,8 @@ class WeatherAgentExecutor(AgentExecutor):
 
     def __init__(self):
         super().__init__()
-        # Instance-level references (mirror class cache)
-        self._vietnam_locations_cache = None
-        self._cache_timestamp = 0
-        self._cache_duration = self.CLASS_CACHE_DURATION
         self._initialization_task = None
         
-        # Fallback coordinates for major cities (backup)
-        self.MAJOR_CITIES_FALLBACK = {
-            'hà nội': (21.0285, 105.8542, 'Hà Nội'),
-            'ha noi': (21.0285, 105.8542, 'Hà Nội'),
-            'hồ chí minh': (10.8231, 106.6297, 'Hồ Chí Minh'),
-            'ho chi minh': (10.8231, 106.6297, 'Hồ Chí Minh'),
-            'tp hcm': (10.8231, 106.6297, 'Hồ Chí Minh'),
-            'đà nẵng': (16.0544, 108.2022, 'Đà Nẵng'),
-            'da nang': (16.0544, 108.2022, 'Đà Nẵng'),
-            'hải phòng': (20.8449, 106.6881, 'Hải Phòng'),
-            'hai phong': (20.8449, 106.6881, 'Hải Phòng'),
-            'cần thơ': (10.0452, 105.7469, 'Cần Thơ'),
-            'can tho': (10.0452, 105.7469, 'Cần Thơ'),
-            'quảng nam': (15.5394, 108.0191, 'Quảng Nam'),
-            'quang nam': (15.5394, 108.0191, 'Quảng Nam'),
-            'thừa thiên huế': (16.4637, 107.5909, 'Thừa Thiên Huế'),
-            'thua thien hue': (16.4637, 107.5909, 'Thừa Thiên Huế'),
-            'huế': (16.4637, 107.5909, 'Thừa Thiên Huế'),
-            'hue': (16.4637, 107.5909, 'Thừa Thiên Huế'),
-            'khánh hòa': (12.2388, 109.1967, 'Khánh Hòa'),
-            'khanh hoa': (12.2388, 109.1967, 'Khánh Hòa'),
-            'nha trang': (12.2388, 109.1967, 'Nha Trang'),
-            'lâm đồng': (11.9404, 108.4583, 'Lâm Đồng'),
-            'lam dong': (11.9404, 108.4583, 'Lâm Đồng'),
-            'đà lạt': (11.9404, 108.4583, 'Đà Lạt'),
-            'da lat': (11.9404, 108.4583, 'Đà Lạt'),
-            'bình dương': (11.1696, 106.6667, 'Bình Dương'),
-            'binh duong': (11.1696, 106.6667, 'Bình Dương'),
-            'đồng nai': (10.9574, 106.8426, 'Đồng Nai'),
-            'dong nai': (10.9574, 106.8426, 'Đồng Nai'),
-            'bà rịa vũng tàu': (10.5411, 107.2420, 'Bà Rịa Vũng Tàu'),
-            'ba ria vung tau': (10.5411, 107.2420, 'Bà Rịa Vũng Tàu'),
-            'vũng tàu': (10.3459, 107.0843, 'Vũng Tàu'),
-            'vung tau': (10.3459, 107.0843, 'Vũng Tàu'),
-        }
-        
         # Start initialization in background only if class cache is empty
         if not type(self).CLASS_LOCATIONS_CACHE:
             self._start_initialization()
@@ -301,132 +907,136 @@ class WeatherAgentExecutor(AgentExecutor):
     def _start_initialization(self):
         """Start background initialization of Vietnam locations."""
         try:
-            import asyncio
-            loop = asyncio.get_event_loop()
+            # Chỉ chạy khi đang có event loop; khởi tạo lúc import thì lifespan sẽ preload
+            loop = asyncio.get_running_loop()
             self._initialization_task = loop.create_task(self._initialize_vietnam_locations())
-            print("DEBUG: Started background initialization of Vietnam locations")
+            logger.debug("Started background initialization of Vietnam locations")
         except Exception as e:
-            print(f"DEBUG: Failed to start initialization: {e}")
+            logger.debug("Failed to start initialization: %s", e)
 
     async def _initialize_vietnam_locations(self):
         """Initialize Vietnam locations in background."""
         try:
             await self._fetch_vietnam_provinces()
-            print("DEBUG: Background initialization completed")
+            logger.debug("Background initialization completed")
         except Exception as e:
-            print(f"DEBUG: Background initialization failed: {e}")
+            logger.warning("Background initialization failed: %s", e)
 
-    async def _fetch_vietnam_provinces(self) -> Dict[str, tuple]:
+    async def _fetch_vietnam_provinces(self, use_file_cache: bool = True) -> Dict[str, tuple]:
         """Lấy danh sách tỉnh/thành Việt Nam từ API."""
-        print("DEBUG: Fetching Vietnam provinces from API...")
+        # Toạ độ tỉnh/thành gần như cố định -> dùng bản lưu trên đĩa nếu còn hạn
+        cached = _load_locations_file(_LOCATIONS_FILE, type(self).CLASS_CACHE_DURATION) if use_file_cache else None
+        if cached:
+            type(self).CLASS_LOCATIONS_CACHE = cached
+            type(self).CLASS_CACHE_TIMESTAMP = time.monotonic()
+            logger.debug("Loaded %s locations from %s", len(cached), _LOCATIONS_FILE)
+            return cached
+
+        logger.debug("Fetching Vietnam provinces from API...")
         
         try:
             # Sử dụng Open-Meteo geocoding API để lấy danh sách tỉnh/thành
-            async with httpx.AsyncClient(timeout=30) as client:
-                # Query cho các tỉnh/thành chính của Việt Nam
-                vietnam_queries = [
-                    "Hà Nội", "Hồ Chí Minh", "Đà Nẵng", "Hải Phòng", "Cần Thơ",
-                    "Quảng Nam", "Thừa Thiên Huế", "Khánh Hòa", "Lâm Đồng", 
-                    "Bình Dương", "Đồng Nai", "Bà Rịa Vũng Tàu", "Vũng Tàu",
-                    "Nghệ An", "Thanh Hóa", "Quảng Ninh", "Bắc Ninh", "Hải Dương",
-                    "Vĩnh Phúc", "Thái Nguyên", "Lào Cai", "Yên Bái", "Tuyên Quang",
-                    "Phú Thọ", "Bắc Giang", "Quảng Bình", "Quảng Trị", "Quảng Ngãi",
-                    "Bình Định", "Phú Yên", "Bình Thuận", "Ninh Thuận", "Bình Phước",
-                    "Tây Ninh", "Long An", "Tiền Giang", "Bến Tre", "Trà Vinh",
-                    "Vĩnh Long", "Đồng Tháp", "An Giang", "Kiên Giang", "Cà Mau",
-                    "Bạc Liêu", "Sóc Trăng", "Hậu Giang", "Bình Phước", "Tây Ninh"
-                ]
-                
-                locations = {}
+            client = _get_http_client()
+            # Query cho các tỉnh/thành chính của Việt Nam
+            vietnam_queries = [
+                "Hà Nội", "Hồ Chí Minh", "Đà Nẵng", "Hải Phòng", "Cần Thơ",
+                "Quảng Nam", "Thừa Thiên Huế", "Khánh Hòa", "Lâm Đồng", 
+                "Bình Dương", "Đồng Nai", "Bà Rịa Vũng Tàu", "Vũng Tàu",
+                "Nghệ An", "Thanh Hóa", "Quảng Ninh", "Bắc Ninh", "Hải Dương",
+                "Vĩnh Phúc", "Thái Nguyên", "Lào Cai", "Yên Bái", "Tuyên Quang",
+                "Phú Thọ", "Bắc Giang", "Quảng Bình", "Quảng Trị", "Quảng Ngãi",
+                "Bình Định", "Phú Yên", "Bình Thuận", "Ninh Thuận", "Bình Phước",
+                "Tây Ninh", "Long An", "Tiền Giang", "Bến Tre", "Trà Vinh",
+                "Vĩnh Long", "Đồng Tháp", "An Giang", "Kiên Giang", "Cà Mau",
+                "Bạc Liêu", "Sóc Trăng", "Hậu Giang", "Bình Phước", "Tây Ninh"
+            ]
                 
-                for query in vietnam_queries:
-                    try:
-                        params = {
-                            'name': query,
-                            'count': 5,
-                            'language': 'vi',
-                            'format': 'json',
-                        }
-                        
-                        r = await client.get(self.GEOCODE_URL, params=params)
-                        if r.status_code == 200:
-                            data = r.json()
-                            results = data.get('results') or []
-                            
-                            # Tìm kết quả Việt Nam
-                            vn_result = next((it for it in results if (it.get('country_code') or '').upper() == 'VN'), None)
-                            if vn_result:
-                                try:
-                                    lat = float(vn_result.get('latitude'))
-                                    lon = float(vn_result.get('longitude'))
-                                    name = vn_result.get('name') or query
-                                    
-                                    # Tạo multiple keys cho tên địa danh
-                                    keys = [
-                                        name.lower(),
-                                        self._strip_diacritics(name).lower(),
-                                        query.lower(),
-                                        self._strip_diacritics(query).lower()
-                                    ]
-                                    
-                                    for key in keys:
-                                        if key and key not in locations:
-                                            locations[key] = (lat, lon, name)
-                                    
-                                    print(f"DEBUG: Added {name} ({lat}, {lon})")
-                                    
-                                except (ValueError, TypeError) as e:
-                                    print(f"DEBUG: Error parsing coordinates for {query}: {e}")
-                                    continue
-                        
-                        # Thêm delay nhỏ để tránh rate limiting
-                        await asyncio.sleep(0.1)
-                        
-                    except Exception as e:
-                        print(f"DEBUG: Error fetching {query}: {e}")
-                        continue
+            # Gửi đồng thời, semaphore giới hạn số request song song để tránh rate limiting
+            # (TaskGroup: warmup bị huỷ lúc shutdown thì các request con cũng bị huỷ theo)
+            sem = asyncio.Semaphore(_PROVINCE_FETCH_CONCURRENCY)
+            async with asyncio.TaskGroup() as tg:
+                tasks = [
+                    tg.create_task(self._fetch_province(client, query, sem))
+                    for query in dict.fromkeys(vietnam_queries)
+                ]
+
+            # Gộp theo đúng thứ tự query, key xuất hiện trước được giữ
+            locations = {}
+            for task in tasks:
+                for key, value in task.result():
+                    if key and key not in locations:
+                        locations[key] = value
                 
-                # Merge với fallback cities
-                all_locations = {**self.MAJOR_CITIES_FALLBACK, **locations}
+            # Merge với fallback cities
+            all_locations = {**_FALLBACK_LOCATIONS, **locations}
                 
-                # Update class-level cache and instance mirror
-                now_ts = asyncio.get_event_loop().time()
-                type(self).CLASS_LOCATIONS_CACHE = all_locations
-                type(self).CLASS_CACHE_TIMESTAMP = now_ts
-                self._vietnam_locations_cache = all_locations
-                self._cache_timestamp = now_ts
+            # Update class-level cache
+            type(self).CLASS_LOCATIONS_CACHE = all_locations
+            type(self).CLASS_CACHE_TIMESTAMP = time.monotonic()
+            if locations:
+                _save_locations_file(_LOCATIONS_FILE, all_locations)
                 
-                print(f"DEBUG: Successfully fetched {len(all_locations)} locations")
-                return all_locations
+            logger.debug("Successfully fetched %s locations", len(all_locations))
+            return all_locations
                 
         except Exception as e:
-            print(f"DEBUG: Error fetching Vietnam provinces: {e}")
+            logger.warning("Error fetching Vietnam provinces: %s", e)
             # Fallback to static mapping
-            now_ts = asyncio.get_event_loop().time()
-            type(self).CLASS_LOCATIONS_CACHE = self.MAJOR_CITIES_FALLBACK
-            type(self).CLASS_CACHE_TIMESTAMP = now_ts
-            self._vietnam_locations_cache = self.MAJOR_CITIES_FALLBACK
-            self._cache_timestamp = now_ts
-            return self.MAJOR_CITIES_FALLBACK
+            type(self).CLASS_LOCATIONS_CACHE = _FALLBACK_LOCATIONS
+            type(self).CLASS_CACHE_TIMESTAMP = time.monotonic()
+            return _FALLBACK_LOCATIONS
+
+    async def _fetch_province(self, client: httpx.AsyncClient, query: str,
+                              sem: asyncio.Semaphore) -> List[tuple]:
+        """Geocode một tỉnh/thành, trả về các cặp (key, (lat, lon, name)); lỗi -> []."""
+        params = {
+            'name': query,
+            'count': 5,
+            'language': 'vi',
+            'format': 'json',
+        }
+        try:
+            async with sem:
+                r = await client.get(self.GEOCODE_URL, params=params, timeout=30)
+            if r.status_code != 200:
+                return []
+            data = json_loads(r.content)
+            results = data.get('results') or []
+
+            # Tìm kết quả Việt Nam
+            vn_result = next((it for it in results if (it.get('country_code') or '').upper() == 'VN'), None)
+            if not vn_result:
+                return []
+            try:
+                lat = float(vn_result.get('latitude'))
+                lon = float(vn_result.get('longitude'))
+                name = vn_result.get('name') or query
+            except (ValueError, TypeError) as e:
+                logger.debug("Error parsing coordinates for %s: %s", query, e)
+                return []
+
+            logger.debug("Added %s (%s, %s)", name, lat, lon)
+            # Tạo multiple keys cho tên địa danh
+            value = (lat, lon, name)
+            return [
+                (name.lower(), value),
+                (_strip_diacritics(name).lower(), value),
+                (query.lower(), value),
+                (_strip_diacritics(query).lower(), value),
+            ]
+        except Exception as e:
+            logger.debug("Error fetching %s: %s", query, e)
+            return []
 
     async def _get_vietnam_locations(self) -> Dict[str, tuple]:
         """Lấy danh sách tỉnh/thành Việt Nam (cached)."""
-        current_time = asyncio.get_event_loop().time()
-        
-        # Prefer class-level cache first
-        if (type(self).CLASS_LOCATIONS_CACHE and
-            current_time - type(self).CLASS_CACHE_TIMESTAMP < type(self).CLASS_CACHE_DURATION):
-            print("DEBUG: Using cached Vietnam locations (class-level)")
-            return type(self).CLASS_LOCATIONS_CACHE
-
-        # Fallback to instance cache
-        if (self._vietnam_locations_cache is not None and 
-            current_time - self._cache_timestamp < self._cache_duration):
-            print("DEBUG: Using cached Vietnam locations (instance-level)")
-            return self._vietnam_locations_cache
+        cls = type(self)
+        if cls.CLASS_LOCATIONS_CACHE and time.monotonic() - cls.CLASS_CACHE_TIMESTAMP < cls.CLASS_CACHE_DURATION:
+            logger.debug("Using cached Vietnam locations (class-level)")
+            return cls.CLASS_LOCATIONS_CACHE
         
         # Nếu cache expired hoặc chưa có, fetch từ API
-        print("DEBUG: Cache expired or not available, fetching from API...")
+        logger.debug("Cache expired or not available, fetching from API...")
         return await self._fetch_vietnam_provinces()
 
     @classmethod
@@ -437,47 +1047,51 @@ class WeatherAgentExecutor(AgentExecutor):
 
     async def _refresh_locations_cache(self):
         """Refresh cache manually."""
-        print("DEBUG: Manually refreshing locations cache...")
-        self._vietnam_locations_cache = None
-        self._cache_timestamp = 0
-        await self._fetch_vietnam_provinces()
+        logger.debug("Manually refreshing locations cache...")
+        type(self).CLASS_CACHE_TIMESTAMP = 0.0
+        await self._fetch_vietnam_provinces(use_file_cache=False)
 
     def _strip_diacritics(self, s: str) -> str:
-        nfkd = unicodedata.normalize('NFKD', s)
-        return ''.join(ch for ch in nfkd if not unicodedata.combining(ch))
+        return _strip_diacritics(s)
 
-    async def _extract_location(self, text: str) -> Optional[str]:
+    async def _extract_location(self, text: str) -> List[str]:
+        """Trích xuất các địa danh người dùng hỏi (vd: "Hà Nội và Đà Nẵng" -> 2 địa danh)."""
         original = (text or '').strip()
         if not original:
-            return None
-        lowered = original.lower()
+            return []
 
         # Take text after the last weather keyword if present
         candidate = original
-        for kw in ['thời tiết', 'thoi tiet', 'weather', 'nhiệt độ', 'nhiet do']:
-            if kw in lowered:
-                idx = lowered.rfind(kw)
-                candidate = original[idx + len(kw):]
-                break
-
-        # Remove punctuation
-        candidate = re.sub(r'[\.,!?;:]+', ' ', candidate)
-        candidate = candidate.strip()
-
-        # Remove common trailing time words
-        candidate = re.sub(r'\b(hôm nay|hom nay|hiện tại|hien tai)\b', '', candidate, flags=re.IGNORECASE).strip()
-
-        print(f"DEBUG: Extracted location: '{candidate}' from '{original}'")
-        return candidate or None
+        last_kw = _last_weather_keyword(original)
+        if last_kw is not None:
+            candidate = original[last_kw.end():]
+
+        locations: List[str] = []
+        for part in _LOCATION_SEP_RE.split(candidate):
+            # Remove punctuation
+            part = _PUNCT_RE.sub(' ', part).strip()
+            # Remove common trailing time words
+            part = _TIME_WORDS_RE.sub('', part).strip()
+            if part and part not in locations:
+                locations.append(part)
+
+        logger.debug("Extracted locations: %s from '%s'", locations, original)
+        return locations
 
     async def _normalize_location_with_llm(self, location: str) -> str:
         """Sử dụng LLM để chuẩn hóa tên địa danh."""
-        if not location.strip():
+        if len(location.strip()) < 2:
             return location
+
+        # Tên đã chuẩn hóa trước đó (kể cả khác hoa/thường) -> không gọi LLM lại
+        norm_key = _normalize_key(location)[0]
+        cached = _NORM_CACHE.get(norm_key)
+        if cached is not _MISSING:
+            return cached
             
         global _gemini_model
         if _gemini_model is None:
-            print(f"DEBUG: No Gemini model available, returning original: '{location}'")
+            logger.debug("No Gemini model available, returning original: '%s'", location)
             return location
             
         try:
@@ -504,83 +1118,65 @@ Tên địa danh chuẩn:
             # Prefer async API if available
             response_text = None
             try:
-                generate_content_async = getattr(_gemini_model, 'generate_content_async', None)
-                if callable(generate_content_async):
-                    resp = await generate_content_async(prompt)
-                    response_text = getattr(resp, 'text', None) if resp else None
-                else:
-                    # Fallback to sync call in a thread if async not available
-                    import asyncio
-                    loop = asyncio.get_running_loop()
-                    resp = await loop.run_in_executor(None, _gemini_model.generate_content, prompt)
-                    response_text = getattr(resp, 'text', None) if resp else None
+                response_text = await _generate_text(prompt)
             except Exception as e:
-                print(f"DEBUG: LLM normalization failed: {e}")
+                logger.debug("LLM normalization failed: %s", e)
                 return location
 
             if response_text:
                 normalized = response_text.strip().strip('"').strip("'")
-                print(f"DEBUG: LLM normalized '{location}' → '{normalized}'")
+                logger.debug("LLM normalized '%s' → '%s'", location, normalized)
+                _NORM_CACHE.set(norm_key, normalized)
                 return normalized
             else:
-                print(f"DEBUG: LLM returned empty response for '{location}'")
+                logger.debug("LLM returned empty response for '%s'", location)
                 
         except Exception as e:
-            print(f"DEBUG: LLM normalization error: {e}")
+            logger.debug("LLM normalization error: %s", e)
             
         return location
 
-    def _test_fallback_mapping(self):
-        """Test fallback mapping functionality."""
-        print("=== TESTING FALLBACK MAPPING ===")
-        test_cases = ["Quảng Nam", "QUảng Nam", "quảng nam", "QUANG NAM"]
-        
-        # Use fallback cities for testing
-        locations = self.MAJOR_CITIES_FALLBACK
-        
-        for test in test_cases:
-            location_lower = test.lower().strip()
-            print(f"Test: '{test}' → '{location_lower}'")
-            if location_lower in locations:
-                lat, lon, name = locations[location_lower]
-                print(f"  ✅ Found: {name} at ({lat}, {lon})")
-            else:
-                print(f"  ❌ Not found")
-                # Check if it's a substring match
-                for key in locations.keys():
-                    if location_lower in key or key in location_lower:
-                        print(f"  🔍 Similar key found: '{key}'")
-        print("=== END TEST ===")
-
     async def _geocode(self, location: str) -> Optional[tuple[float, float, str]]:
-        print(f"DEBUG: Geocoding location: '{location}'")
+        key = _normalize_key(location)[1]
+        cached = _GEOCODE_CACHE.get(key)
+        if cached is not _MISSING:
+            logger.debug("Geocode cache hit for '%s'", location)
+            return cached
+        coords = await self._geocode_uncached(location)
+        _GEOCODE_CACHE.set(key, coords, ttl=None if coords else _GEOCODE_NEGATIVE_TTL)
+        return coords
+
+    async def _geocode_uncached(self, location: str) -> Optional[tuple[float, float, str]]:
+        logger.debug("Geocoding location: '%s'", location)
+        
+        # Lấy danh sách locations động
+        vietnam_locations = await self._get_vietnam_locations()
         
-        # Test fallback mapping first
-        self._test_fallback_mapping()
+        # Địa danh phổ biến đã có toạ độ (có dấu hoặc không dấu) -> trả ngay, không cần gọi LLM chuẩn hóa
+        lk, lk_nd = _normalize_key(location)
+        known = vietnam_locations.get(lk) or vietnam_locations.get(lk_nd)
+        if known:
+            logger.debug("Found '%s' in known locations, skipping LLM normalization", location)
+            return known
         
         # Chuẩn hóa tên địa danh bằng LLM
         normalized_location = await self._normalize_location_with_llm(location)
-        print(f"DEBUG: After LLM normalization: '{normalized_location}'")
-        
-        # Lấy danh sách locations động
-        vietnam_locations = await self._get_vietnam_locations()
+        logger.debug("After LLM normalization: '%s'", normalized_location)
         
         # Check fallback mapping first
         location_lower = normalized_location.lower().strip()
-        print(f"DEBUG: Checking dynamic locations for: '{location_lower}'")
-        print(f"DEBUG: Available keys: {list(vietnam_locations.keys())[:10]}...")  # Show first 10 keys
+        logger.debug("Checking dynamic locations for: '%s'", location_lower)
         
         if location_lower in vietnam_locations:
             lat, lon, name = vietnam_locations[location_lower]
-            print(f"DEBUG: Found in dynamic locations: {name} at ({lat}, {lon})")
+            logger.debug("Found in dynamic locations: %s at (%s, %s)", name, lat, lon)
             return (lat, lon, name)
         else:
-            print(f"DEBUG: Not found in dynamic locations")
+            logger.debug("Not found in dynamic locations")
             # Try fuzzy matching
-            for key in vietnam_locations.keys():
+            for key, (lat, lon, name) in vietnam_locations.items():
                 if location_lower in key or key in location_lower:
-                    lat, lon, name = vietnam_locations[key]
-                    print(f"DEBUG: Fuzzy match found: '{key}' → {name} at ({lat}, {lon})")
+                    logger.debug("Fuzzy match found: '%s' → %s at (%s, %s)", key, name, lat, lon)
                     return (lat, lon, name)
         
         # Try multiple variants: original, normalized, without diacritics
@@ -588,147 +1184,306 @@ Tên địa danh chuẩn:
         if normalized_location != location:
             queries.append(location)  # Keep original as backup
             
-        no_diac = self._strip_diacritics(normalized_location)
+        no_diac = _strip_diacritics(normalized_location)
         if no_diac and no_diac != normalized_location:
             queries.append(no_diac)
         
-        print(f"DEBUG: Trying queries: {queries}")
-
-        async with httpx.AsyncClient(timeout=10) as client:
-            for q in queries:
-                params = {
-                    'name': q,
-                    'count': 10,  # Tăng số lượng kết quả
-                    'language': 'vi',
-                    'format': 'json',
-                }
-                print(f"DEBUG: Querying with: {q}")
-                r = await client.get(self.GEOCODE_URL, params=params)
-                if r.status_code != 200:
-                    print(f"DEBUG: HTTP {r.status_code} for query '{q}'")
-                    continue
-                data = r.json()
-                results = data.get('results') or []
-                print(f"DEBUG: Found {len(results)} results for '{q}'")
-                
-                if not results:
+        logger.debug("Trying queries: %s", queries)
+
+        client = _get_http_client()
+        # Các biến thể độc lập nhau -> gửi đồng thời. Chọn theo thứ tự ưu tiên kết quả
+        # đầu tiên ở Việt Nam; không biến thể nào ra Việt Nam thì lấy kết quả đầu tiên
+        tasks = [
+            asyncio.create_task(self._geocode_one(client, q, normalized_location))
+            for q in dict.fromkeys(queries)
+        ]
+        first = None
+        try:
+            for task in tasks:
+                found = await task
+                if not found:
                     continue
-                
-                # Log all results for debugging
-                for i, result in enumerate(results[:3]):  # Log first 3 results
-                    print(f"DEBUG: Result {i+1}: {result.get('name')} ({result.get('country_code')})")
-                
-                # Prefer Vietnam results
-                vn = next((it for it in results if (it.get('country_code') or '').upper() == 'VN'), None)
-                item = vn or results[0]
-                try:
-                    coords = (
-                        float(item.get('latitude')),
-                        float(item.get('longitude')),
-                        item.get('name') or normalized_location,
-                    )
-                    print(f"DEBUG: Selected: {coords[2]} at ({coords[0]}, {coords[1]})")
+                coords, is_vn = found
+                if is_vn:
                     return coords
-                except Exception as e:
-                    print(f"DEBUG: Error parsing result: {e}")
-                    continue
+                if first is None:
+                    first = coords
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if first is not None:
+            return first
         
-        print(f"DEBUG: No results found for '{location}'")
+        logger.debug("No results found for '%s'", location)
         return None
 
+    async def _geocode_one(self, client: httpx.AsyncClient, q: str,
+                           fallback_name: str) -> Optional[tuple[tuple[float, float, str], bool]]:
+        """Geocode một biến thể tên địa danh, ưu tiên kết quả ở Việt Nam.
+
+        Trả về (toạ độ, có phải kết quả ở Việt Nam không) hoặc None.
+        """
+        params = {
+            'name': q,
+            'count': 10,  # Tăng số lượng kết quả
+            'language': 'vi',
+            'format': 'json',
+        }
+        logger.debug("Querying with: %s", q)
+        r = await client.get(self.GEOCODE_URL, params=params)
+        if r.status_code != 200:
+            logger.debug("HTTP %s for query '%s'", r.status_code, q)
+            return None
+        data = json_loads(r.content)
+        results = data.get('results') or []
+        logger.debug("Found %s results for '%s'", len(results), q)
+            
+        if not results:
+            return None
+            
+        # Log all results for debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, result in enumerate(results[:3]):  # Log first 3 results
+                logger.debug("Result %d: %s (%s)", i + 1, result.get('name'), result.get('country_code'))
+            
+        # Prefer Vietnam results
+        vn = next((it for it in results if (it.get('country_code') or '').upper() == 'VN'), None)
+        item = vn or results[0]
+        try:
+            coords = (
+                float(item.get('latitude')),
+                float(item.get('longitude')),
+                item.get('name') or fallback_name,
+            )
+            logger.debug("Selected: %s at (%s, %s)", coords[2], coords[0], coords[1])
+            return coords, vn is not None
+        except Exception as e:
+            logger.debug("Error parsing result: %s", e)
+            return None
+
     async def _get_weather(self, lat: float, lon: float) -> Optional[str]:
+        key = (round(lat, 2), round(lon, 2))
+        cached = _WEATHER_CACHE.get(key)
+        if cached is not _MISSING:
+            return cached
+        weather = await self._fetch_weather(lat, lon)
+        if weather:
+            _WEATHER_CACHE.set(key, weather)
+        return weather
+
+    async def _fetch_weather(self, lat: float, lon: float) -> Optional[str]:
         params = {
             'latitude': lat,
             'longitude': lon,
             'current': 'temperature_2m,weather_code',
             'timezone': 'auto',  # use location's local timezone from API
         }
-        async with httpx.AsyncClient(timeout=10) as client:
-            r = await client.get(self.WEATHER_URL, params=params)
-            if r.status_code != 200:
-                return None
-            j = r.json()
-            cur = (j or {}).get('current') or {}
-            temp = cur.get('temperature_2m')
-            code = cur.get('weather_code')
-            api_time = cur.get('time')  # ISO 8601; already in local TZ per 'timezone=auto'
-            tz_name = (j or {}).get('timezone')
-            # Map a few common codes; otherwise show code number
-            codes = {
-                0: 'Trời quang',
-                1: 'Trời quang phần lớn',
-                2: 'Có mây rải rác',
-                3: 'Nhiều mây',
-                45: 'Sương mù',
-                51: 'Mưa phùn nhẹ',
-                61: 'Mưa nhẹ',
-                63: 'Mưa vừa',
-                65: 'Mưa to',
-                71: 'Tuyết nhẹ',
-                80: 'Mưa rào nhẹ',
-                95: 'Dông',
-            }
-            desc = codes.get(code, f'Mã thời tiết {code}')
-            if temp is None:
-                return None
-            # Compose source and API-provided local time only
-            source = 'open-meteo.com'
-            suffix_parts = []
-            if api_time:
-                if tz_name:
-                    suffix_parts.append(f'Thời gian: {api_time} ({tz_name})')
-                else:
-                    suffix_parts.append(f'Thời gian: {api_time}')
-            suffix_parts.append(f'Nguồn: {source}')
-            suffix = ' | '.join(suffix_parts)
-            return f'Nhiệt độ hiện tại: {temp}°C — {desc}. ({suffix})'
+        client = _get_http_client()
+        r = await client.get(self.WEATHER_URL, params=params)
+        if r.status_code != 200:
+            return None
+        j = json_loads(r.content)
+        cur = (j or {}).get('current') or {}
+        temp = cur.get('temperature_2m')
+        code = cur.get('weather_code')
+        api_time = cur.get('time')  # ISO 8601; already in local TZ per 'timezone=auto'
+        tz_name = (j or {}).get('timezone')
+        # Map a few common codes; otherwise show code number
+        desc = _weather_code_desc(code)
+        if temp is None:
+            return None
+        # Compose source and API-provided local time only
+        source = 'open-meteo.com'
+        suffix_parts = []
+        if api_time:
+            if tz_name:
+                suffix_parts.append(f'Thời gian: {api_time} ({tz_name})')
+            else:
+                suffix_parts.append(f'Thời gian: {api_time}')
+        suffix_parts.append(f'Nguồn: {source}')
+        suffix = ' | '.join(suffix_parts)
+        return f'Nhiệt độ hiện tại: {temp}°C — {desc}. ({suffix})'
 
     async def execute(self, context: RequestContext, event_queue: EventQueue) -> None:
-        user_text = ''
-        try:
-            user_text = context.get_user_input() or ''
-        except Exception:
-            pass
-
-        location_query = await self._extract_location(user_text)
-        if not location_query or len(location_query.split()) < 1:
+        await self._execute_with_text(_user_input(context), context, event_queue)
+
+    async def _execute_with_text(self, user_text: str, context: RequestContext, event_queue: EventQueue) -> None:
+        """Xử lý request với text người dùng đã được đọc sẵn (router truyền vào)."""
+        task_id, context_id = _context_ids(context)
+        user_text = user_text.strip()
+        location_queries = await self._extract_location(user_text)
+        if not location_queries:
             reply = 'Bạn muốn xem thời tiết ở tỉnh/thành nào? Vui lòng nêu rõ địa danh.'
+        elif len(location_queries) == 1:
+            reply = await self._weather_reply(location_queries[0])
         else:
-            loc = await self._geocode(location_query)
-            if not loc:
-                reply = 'Không tìm thấy địa danh. Vui lòng cung cấp tên tỉnh/thành cụ thể.'
-            else:
-                lat, lon, place = loc
-                weather = await self._get_weather(lat, lon)
-                if weather:
-                    reply = f'Thời tiết tại {place}: {weather}'
-                else:
-                    reply = 'Không lấy được dữ liệu thời tiết. Vui lòng thử lại sau.'
-
-        msg = Message(
-            messageId=str(uuid4()),
-            role=Role.agent,
-            parts=[TextPart(text=reply)],
-            taskId=getattr(context, 'task_id', None),
-            contextId=getattr(context, 'context_id', None),
-        )
-        maybe_awaitable = event_queue.enqueue_event(msg)
-        if inspect.isawaitable(maybe_awaitable):
-            await maybe_awaitable
+            # Nhiều địa danh: geocode + lấy thời tiết cho từng nơi song song
+            replies = await asyncio.gather(
+                *(self._weather_reply(q, multi=True) for q in location_queries)
+            )
+            reply = '\n'.join(replies)
+
+        # Lưu lượt hỏi-đáp vào memory của phiên (một lần ghi cho cả input và output)
+        memory = get_or_create_memory(context_id if context_id is not None else 'default')
+        memory.save_context({"input": user_text}, {"output": reply})
+
+        await _emit(event_queue, task_id, context_id, reply)
+
+    async def _weather_reply(self, location_query: str, multi: bool = False) -> str:
+        """Geocode một địa danh rồi lấy thời tiết, trả về câu trả lời cho địa danh đó."""
+        loc = await self._geocode(location_query)
+        if not loc:
+            if multi:
+                return f"Không tìm thấy địa danh '{location_query}'."
+            return 'Không tìm thấy địa danh. Vui lòng cung cấp tên tỉnh/thành cụ thể.'
+        lat, lon, place = loc
+        weather = await self._get_weather(lat, lon)
+        if weather:
+            return f'Thời tiết tại {place}: {weather}'
+        if multi:
+            return f'Không lấy được dữ liệu thời tiết tại {place}.'
+        return 'Không lấy được dữ liệu thời tiết. Vui lòng thử lại sau.'
 
     async def cancel(self, context: RequestContext, event_queue: EventQueue) -> None:
-        task_id = getattr(context, 'task_id', None)
-        context_id = getattr(context, 'context_id', None) or ''
-        status = TaskStatus(state=TaskState.canceled)
-        evt = TaskStatusUpdateEvent(
-            taskId=task_id or '',
-            contextId=context_id,
-            status=status,
-            final=True,
-        )
-        maybe_awaitable = event_queue.enqueue_event(evt)
-        if inspect.isawaitable(maybe_awaitable):
-            await maybe_awaitable
+        await _enqueue(event_queue, _canceled_event(*_context_ids(context)))
+
+
+# Gom các lời phân loại intent đồng thời thành một lời gọi Gemini khi tải cao
+INTENT_BATCH_MAX = 16
+INTENT_BATCH_WINDOW_MS = 15
+# Chỉ gom lô khi đã có ít nhất chừng này lời phân loại đang chờ; tải thấp gọi lẻ
+INTENT_BATCH_MIN_PENDING = 4
+
+_BATCH_INTENT_PROMPT = STATIC_INTENT_SYSTEM.replace(
+    'Chỉ trả đúng 1 từ (weather hoặc chat).',
+    'Đầu vào là một mảng JSON, mỗi phần tử là một câu hỏi (có thể kèm ngữ cảnh).\n'
+    'Chỉ trả về một mảng JSON các nhãn ("weather" hoặc "chat") theo đúng thứ tự, '
+    'không giải thích.',
+)
+# Lô trả về mảng tối đa INTENT_BATCH_MAX nhãn ("weather", ~4 token mỗi nhãn kể cả
+# dấu phẩy/ngoặc) -> cap theo cỡ lô thay vì cap 1 nhãn của lời gọi lẻ
+_INTENT_BATCH_GENERATION_CONFIG = {
+    'max_output_tokens': int(os.environ.get('INTENT_BATCH_MAX_OUTPUT_TOKENS', INTENT_BATCH_MAX * 5)),
+    'temperature': 0.0,
+}
+_JSON_ARRAY_RE = re.compile(r'\[.*\]', re.DOTALL)
+
+async def _generate_intent_batch(payload: str) -> Optional[str]:
+    """Gọi model phân loại theo lô (payload là mảng JSON các prompt).
+
+    Prompt lô hầu như không lặp lại nên không qua _RESPONSE_CACHE / single-flight,
+    tránh đẩy các entry chat/intent hữu ích ra khỏi cache.
+    """
+    if _intent_batch_generate is None:
+        raise RuntimeError('Gemini model is not initialized')
+    async with _gemini_semaphore:
+        resp = await _intent_batch_generate(payload)
+    return resp if isinstance(resp, str) else getattr(resp, 'text', None) if resp else None
+
+class _BatchClassifier:
+    """Micro-batch cho phân loại intent.
+
+    Khi có nhiều lời phân loại cùng lúc, các prompt đến trong cửa sổ
+    INTENT_BATCH_WINDOW_MS được gửi chung một lời gọi Gemini (mảng JSON vào, mảng
+    nhãn ra). Tải thấp thì gọi lẻ như bình thường; lô chỉ có một prompt hoặc
+    prompt mà lô không phân loại được thì gọi lẻ ngay trong lô, caller không phải
+    gọi lại.
+    """
+
+    def __init__(self) -> None:
+        self._queue: Optional[asyncio.Queue] = None
+        self._drain_task: Optional[asyncio.Task] = None
+        # Các lô đang gọi Gemini (giữ tham chiếu để task không bị GC)
+        self._batches: set = set()
+        self.pending = 0
+
+    async def classify(self, prompt: str) -> Optional[str]:
+        """Trả về text phân loại cho prompt (nhãn hoặc câu trả lời thô của Gemini)."""
+        self.pending += 1
+        try:
+            if self.pending >= INTENT_BATCH_MIN_PENDING:
+                # None: cả lời gọi lẻ dự phòng cũng lỗi -> caller coi như không có phản hồi
+                return await self._enqueue(prompt)
+            return await _generate_text(prompt, intent=True)
+        finally:
+            self.pending -= 1
+
+    def _enqueue(self, prompt: str) -> "asyncio.Future[Optional[str]]":
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._drain_task is None or self._drain_task.done():
+            self._drain_task = asyncio.get_running_loop().create_task(self._drain_loop())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((future, prompt))
+        return future
+
+    async def _drain_loop(self) -> None:
+        """Gom tối đa INTENT_BATCH_MAX prompt hoặc chờ hết cửa sổ rồi gửi một lô."""
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + INTENT_BATCH_WINDOW_MS / 1000
+            while len(batch) < INTENT_BATCH_MAX:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            if len(batch) == 1:
+                # Không có prompt nào khác trong cửa sổ -> gọi lẻ, không bọc thành lô
+                task = loop.create_task(self._classify_one(*batch[0]))
+            else:
+                task = loop.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch: List[tuple]) -> None:
+        labels: List[Optional[str]] = [None] * len(batch)
+        try:
+            labels = await self._classify_batch([prompt for _, prompt in batch])
+        except Exception as e:
+            logger.debug("Intent batch of %d failed: %s", len(batch), e)
+        retry = []
+        for (future, prompt), label in zip(batch, labels):
+            if label is None:
+                retry.append(self._classify_one(future, prompt))
+            elif not future.done():
+                future.set_result(label)
+        # Lô lỗi / nhãn không hợp lệ -> gọi lẻ song song cho các prompt còn thiếu
+        if retry:
+            await asyncio.gather(*retry)
+
+    @staticmethod
+    async def _classify_one(future: "asyncio.Future[Optional[str]]", prompt: str) -> None:
+        if future.done():  # Caller đã bị huỷ -> không tốn một lời gọi Gemini
+            return
+        try:
+            label = await _generate_text(prompt, intent=True)
+        except Exception as e:
+            logger.debug("Intent classification failed: %s", e)
+            label = None
+        if not future.done():
+            future.set_result(label)
+
+    async def _classify_batch(self, prompts: List[str]) -> List[Optional[str]]:
+        response_text = await _generate_intent_batch(json_dumps(prompts))
+        match = _JSON_ARRAY_RE.search(response_text or '')
+        if match is None:
+            return [None] * len(prompts)
+        parsed = json_loads(match.group(0))
+        if not isinstance(parsed, list) or len(parsed) != len(prompts):
+            return [None] * len(prompts)
+        return [
+            label if label in _INTENT_LABELS else None
+            for label in (str(item).strip().lower() for item in parsed)
+        ]
+
+_intent_batcher = _BatchClassifier()
 
 
 class IntentRouterAgentExecutor(AgentExecutor):
@@ -740,116 +1495,122 @@ class IntentRouterAgentExecutor(AgentExecutor):
         self._intent_model = None  # Có thể cache Gemini hoặc model khác
         # Lưu intent gần nhất để wrapper có thể đọc
         self.last_intent: str | None = None
+        # task_id -> agent con đang xử lý task đó (để cancel đúng agent)
+        self._dispatch: Dict[str, AgentExecutor] = {}
 
     async def _classify_intent(self, text: str, context_id: str = 'default') -> str:
         """Phân loại intent bằng Gemini API với context."""
-        if not text.strip():
+        normalized = text.strip().lower()
+        if not normalized:
             return "chat"
 
-        global _gemini_model
+        # Có từ khóa thời tiết rõ ràng -> không cần gọi Gemini để phân loại
+        if _WEATHER_KW_RE.search(text) is not None:
+            return "weather"
+        # Từ khóa chỉ thuộc một bên (thời tiết hoặc chào hỏi) -> cũng quyết định luôn
+        quick = _prefilter_intent(text)
+        if quick is not None:
+            return quick
+
+        cache_key = (context_id, normalized)
+        cached = _INTENT_CACHE.get(cache_key)
+        if cached is not _MISSING:
+            INTENT_CACHE_STATS['hits'] += 1
+            return cached
+        INTENT_CACHE_STATS['misses'] += 1
+
+        # Model được khởi tạo một lần lúc startup (lifespan gọi get_gemini_model);
+        # chưa có (lỗi cấu hình) thì mặc định chat, không khởi tạo trong hot path
         if _gemini_model is None:
-            try:
-                import google.generativeai as genai
-                api_key = os.environ.get("GOOGLE_API_KEY") or os.environ.get("GEMINI_API_KEY")
-                if not api_key:
-                    return "chat"
-                genai.configure(api_key=api_key)
-                _gemini_model = genai.GenerativeModel("gemini-2.5-flash")
-            except Exception:
-                return "chat"
+            return "chat"
 
         # Lấy memory context cho phiên này
-        memory = get_or_create_memory(context_id)
-        history_text = memory.load_memory_variables({"input": text})['history']
+        history_text = _history_text(get_or_create_memory(context_id))
 
-        # Tạo prompt với context
+        # Chỉ gửi phần thay đổi; quy tắc phân loại nằm trong STATIC_INTENT_SYSTEM
         if history_text:
-            prompt = f"""
-Bạn là bộ phân loại intent thông minh.
-
-Ngữ cảnh trước đó:
-{history_text}
-
-Câu hỏi hiện tại: "{text}"
-
-Intent hợp lệ: [weather, chat]
-
-Quy tắc phân loại:
-- Nếu câu hỏi liên quan đến thời tiết, nhiệt độ, khí hậu, dự báo, mưa, nắng, gió, bão → trả "weather"
-- Nếu câu hỏi về địa danh, tỉnh, thành phố mà có thể liên quan đến thời tiết → trả "weather"
-- Nếu câu hỏi chung chung, không liên quan thời tiết → trả "chat"
-- Nếu câu hỏi tiếp tục cuộc trò chuyện trước đó → trả "chat"
-
-Chỉ trả đúng 1 từ (weather hoặc chat).
-"""
+            prompt = f'Ngữ cảnh trước đó:\n{history_text}\n\nCâu hỏi hiện tại: "{text}"\n'
         else:
-            prompt = f"""
-Bạn là bộ phân loại intent. 
-Người dùng vừa nói: "{text}".
-Intent hợp lệ: [weather, chat].
-Nếu câu hỏi liên quan đến thời tiết, nhiệt độ, khí hậu, dự báo → trả "weather".
-Nếu không → trả "chat".
-Chỉ trả đúng 1 từ (weather hoặc chat).
-"""
+            prompt = f'Câu hỏi hiện tại: "{text}"\n'
 
         try:
             # Prefer async API if available
             response_text = None
             try:
-                generate_content_async = getattr(_gemini_model, 'generate_content_async', None)
-                if callable(generate_content_async):
-                    resp = await generate_content_async(prompt)
-                    response_text = getattr(resp, 'text', None) if resp else None
-                else:
-                    # Fallback to sync call in a thread if async not available
-                    import asyncio
-                    loop = asyncio.get_running_loop()
-                    resp = await loop.run_in_executor(None, _gemini_model.generate_content, prompt)
-                    response_text = getattr(resp, 'text', None) if resp else None
+                response_text = await _intent_batcher.classify(prompt)
             except Exception:
                 response_text = None
 
-            if response_text:
-                raw = response_text.strip().lower()
-                if "weather" in raw:
-                    return "weather"
-            return "chat"
+            if not response_text:
+                # Lỗi / không có phản hồi -> không cache, lượt sau thử lại
+                return "chat"
+            intent = "weather" if "weather" in response_text.strip().lower() else "chat"
+            _INTENT_CACHE.set(cache_key, intent)
+            return intent
         except Exception:
             return "chat"
 
+    def _needs_prefetch(self) -> bool:
+        """Danh sách địa danh của weather agent chưa nạp hoặc đã hết hạn."""
+        cls = type(self.weather)
+        return (not cls.CLASS_LOCATIONS_CACHE
+                or time.monotonic() - cls.CLASS_CACHE_TIMESTAMP >= cls.CLASS_CACHE_DURATION)
+
+    async def _speculative_prefetch(self) -> None:
+        """Chuẩn bị trước cho weather agent (HTTP client + danh sách địa danh).
+
+        Chạy song song với phân loại intent; lỗi được bỏ qua, agent tự nạp lại khi cần.
+        """
+        _get_http_client()
+        await self.weather._get_vietnam_locations()
+
     async def execute(self, context: RequestContext, event_queue: EventQueue) -> None:
-        text = ""
-        try:
-            text = context.get_user_input() or ""
-        except Exception:
-            pass
+        # Đọc input một lần rồi truyền xuống agent con, không đọc lại ở mỗi tầng
+        text = _user_input(context)
 
         # Lấy context_id cho phiên này
-        context_id = getattr(context, 'context_id', 'default')
+        task_id, context_id = _context_ids(context)
+        if context_id is None:
+            context_id = 'default'
         
-        # Lưu tin nhắn người dùng vào memory trước khi phân loại intent
-        memory = get_or_create_memory(context_id)
-        memory.save_context({"input": text}, {"output": ""})
-
-        # Phân loại intent với context
-        intent = await self._classify_intent(text, context_id)
-        print(f"Intent: {intent} (Context ID: {context_id})")
+        # Phân loại intent với context (chỉ đọc memory; agent con lưu cả lượt
+        # hỏi-đáp một lần khi đã có câu trả lời)
+        if not text or text.isspace():
+            # Input rỗng (vd: ping/health check) -> chat trả lời có sẵn, không phân
+            # loại, không đọc memory, không prefetch
+            intent = "chat"
+        elif self._needs_prefetch():
+            # Cache địa danh chưa sẵn sàng -> nạp song song trong lúc chờ phân loại
+            intent, _ = await asyncio.gather(
+                self._classify_intent(text, context_id),
+                self._speculative_prefetch(),
+                return_exceptions=True,
+            )
+            if isinstance(intent, BaseException):
+                raise intent
+        else:
+            intent = await self._classify_intent(text, context_id)
+        # Mỗi request đều qua đây -> log ở DEBUG (production chạy INFO nên bị lọc
+        # trước khi format); intent/context_id đi theo record dưới dạng field
+        logger.debug("intent_classified", extra={"intent": intent, "context_id": context_id})
         # Ghi lại intent để bên ngoài có thể đọc
         self.last_intent = intent
         
-        if intent == "weather":
-            await self.weather.execute(context, event_queue)
-        else:
-            await self.chat.execute(context, event_queue)
+        target = self.weather if intent == "weather" else self.chat
+        if task_id is None:
+            await target._execute_with_text(text, context, event_queue)
+            return
+        self._dispatch[task_id] = target
+        try:
+            await target._execute_with_text(text, context, event_queue)
+        finally:
+            self._dispatch.pop(task_id, None)
 
     async def cancel(self, context: RequestContext, event_queue: EventQueue) -> None:
-        # Huỷ trên cả 2 agent
-        try:
-            await self.weather.cancel(context, event_queue)
-        except Exception:
-            pass
+        # Chỉ huỷ agent đang xử lý task -> phát đúng một status update 'canceled'
+        target = self._dispatch.pop(context.task_id, None) or self.chat
         try:
-            await self.chat.cancel(context, event_queue)
+            await target.cancel(context, event_queue)
         except Exception:
             pass
 
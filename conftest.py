@@ -0,0 +1,4 @@
+"""
+Pytest cấu hình chung: file này nằm ở thư mục gốc để pytest thêm thư mục gốc vào
+sys.path, test import được các package của app (service, utils, agent_executor...)
+"""
@@ -7,6 +7,7 @@ from .run import (
     cleanup_all_services,
     get_postgres_pool,
     get_redis_client,
+    get_redis_binary_client,
     get_app_runner,
     ApplicationRunner
 )
@@ -16,6 +17,7 @@ __all__ = [
     'cleanup_all_services', 
     'get_postgres_pool',
     'get_redis_client',
+    'get_redis_binary_client',
     'get_app_runner',
     'ApplicationRunner'
 ]
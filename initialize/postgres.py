@@ -1,5 +1,6 @@
 import asyncpg
 import logging
+import os
 from typing import Optional, List, Dict, Any
 from contextlib import asynccontextmanager
 
@@ -8,6 +9,11 @@ logger = logging.getLogger(__name__)
 class PostgresInitializer:
     def __init__(self):
         self.pool: Optional[asyncpg.Pool] = None
+        # Kích thước pool: mỗi request ghi ít nhất một log conversation
+        self.min_size = int(os.getenv('POSTGRES_POOL_MIN', 2))
+        self.max_size = int(os.getenv('POSTGRES_POOL_MAX', min(32, (os.cpu_count() or 1) * 4)))
+        # Số prepared statement cache trên mỗi connection (INSERT/SELECT lặp lại)
+        self.statement_cache_size = int(os.getenv('POSTGRES_STATEMENT_CACHE', 1024))
         
     async def initialize(self) -> asyncpg.Pool:
         try:
@@ -17,20 +23,45 @@ class PostgresInitializer:
                 database='chatbot',
                 host='localhost',
                 port=5432,
-                min_size=10,  # Tăng min_size để có sẵn connections
-                max_size=50,  # Tăng max_size cho high load
+                min_size=self.min_size,
+                max_size=self.max_size,
                 command_timeout=30,  # Timeout cho commands
-                statement_cache_size=100,  # Cache prepared statements
+                statement_cache_size=self.statement_cache_size,  # Cache prepared statements
                 max_cached_statement_lifetime=300,  # Lifetime của cached statements
                 max_queries=50000,  # Reset connection sau số queries này
                 max_inactive_connection_lifetime=300.0,  # Close inactive connections
+                init=self._init_connection,  # Chạy một lần khi mở connection mới
                 setup=self._setup_connection  # Custom setup cho mỗi connection
             )
+            
+            # Test connection: startup lỗi ngay nếu không query được, thay vì để log
+            # conversation bị mất âm thầm lúc chạy
+            await self._test_connection()
             return self.pool
         except Exception as e:
             logger.error(f"Failed to initialize PostgreSQL connection pool: {str(e)}")
             raise
+
+    async def _test_connection(self):
+        """Test PostgreSQL connection"""
+        async with self.pool.acquire() as conn:
+            await conn.fetchval('SELECT 1')
+        logger.info("PostgreSQL connection successful")
+
+    async def _init_connection(self, conn):
+        # JSONB <-> dict/list: encode/decode bằng orjson ở dạng binary (byte version 1
+        # + JSON), dùng được cả cho query thường lẫn COPY binary.
+        # Import trong hàm để tránh vòng import initialize <-> utils
+        from utils.json_utils import json_dumps_bytes, json_loads
+        await conn.set_type_codec(
+            'jsonb',
+            encoder=lambda value: b'\x01' + json_dumps_bytes(value),
+            decoder=lambda data: json_loads(data[1:]),
+            schema='pg_catalog',
+            format='binary'
+        )
     async def _setup_connection(self, conn):
+        # SET SESSION bị pool RESET ALL khi trả connection -> phải đặt lại mỗi lần acquire
         # Tối ưu connection settings
         await conn.execute('''
             SET SESSION synchronous_commit = OFF;
@@ -8,23 +8,47 @@ logger = logging.getLogger(__name__)
 class RedisInitializer:
     def __init__(self):
         self.client: Optional[redis.Redis] = None
+        # Client trả về bytes (không decode UTF-8) cho value nhị phân như msgpack
+        self.binary_client: Optional[redis.Redis] = None
         self.host = os.getenv('REDIS_HOST', 'localhost')
         self.port = int(os.getenv('REDIS_PORT', 6379))
         self.password = os.getenv('REDIS_PASSWORD')
         self.db = int(os.getenv('REDIS_DB', 0))
+        self.max_connections = int(os.getenv('REDIS_MAX_CONNECTIONS', 64))
+        self.health_check_interval = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30))
+        # Thời gian chờ connection rảnh khi pool đã dùng hết (giây)
+        self.pool_timeout = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
     
     async def initialize(self):
         """Initialize Redis connection"""
         try:
-            # Create Redis client
-            self.client = redis.Redis(
+            # Create Redis client trên connection pool có kích thước rõ ràng. Blocking pool:
+            # khi đủ max_connections lệnh mới chờ connection rảnh thay vì báo lỗi
+            # "Too many connections" lúc tải cao
+            pool = redis.BlockingConnectionPool(
                 host=self.host,
                 port=self.port,
                 password=self.password,
                 db=self.db,
                 decode_responses=True,
-                max_connections=20
+                max_connections=self.max_connections,
+                health_check_interval=self.health_check_interval,
+                timeout=self.pool_timeout,
             )
+            # from_pool: client sở hữu pool, close() đóng luôn các connection
+            self.client = redis.Redis.from_pool(pool)
+            # Pool riêng vì decode_responses là thuộc tính của connection; connection
+            # chỉ được mở khi có lệnh nhị phân đầu tiên
+            self.binary_client = redis.Redis.from_pool(redis.BlockingConnectionPool(
+                host=self.host,
+                port=self.port,
+                password=self.password,
+                db=self.db,
+                decode_responses=False,
+                max_connections=self.max_connections,
+                health_check_interval=self.health_check_interval,
+                timeout=self.pool_timeout,
+            ))
             
             # Test connection
             await self._test_connection()
@@ -75,6 +99,8 @@ class RedisInitializer:
     
     async def close(self):
         """Close Redis connection"""
+        if self.binary_client:
+            await self.binary_client.close()
         if self.client:
             await self.client.close()
             logger.info("Redis connection closed")
\ No newline at end of file
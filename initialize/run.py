@@ -1,4 +1,8 @@
+import asyncio
+import atexit
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from colorama import Fore, Style, init
 import platform
 import sys
@@ -6,22 +10,28 @@ from contextlib import asynccontextmanager
 from typing import Optional
 
 # Import các module khởi tạo
-from .postgres import PostgresInitializer, get_pool
+from .postgres import PostgresInitializer
 from .redis import RedisInitializer
 
 init(autoreset=True)
 
 class ColoredFormatter(logging.Formatter):
     """Custom formatter with colors"""
-    
-    def format(self, record):
-        if record.levelno == logging.INFO:
-            record.msg = f"{Fore.GREEN}{record.msg}{Style.RESET_ALL}"
-        elif record.levelno == logging.WARNING:
-            record.msg = f"{Fore.YELLOW}{record.msg}{Style.RESET_ALL}"
-        elif record.levelno == logging.ERROR:
-            record.msg = f"{Fore.RED}{record.msg}{Style.RESET_ALL}"
-        return super().format(record)
+
+    # Bảng màu theo level, tra một lần cho mỗi record thay vì chuỗi if/elif
+    _COLORS = {
+        logging.INFO: Fore.GREEN,
+        logging.WARNING: Fore.YELLOW,
+        logging.ERROR: Fore.RED,
+        logging.CRITICAL: Fore.RED,
+    }
+
+    def formatMessage(self, record):
+        # Tô màu dòng đã format thay vì sửa record.msg, để các handler khác
+        # (vd: file log) không nhận message dính mã màu
+        message = super().formatMessage(record)
+        color = self._COLORS.get(record.levelno)
+        return f"{color}{message}{Style.RESET_ALL}" if color else message
 
 # Configure logging
 handlers = []
@@ -44,9 +54,16 @@ else:
     console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
 handlers.append(console_handler)
 
+# Request path chỉ put_nowait record vào queue; thread nền của QueueListener mới
+# format và ghi ra file/console, nên I/O log không chặn event loop
+log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 logging.basicConfig(
     level=logging.INFO,
-    handlers=handlers
+    handlers=[QueueHandler(log_queue)]
 )
 logger = logging.getLogger(__name__)
 
@@ -65,17 +82,14 @@ class ApplicationRunner:
         logger.info("Initializing core services...")
         
         try:
-            # Khởi tạo PostgreSQL
-            logger.info("Initializing PostgreSQL...")
+            # Khởi tạo PostgreSQL và Redis song song (hai kết nối độc lập nhau)
+            logger.info("Initializing PostgreSQL and Redis...")
             self.postgres_initializer = PostgresInitializer()
-            await self.postgres_initializer.initialize()
-            logger.info("PostgreSQL initialized successfully")
-            
-            # Khởi tạo Redis
-            logger.info("Initializing Redis...")
             self.redis_initializer = RedisInitializer()
-            await self.redis_initializer.initialize()
-            logger.info("Redis initialized successfully")
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self.postgres_initializer.initialize())
+                tg.create_task(self.redis_initializer.initialize())
+            logger.info("PostgreSQL and Redis initialized successfully")
             
             self.is_initialized = True
             logger.info("All services initialized successfully")
@@ -90,13 +104,18 @@ class ApplicationRunner:
         logger.info("Cleaning up services...")
         
         try:
+            # Đóng Redis và PostgreSQL song song; lỗi bên này không chặn bên kia
+            closers = {}
             if self.redis_initializer:
-                await self.redis_initializer.close()
-                logger.info("Redis connection closed")
-                
+                closers["Redis"] = self.redis_initializer.close()
             if self.postgres_initializer:
-                await self.postgres_initializer.close()
-                logger.info("PostgreSQL connection closed")
+                closers["PostgreSQL"] = self.postgres_initializer.close()
+            results = await asyncio.gather(*closers.values(), return_exceptions=True)
+            for name, result in zip(closers, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error closing {name}: {str(result)}")
+                else:
+                    logger.info(f"{name} connection closed")
                 
         except Exception as e:
             logger.error(f"Error during cleanup: {str(e)}")
@@ -105,15 +124,22 @@ class ApplicationRunner:
     
     def get_postgres_pool(self):
         """Lấy PostgreSQL connection pool"""
-        if not self.is_initialized:
+        if not self.is_initialized or not self.postgres_initializer:
             raise RuntimeError("Services not initialized. Call initialize_services() first.")
-        return get_pool()
+        # Pool do initializer tạo lúc startup (get_pool() sẽ tạo thêm một pool riêng)
+        return self.postgres_initializer.pool
     
     def get_redis_client(self):
         """Lấy Redis client"""
         if not self.is_initialized or not self.redis_initializer:
             raise RuntimeError("Services not initialized. Call initialize_services() first.")
         return self.redis_initializer.client
+    
+    def get_redis_binary_client(self):
+        """Lấy Redis client trả về bytes (cho value nhị phân)"""
+        if not self.is_initialized or not self.redis_initializer:
+            raise RuntimeError("Services not initialized. Call initialize_services() first.")
+        return self.redis_initializer.binary_client
 
 # Global instance
 _app_runner: Optional[ApplicationRunner] = None
@@ -146,3 +172,8 @@ def get_redis_client():
     """Lấy Redis client"""
     runner = get_app_runner()
     return runner.get_redis_client()
+
+def get_redis_binary_client():
+    """Lấy Redis client trả về bytes"""
+    runner = get_app_runner()
+    return runner.get_redis_binary_client()
@@ -1,33 +1,64 @@
+import asyncio
+import logging
+import os
+import sys
 import uvicorn
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from agent import get_a2a_app
 from router import conversation_router, health_router, chat_router
 from initialize import initialize_all_services, cleanup_all_services
+from service import start_log_writer, stop_log_writer
+from utils import redis_flush, reset_redis_client
 from middleware.cors.cors import configure_cors
-from agent_executor import WeatherAgentExecutor
+from agent_executor import WeatherAgentExecutor, get_gemini_model, aclose_http_client
+
+logger = logging.getLogger(__name__)
+
+async def _warmup(name: str, coro) -> None:
+    """Chạy một bước warmup, lỗi chỉ ghi log để không làm hỏng startup."""
+    try:
+        await coro
+    except Exception as e:
+        logger.warning("Failed to %s at startup: %s", name, e)
+    else:
+        logger.debug("Startup step done: %s", name)
 
 # Lifespan context manager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan events cho FastAPI app"""
-    # Startup
-    await initialize_all_services()
-    # Preload Vietnam locations once at startup
-    try:
-        await WeatherAgentExecutor.preload_locations()
-        print("DEBUG: Preloaded Vietnam locations at startup")
-    except Exception as e:
-        print(f"DEBUG: Failed to preload locations at startup: {e}")
+    # Startup: kết nối Postgres/Redis, preload Vietnam locations và khởi tạo Gemini
+    # model (cả model phân loại intent) chạy song song, để request đầu tiên không phải
+    # chờ; router không tự khởi tạo model. Lỗi kết nối DB vẫn làm startup thất bại,
+    # lỗi warmup thì chỉ ghi log.
+    # (A2A app được mount nên không nhận on_startup, phải làm ở đây)
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(initialize_all_services())
+        tg.create_task(_warmup("preload locations", WeatherAgentExecutor.preload_locations()))
+        tg.create_task(_warmup("initialize Gemini model", get_gemini_model()))
+    # Writer ghi log conversation theo lô
+    start_log_writer()
     yield
     # Shutdown
+    # Ghi nốt các log conversation còn trong hàng đợi trước khi đóng kết nối
+    await stop_log_writer()
+    # Gửi nốt các lệnh Redis fire-and-forget trước khi đóng client
+    await redis_flush()
+    # Đóng HTTP client dùng chung (Open-Meteo)
+    await aclose_http_client()
     await cleanup_all_services()
+    # Client Redis đã đóng -> bỏ bản cache trong redis_utils
+    reset_redis_client()
 
 # Tạo FastAPI app với lifespan
 app = FastAPI(
     title="AI Agent API",
     description="AI Agent với conversation logging và skill routing",
     version="1.0.0",
+    # Serialize response bằng orjson cho mọi route (trừ route trả về Response riêng)
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -44,4 +75,27 @@ a2a_app = get_a2a_app()
 app.mount("/a2a", a2a_app)  # Thay đổi từ "/" thành "/a2a"
 
 if __name__ == '__main__':
-    uvicorn.run(app, host="0.0.0.0", port=9999)
+    run_kwargs = {}
+    if sys.platform != "win32":
+        # uvloop + httptools chỉ có trên POSIX; Windows giữ mặc định của uvicorn
+        run_kwargs.update(loop="uvloop", http="httptools")
+    # Mặc định 1 worker: app giả định chạy một process. Các trạng thái sau chỉ nằm
+    # trong bộ nhớ process, worker khác không thấy:
+    # - _memory_store (LRU memory hội thoại theo context_id)
+    # - GeminiAgentExecutor._inflight và IntentRouterAgentExecutor._dispatch (map
+    #   task_id -> task/agent để cancel): cancel rơi vào worker khác sẽ không có tác dụng
+    # - single-flight _inflight_prompts và các cache intent/geocode/response của Gemini
+    # - EventQueue của A2A trong DefaultRequestHandler (stream/resubscribe của một task)
+    # WEB_CONCURRENCY > 1 là opt-in, chỉ dùng khi chấp nhận các giới hạn trên
+    # (vd: sticky session theo context). App truyền dạng import string để mỗi
+    # worker tự import.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=9999,
+        workers=int(os.environ.get("WEB_CONCURRENCY", 1)),
+        log_level="info",
+        # Giữ kết nối HTTP/1.1 lâu hơn mặc định (5s) để client gọi liên tục không phải mở lại TCP
+        timeout_keep_alive=int(os.environ.get("UVICORN_KEEPALIVE", 30)),
+        **run_kwargs,
+    )
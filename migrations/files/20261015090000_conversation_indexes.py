@@ -0,0 +1,37 @@
+"""
+Migration: conversation_indexes
+Description: Index (session_id, created_at DESC) cho truy vấn lịch sử theo session và partial index cho skill_used
+Created: 2026-10-15T09:00:00
+"""
+
+async def upgrade(conn):
+    """
+    Apply migration changes
+    """
+    # Migration chạy trong transaction nên không dùng được CREATE INDEX CONCURRENTLY;
+    # với bảng lớn có thể tạo index thủ công bằng CONCURRENTLY trước rồi mới migrate
+    # (IF NOT EXISTS sẽ bỏ qua).
+    # Không INCLUDE user_message/agent_response/metadata: cột text/JSONB không giới hạn
+    # độ dài, tuple index vượt ~2704 byte sẽ làm INSERT/COPY của cả lô bị lỗi
+    sql = """
+    CREATE INDEX IF NOT EXISTS idx_conversations_session_created
+        ON conversations (session_id, created_at DESC);
+
+    CREATE INDEX IF NOT EXISTS idx_conversations_skill_used
+        ON conversations (skill_used)
+        WHERE skill_used IS NOT NULL;
+    """
+    
+    await conn.execute(sql)
+
+
+async def downgrade(conn):
+    """
+    Rollback migration changes
+    """
+    sql = """
+    DROP INDEX IF EXISTS idx_conversations_skill_used;
+    DROP INDEX IF EXISTS idx_conversations_session_created;
+    """
+    
+    await conn.execute(sql)
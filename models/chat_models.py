@@ -2,17 +2,22 @@
 Chat Models - Pydantic models cho chat API
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, Dict, Any
 
 class ChatRequest(BaseModel):
     """Model cho request chat"""
+    # Bất biến, bỏ qua field lạ, bỏ khoảng trắng thừa ở input
+    model_config = ConfigDict(frozen=True, extra="ignore", str_strip_whitespace=True)
+
     message: str = Field(..., description="Tin nhắn từ user", min_length=1)
     conversion_id: str = Field(..., description="ID của hội thoại")
     account_id: str = Field(..., description="ID của user")
 
 class ChatResponse(BaseModel):
     """Model cho response chat"""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     success: bool = Field(..., description="Trạng thái xử lý")
     message: str = Field(..., description="Thông báo kết quả")
     response: str = Field(..., description="Phản hồi từ agent")
@@ -22,6 +27,8 @@ class ChatResponse(BaseModel):
 
 class ChatSessionInfo(BaseModel):
     """Model cho thông tin session chat"""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     session_id: str = Field(..., description="ID của session")
     summary: Optional[Dict[str, Any]] = Field(None, description="Summary của session")
     recent_conversations: list = Field(default_factory=list, description="Danh sách conversation gần đây")
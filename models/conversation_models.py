@@ -2,11 +2,14 @@
 Conversation Models - Pydantic models cho conversation API
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, Dict, Any
 
 class ConversationLogRequest(BaseModel):
     """Model cho request log conversation thủ công"""
+    # Bất biến, bỏ qua field lạ, bỏ khoảng trắng thừa ở input
+    model_config = ConfigDict(frozen=True, extra="ignore", str_strip_whitespace=True)
+
     session_id: str = Field(..., description="ID của session")
     user_message: str = Field(..., description="Tin nhắn của user")
     agent_response: str = Field(..., description="Phản hồi của agent")
@@ -16,23 +19,31 @@ class ConversationLogRequest(BaseModel):
 
 class ConversationLogResponse(BaseModel):
     """Model cho response log conversation"""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     success: bool = Field(..., description="Trạng thái logging")
     session_id: str = Field(..., description="ID của session")
     message: str = Field(..., description="Thông báo kết quả")
 
 class ConversationHistoryResponse(BaseModel):
     """Model cho response conversation history"""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     session_id: str = Field(..., description="ID của session")
     conversations: list = Field(default_factory=list, description="Danh sách conversations")
     count: int = Field(0, description="Số lượng conversation")
 
 class ConversationSummaryResponse(BaseModel):
     """Model cho response conversation summary"""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     session_id: str = Field(..., description="ID của session")
     summary: Optional[Dict[str, Any]] = Field(None, description="Summary của session")
 
 class ConversationStatsResponse(BaseModel):
     """Model cho response conversation stats"""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     total_sessions: int = Field(0, description="Tổng số sessions")
     total_conversations: int = Field(0, description="Tổng số conversations")
     avg_processing_time: float = Field(0.0, description="Thời gian xử lý trung bình")
@@ -44,6 +55,8 @@ class ConversationStatsResponse(BaseModel):
 
 class TestLogResponse(BaseModel):
     """Model cho response test log"""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     success: bool = Field(..., description="Trạng thái test")
     session_id: str = Field(..., description="ID của session test")
     message: str = Field(..., description="Thông báo kết quả test")
@@ -5,15 +5,16 @@ Chat Routes - API để tương tác với agent
 import uuid
 import time
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from typing import Dict, Any
 from models import ChatRequest, ChatResponse, ChatSessionInfo
-from service import log_agent_response, delete_session
+from service import log_agent_response, delete_session, get_session_summary, get_conversation_history
 from agent import create_request_handler
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
-# Create a single request handler instance to avoid re-initializing agent/executors
+# Request handler dùng chung với A2A app (create_request_handler tạo một lần), không
+# khởi tạo lại agent/executors cho mỗi request
 _request_handler = create_request_handler()
 
 @router.post("/", response_model=ChatResponse)
@@ -141,8 +142,6 @@ async def process_message_with_agent(message: str, session_id: str) -> Dict[str,
 async def get_chat_session(session_id: str):
     """Lấy thông tin session chat"""
     try:
-        from service import get_session_summary, get_conversation_history
-        
         # Lấy session summary
         summary = await get_session_summary(session_id)
         
@@ -166,7 +165,7 @@ async def delete_chat_session(session_id: str):
         success = await delete_session(session_id)
         
         if success:
-            return JSONResponse({
+            return ORJSONResponse({
                 "success": True,
                 "message": f"Session {session_id} đã được xóa thành công"
             })
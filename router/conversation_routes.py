@@ -4,12 +4,12 @@ Conversation Routes - Các routes để test và quản lý conversation logging
 
 import uuid
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
 from models import (
     ConversationLogRequest, ConversationLogResponse, ConversationHistoryResponse,
     ConversationSummaryResponse, ConversationStatsResponse, TestLogResponse
 )
-from service import get_conversation_history, get_session_summary, log_agent_response, get_conversation_stats
+from service import get_conversation_history, stream_conversation_history, get_session_summary, log_agent_response, get_conversation_stats
 
 router = APIRouter(prefix="/conversation", tags=["conversation"])
 
@@ -35,8 +35,13 @@ async def test_log():
     )
 
 @router.get("/history/{session_id}", response_model=ConversationHistoryResponse)
-async def get_conversations(session_id: str, limit: int = 10):
-    """Lấy lịch sử conversation của một session"""
+async def get_conversations(session_id: str, limit: int = 10, stream: bool = False):
+    """Lấy lịch sử conversation của một session (stream=true: trả ND-JSON qua cursor)"""
+    if stream:
+        return StreamingResponse(
+            stream_conversation_history(session_id, limit=limit),
+            media_type="application/x-ndjson"
+        )
     try:
         conversations = await get_conversation_history(session_id, limit=limit)
         return ConversationHistoryResponse(
@@ -2,39 +2,48 @@
 Health Routes - Các routes để kiểm tra trạng thái hệ thống
 """
 
+from utils import json_dumps_bytes
 from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
 
 router = APIRouter(prefix="/health", tags=["health"])
 
+# Nội dung các endpoint health là hằng số -> serialize một lần khi import.
+# Handler giữ async def vì không có I/O chặn: def thường sẽ bị FastAPI đẩy sang threadpool
+_HEALTH_BODY = json_dumps_bytes({
+    "status": "healthy",
+    "message": "AI Agent is running with conversation logging",
+    "version": "1.0.0"
+})
+
+_PING_BODY = json_dumps_bytes({
+    "pong": True,
+    "timestamp": "2024-01-01T00:00:00Z"
+})
+
+_STATUS_BODY = json_dumps_bytes({
+    "status": "operational",
+    "services": {
+        "agent": "running",
+        "database": "connected",
+        "redis": "connected",
+        "conversation_logging": "enabled"
+    },
+    "uptime": "N/A",  # Có thể implement để lấy uptime thực
+    "version": "1.0.0"
+})
+
 @router.get("/")
 async def health_check():
     """Health check endpoint"""
-    return JSONResponse({
-        "status": "healthy",
-        "message": "AI Agent is running with conversation logging",
-        "version": "1.0.0"
-    })
+    return Response(content=_HEALTH_BODY, media_type="application/json")
 
 @router.get("/ping")
 async def ping():
     """Simple ping endpoint"""
-    return JSONResponse({
-        "pong": True,
-        "timestamp": "2024-01-01T00:00:00Z"
-    })
+    return Response(content=_PING_BODY, media_type="application/json")
 
 @router.get("/status")
 async def system_status():
     """Detailed system status"""
-    return JSONResponse({
-        "status": "operational",
-        "services": {
-            "agent": "running",
-            "database": "connected",
-            "redis": "connected",
-            "conversation_logging": "enabled"
-        },
-        "uptime": "N/A",  # Có thể implement để lấy uptime thực
-        "version": "1.0.0"
-    })
+    return Response(content=_STATUS_BODY, media_type="application/json")
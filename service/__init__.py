@@ -6,16 +6,26 @@ from .conversation_service import (
     ConversationService,
     log_agent_response,
     get_conversation_history,
+    stream_conversation_history,
     get_session_summary,
     delete_session,
     get_conversation_stats
 )
+from .log_batcher import (
+    enqueue_log,
+    start_log_writer,
+    stop_log_writer
+)
 
 __all__ = [
     'ConversationService',
     'log_agent_response',
     'get_conversation_history',
+    'stream_conversation_history',
     'get_session_summary',
     'delete_session',
-    'get_conversation_stats'
+    'get_conversation_stats',
+    'enqueue_log',
+    'start_log_writer',
+    'stop_log_writer'
 ]
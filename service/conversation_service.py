@@ -2,15 +2,140 @@
 Conversation Service - Business logic cho conversation logging và management
 """
 
+import asyncio
 import logging
-import json
-import uuid
+import secrets
 from datetime import datetime
-from typing import Dict, Any, Optional, List
-from utils import db_execute, db_fetch_all, db_fetch_one, redis_set, redis_get, redis_delete
+from typing import Dict, Any, Optional, List, AsyncIterator
+from utils import db_execute, db_execute_many, db_copy_records, db_fetch_all, db_iterate, db_fetch_one, redis_set, redis_setnx_ex, redis_get, redis_delete, redis_delete_many, redis_hgetall, redis_hmget, redis_pipeline, redis_script, json_dumps_bytes, json_loads
+from .log_batcher import enqueue_log
 
 logger = logging.getLogger(__name__)
 
+# Thứ tự cột khi ghi conversation (COPY và INSERT dùng chung). created_at lấy
+# DEFAULT NOW() của bảng, metadata (JSONB) truyền dict qua codec của pool
+_CONVERSATION_COLUMNS = (
+    "conversation_id", "session_id", "user_message", "agent_response",
+    "skill_used", "processing_time", "metadata"
+)
+_INSERT_CONVERSATION_QUERY = """
+    INSERT INTO conversations (
+        conversation_id, session_id, user_message, agent_response, 
+        skill_used, processing_time, metadata
+    ) VALUES ($1, $2, $3, $4, $5, $6, $7)
+"""
+
+# Session summary lưu dạng Redis HASH (key mới, không trùng kiểu với bản JSON cũ)
+def _summary_key(session_id: str) -> str:
+    return f"session_summary:h:{session_id}"
+
+# Lịch sử conversation của một session, mới nhất trước
+_HISTORY_QUERY = """
+    SELECT conversation_id, user_message, agent_response, 
+           skill_used, processing_time, metadata, created_at
+    FROM conversations 
+    WHERE session_id = $1 
+    ORDER BY created_at DESC 
+    LIMIT $2 OFFSET $3
+"""
+
+# Cache lịch sử theo (session, limit, offset); các key đã cache của một session được
+# ghi vào SET hist_keys:{sid} để xóa đúng các key đó khi có conversation mới (không SCAN)
+HISTORY_CACHE_TTL = 60
+
+def _history_key(session_id: str, limit: int, offset: int) -> str:
+    return f"hist:{session_id}:{limit}:{offset}"
+
+def _history_keys_set(session_id: str) -> str:
+    return f"hist_keys:{session_id}"
+
+# Thống kê tổng quan: đọc nhiều, chấp nhận trễ vài chục giây -> cache chung cho mọi
+# request, kèm lock để mỗi lần hết hạn chỉ một request query database
+STATS_CACHE_TTL = 30
+STATS_LOCK_TTL = 5
+_STATS_CACHE_KEY = "conv_stats:v1"
+_STATS_LOCK_KEY = "conv_stats:lock"
+_STATS_WAIT_INTERVAL = 0.05
+
+# Chỉ xoá lock khi vẫn là token của mình: lock có thể đã hết hạn (query lâu hơn
+# STATS_LOCK_TTL) và được request khác lấy lại. KEYS: lock. ARGV: token
+_STATS_UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Chống đếm sai khi warm-up summary chạy cùng lúc với log batcher. Key guard (HASH)
+# của mỗi session có: inflight = số lô đang ghi DB, gen = số lô đã ghi xong. Warm-up
+# chỉ ghi kết quả DB vào cache khi không có lô nào chồng lên thời gian query; log
+# batcher chỉ cộng dồn vào summary đã warm-up (có created_at)
+_SUMMARY_GUARD_TTL = 86400
+_SUMMARY_INFLIGHT_TTL = 60
+
+def _summary_guard_key(session_id: str) -> str:
+    return f"session_summary:w:{session_id}"
+
+# KEYS: summary, guard. ARGV: count, total_time, last_conversation_id, now, ttl, applied
+_SUMMARY_APPLY_SCRIPT = """
+local inflight = redis.call('HINCRBY', KEYS[2], 'inflight', -1)
+if inflight < 0 then redis.call('HSET', KEYS[2], 'inflight', 0) end
+redis.call('HINCRBY', KEYS[2], 'gen', 1)
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+if ARGV[6] == '1' and redis.call('HEXISTS', KEYS[1], 'created_at') == 1 then
+    redis.call('HINCRBY', KEYS[1], 'total_conversations', ARGV[1])
+    if tonumber(ARGV[2]) > 0 then
+        redis.call('HINCRBYFLOAT', KEYS[1], 'total_processing_time', ARGV[2])
+    end
+    redis.call('HSET', KEYS[1], 'last_conversation_id', ARGV[3],
+               'last_conversation_at', ARGV[4], 'updated_at', ARGV[4])
+    redis.call('HSETNX', KEYS[1], 'first_conversation_at', ARGV[4])
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+end
+return 1
+"""
+
+# KEYS: summary, guard. ARGV: gen đọc trước khi query, ttl, field1, value1, ...
+_SUMMARY_WARM_SCRIPT = """
+local guard = redis.call('HMGET', KEYS[2], 'gen', 'inflight')
+if (guard[1] or '0') ~= ARGV[1] or tonumber(guard[2] or '0') > 0 then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Field số của summary (HGETALL trả về string)
+_SUMMARY_INT_FIELDS = ("total_conversations",)
+_SUMMARY_FLOAT_FIELDS = ("total_processing_time",)
+
+def _decode_summary(fields: Dict[str, str]) -> Dict[str, Any]:
+    summary: Dict[str, Any] = dict(fields)
+    for name in _SUMMARY_INT_FIELDS:
+        if name in summary:
+            summary[name] = int(summary[name])
+    for name in _SUMMARY_FLOAT_FIELDS:
+        if summary.get(name) is not None:
+            summary[name] = float(summary[name])
+    # avg tính lúc đọc từ tổng thời gian và số conversation (cả hai được cộng dồn)
+    total_time = summary.pop("total_processing_time", None)
+    count = summary.get("total_conversations")
+    summary["avg_processing_time"] = total_time / count if total_time and count else None
+    return summary
+
+async def _wait_for_stats_cache() -> Optional[bytes]:
+    """Chờ tối đa STATS_LOCK_TTL giây cho request giữ lock ghi cache thống kê"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STATS_LOCK_TTL
+    while loop.time() < deadline:
+        await asyncio.sleep(_STATS_WAIT_INTERVAL)
+        cached_data = await redis_get(_STATS_CACHE_KEY)
+        if cached_data:
+            return cached_data
+    return None
+
 class ConversationService:
     """Service để quản lý conversation logging và retrieval"""
     
@@ -34,103 +159,192 @@ class ConversationService:
             processing_time: Thời gian xử lý (giây)
             metadata: Thông tin bổ sung
         """
-        try:
-            # Tạo conversation ID
-            conversation_id = str(uuid.uuid4())
-            timestamp = datetime.now()
-            
-            # Lưu vào PostgreSQL
-            query = """
-                INSERT INTO conversations (
-                    conversation_id, session_id, user_message, agent_response, 
-                    skill_used, processing_time, metadata, created_at
-                ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-            """
-            
-            metadata_json = json.dumps(metadata) if metadata else None
-            
-            await db_execute(query, (
-                conversation_id,
-                session_id,
-                user_message,
-                agent_response,
-                skill_used,
-                processing_time,
-                metadata_json,
-                timestamp
-            ))
-            
-            # Cache conversation gần đây trong Redis
-            await ConversationService._cache_conversation(
-                session_id, conversation_id, user_message, 
-                agent_response, skill_used, processing_time, timestamp
-            )
-            
-            # Cập nhật session summary
-            await ConversationService._update_session_summary(session_id, conversation_id)
-            
-            logger.info(f"Conversation logged successfully: {conversation_id}")
+        # Đưa vào hàng đợi của log batcher (ghi theo lô bằng COPY) và trả về ngay.
+        # True nghĩa là đã nhận vào hàng đợi; False khi hàng đợi đầy.
+        return enqueue_log({
+            "session_id": session_id,
+            "user_message": user_message,
+            "agent_response": agent_response,
+            "skill_used": skill_used,
+            "processing_time": processing_time,
+            "metadata": metadata
+        })
+    
+    @staticmethod
+    async def log_conversations_batch(rows: List[Dict[str, Any]]) -> bool:
+        """
+        Lưu nhiều conversation trong một lần ghi database (dùng bởi log batcher)
+        
+        Args:
+            rows: Danh sách dict gồm conversation_id, session_id, user_message,
+                  agent_response, skill_used, processing_time, metadata
+        """
+        if not rows:
             return True
+        try:
+            params_list = [
+                (
+                    row["conversation_id"],
+                    row["session_id"],
+                    row["user_message"],
+                    row["agent_response"],
+                    row.get("skill_used"),
+                    row.get("processing_time"),
+                    row.get("metadata") or None
+                )
+                for row in rows
+            ]
+            
+            # Chỉ cache từng conversation (SET độc lập, có TTL) chạy song song với ghi DB.
+            # Summary là bộ đếm cộng dồn nên chỉ cập nhật sau khi DB ghi thành công,
+            # nếu không lỗi DB sẽ làm số liệu bị đếm dư đến khi hết TTL
+            now = datetime.now().isoformat()
+            session_ids = {row["session_id"] for row in rows}
+            await ConversationService._begin_summary_writes(session_ids)
+            try:
+                inserted, _ = await asyncio.gather(
+                    ConversationService._insert_rows(params_list),
+                    ConversationService._cache_conversations(rows, now)
+                )
+            except Exception:
+                await ConversationService._update_summaries(session_ids, [], now)
+                raise
+            persisted = rows if inserted is None else [rows[i] for i in inserted]
+            await ConversationService._update_summaries(session_ids, persisted, now)
+            # Xóa cache lịch sử sau khi DB đã có dòng mới, để lượt đọc kế tiếp không
+            # cache lại dữ liệu cũ
+            await ConversationService._invalidate_history({row["session_id"] for row in rows})
+            
+            logger.info(f"Conversation batch logged successfully: {len(persisted)}/{len(rows)} rows")
+            return len(persisted) == len(rows)
             
         except Exception as e:
-            logger.error(f"Error logging conversation: {str(e)}")
+            logger.error(f"Error logging conversation batch: {str(e)}")
             return False
     
     @staticmethod
-    async def _cache_conversation(
-        session_id: str, 
-        conversation_id: str, 
-        user_message: str, 
-        agent_response: str, 
-        skill_used: str, 
-        processing_time: float, 
-        timestamp: datetime
-    ):
-        """Cache conversation trong Redis"""
+    async def _insert_rows(params_list: List[tuple]) -> Optional[List[int]]:
+        """Ghi các dòng conversation bằng COPY, lỗi thì thử lại bằng INSERT executemany
+
+        COPY/executemany là tất cả-hoặc-không: một dòng lỗi (trùng conversation_id,
+        metadata sai...) làm hỏng cả lô. Khi cả hai đều lỗi thì ghi từng dòng và chỉ bỏ
+        các dòng lỗi. Trả về None nếu cả lô đã được ghi, ngược lại là index các dòng
+        đã ghi được.
+        """
         try:
-            cache_key = f"conversation:{session_id}:{conversation_id}"
-            cache_data = {
-                "conversation_id": conversation_id,
-                "user_message": user_message,
-                "agent_response": agent_response,
-                "skill_used": skill_used,
-                "processing_time": processing_time,
-                "timestamp": timestamp.isoformat()
-            }
-            
-            await redis_set(cache_key, json.dumps(cache_data), expire=3600)  # Cache 1 giờ
-            
+            await db_copy_records("conversations", params_list, _CONVERSATION_COLUMNS)
+            return None
         except Exception as e:
-            logger.error(f"Error caching conversation: {str(e)}")
+            # COPY chạy trong một lệnh nên lỗi thì không dòng nào được ghi -> ghi lại an toàn
+            logger.warning(f"COPY into conversations failed, falling back to INSERT: {str(e)}")
+        try:
+            await db_execute_many(_INSERT_CONVERSATION_QUERY, params_list)
+            return None
+        except Exception as e:
+            logger.warning(f"Batch INSERT into conversations failed, inserting rows one by one: {str(e)}")
+        
+        inserted: List[int] = []
+        for index, params in enumerate(params_list):
+            try:
+                await db_execute(_INSERT_CONVERSATION_QUERY, params)
+            except Exception as e:
+                logger.error(f"Dropping conversation {params[0]} of session {params[1]}: {str(e)}")
+            else:
+                inserted.append(index)
+        return inserted
     
     @staticmethod
-    async def _update_session_summary(session_id: str, conversation_id: str):
-        """Cập nhật summary của session trong Redis"""
+    async def _cache_conversations(rows: List[Dict[str, Any]], now: str):
+        """Cache từng conversation của lô trong Redis (một pipeline)"""
         try:
-            summary_key = f"session_summary:{session_id}"
-            
-            # Lấy summary hiện tại
-            current_summary = await redis_get(summary_key)
-            if current_summary:
-                summary = json.loads(current_summary)
-            else:
-                summary = {
-                    "session_id": session_id,
-                    "total_conversations": 0,
-                    "last_conversation_id": None,
-                    "created_at": datetime.now().isoformat()
-                }
+            async with redis_pipeline() as pipe:
+                for row in rows:
+                    pipe.set(
+                        f"conversation:{row['session_id']}:{row['conversation_id']}",
+                        ConversationService._conversation_cache_json(row, now),
+                        ex=3600  # Cache 1 giờ
+                    )
+                await pipe.execute()
             
-            # Cập nhật summary
-            summary["total_conversations"] += 1
-            summary["last_conversation_id"] = conversation_id
-            summary["updated_at"] = datetime.now().isoformat()
-            
-            # Lưu lại vào Redis
-            await redis_set(summary_key, json.dumps(summary), expire=86400)  # Cache 24 giờ
+        except Exception as e:
+            logger.error(f"Error caching conversation batch: {str(e)}")
+    
+    @staticmethod
+    async def _begin_summary_writes(session_ids):
+        """Đánh dấu các session đang có lô ghi DB (warm-up summary sẽ không cache)"""
+        try:
+            async with redis_pipeline() as pipe:
+                for session_id in session_ids:
+                    guard_key = _summary_guard_key(session_id)
+                    pipe.hincrby(guard_key, "inflight", 1)
+                    pipe.expire(guard_key, _SUMMARY_INFLIGHT_TTL)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error marking session summary writes: {str(e)}")
+    
+    @staticmethod
+    async def _update_summaries(session_ids, rows: List[Dict[str, Any]], now: str):
+        """Kết thúc lô ghi của các session và cộng dồn các conversation đã ghi xuống DB
+
+        rows chỉ gồm các dòng đã ghi thành công; session không có dòng nào chỉ được
+        bỏ đánh dấu. Mỗi session một lệnh script, cả lô chung một pipeline.
+        """
+        try:
+            # Summary chỉ cập nhật một lần mỗi session
+            last_by_session: Dict[str, Dict[str, Any]] = {}
+            count_by_session: Dict[str, int] = {}
+            time_by_session: Dict[str, float] = {}
+            for row in rows:
+                last_by_session[row["session_id"]] = row
+                count_by_session[row["session_id"]] = count_by_session.get(row["session_id"], 0) + 1
+                if row.get("processing_time"):
+                    time_by_session[row["session_id"]] = time_by_session.get(row["session_id"], 0.0) + row["processing_time"]
+            apply_summary = redis_script(_SUMMARY_APPLY_SCRIPT)
+            async with redis_pipeline() as pipe:
+                for session_id in session_ids:
+                    row = last_by_session.get(session_id)
+                    await apply_summary(
+                        keys=[_summary_key(session_id), _summary_guard_key(session_id)],
+                        args=[
+                            count_by_session.get(session_id, 0),
+                            time_by_session.get(session_id, 0.0),
+                            str(row["conversation_id"]) if row else "",
+                            now,
+                            _SUMMARY_GUARD_TTL,
+                            1 if row else 0
+                        ],
+                        client=pipe
+                    )
+                await pipe.execute()
             
         except Exception as e:
-            logger.error(f"Error updating session summary: {str(e)}")
+            logger.error(f"Error updating session summaries: {str(e)}")
+    
+    @staticmethod
+    async def _invalidate_history(session_ids):
+        """Xóa các key cache lịch sử của các session (đọc key-set rồi xóa trong một pipeline)"""
+        try:
+            set_keys = [_history_keys_set(session_id) for session_id in session_ids]
+            async with redis_pipeline() as pipe:
+                for set_key in set_keys:
+                    pipe.smembers(set_key)
+                members = await pipe.execute()
+            keys = [key for group in members for key in group]
+            await redis_delete_many([*keys, *set_keys])
+        except Exception as e:
+            logger.error(f"Error invalidating conversation history cache: {str(e)}")
+    
+    @staticmethod
+    def _conversation_cache_json(row: Dict[str, Any], timestamp: str) -> bytes:
+        # Ghi thẳng bytes của orjson vào Redis, không decode sang str
+        return json_dumps_bytes({
+            "conversation_id": row["conversation_id"],
+            "user_message": row["user_message"],
+            "agent_response": row["agent_response"],
+            "skill_used": row.get("skill_used"),
+            "processing_time": row.get("processing_time"),
+            "timestamp": timestamp
+        })
     
     @staticmethod
     async def get_conversation_history(
@@ -140,24 +354,23 @@ class ConversationService:
     ) -> List[Dict[str, Any]]:
         """Lấy lịch sử conversation của một session"""
         try:
-            query = """
-                SELECT conversation_id, user_message, agent_response, 
-                       skill_used, processing_time, metadata, created_at
-                FROM conversations 
-                WHERE session_id = $1 
-                ORDER BY created_at DESC 
-                LIMIT $2 OFFSET $3
-            """
+            cache_key = _history_key(session_id, limit, offset)
+            cached_data = await redis_get(cache_key)
+            if cached_data:
+                return json_loads(cached_data)
             
-            conversations = await db_fetch_all(query, (session_id, limit, offset))
+            # metadata (JSONB) đã được codec của pool decode thành dict. Kết quả được
+            # cache và trả ra JSON nên chuyển Record sang dict ở đây (một lần)
+            records = await db_fetch_all(_HISTORY_QUERY, (session_id, limit, offset))
+            conversations = [dict(record) for record in records]
             
-            # Parse metadata JSON
-            for conv in conversations:
-                if conv.get('metadata'):
-                    try:
-                        conv['metadata'] = json.loads(conv['metadata'])
-                    except:
-                        conv['metadata'] = None
+            # Cache ngắn hạn và ghi key vào key-set của session để invalidate
+            keys_set = _history_keys_set(session_id)
+            async with redis_pipeline() as pipe:
+                pipe.set(cache_key, json_dumps_bytes(conversations), ex=HISTORY_CACHE_TTL)
+                pipe.sadd(keys_set, cache_key)
+                pipe.expire(keys_set, HISTORY_CACHE_TTL)
+                await pipe.execute()
             
             return conversations
             
@@ -165,24 +378,44 @@ class ConversationService:
             logger.error(f"Error getting conversation history: {str(e)}")
             return []
     
+    @staticmethod
+    async def stream_conversation_history(
+        session_id: str,
+        limit: int = 10,
+        offset: int = 0
+    ) -> AsyncIterator[bytes]:
+        """Stream lịch sử conversation dạng ND-JSON (mỗi dòng một conversation)
+
+        Đọc bằng server-side cursor nên bộ nhớ không tăng theo limit; không dùng cache.
+        """
+        async for record in db_iterate(_HISTORY_QUERY, (session_id, limit, offset)):
+            yield json_dumps_bytes(dict(record)) + b"\n"
+    
     @staticmethod
     async def get_session_summary(session_id: str) -> Optional[Dict[str, Any]]:
         """Lấy summary của session"""
         try:
             # Thử lấy từ Redis cache trước
-            cache_key = f"session_summary:{session_id}"
-            cached_summary = await redis_get(cache_key)
-            
-            if cached_summary:
-                return json.loads(cached_summary)
-            
-            # Nếu không có trong cache, tính toán từ database
+            cache_key = _summary_key(session_id)
+            cached_summary = await redis_hgetall(cache_key)
+            
+            # created_at chỉ được ghi khi summary đã warm-up từ database; HASH chỉ có
+            # phần cộng dồn của log batcher (chưa warm-up) thì chưa đủ số liệu
+            if "created_at" in cached_summary:
+                return _decode_summary(cached_summary)
+            
+            # Warm-up: tính một lần từ database, sau đó log batcher cập nhật dần
+            # (HINCRBY/HINCRBYFLOAT) nên các lần đọc sau chỉ cần HGETALL. Đọc guard
+            # trước khi query: có lô đang ghi thì chỉ trả kết quả, không cache
+            guard_key = _summary_guard_key(session_id)
+            generation, inflight = await redis_hmget(guard_key, "gen", "inflight")
+            cacheable = not inflight or int(inflight) <= 0
             query = """
                 SELECT 
                     COUNT(*) as total_conversations,
                     MAX(created_at) as last_conversation_at,
                     MIN(created_at) as first_conversation_at,
-                    AVG(processing_time) as avg_processing_time
+                    SUM(processing_time) as total_processing_time
                 FROM conversations 
                 WHERE session_id = $1
             """
@@ -195,13 +428,19 @@ class ConversationService:
                     "total_conversations": result['total_conversations'],
                     "last_conversation_at": result['last_conversation_at'].isoformat() if result['last_conversation_at'] else None,
                     "first_conversation_at": result['first_conversation_at'].isoformat() if result['first_conversation_at'] else None,
-                    "avg_processing_time": float(result['avg_processing_time']) if result['avg_processing_time'] else None,
+                    "total_processing_time": float(result['total_processing_time']) if result['total_processing_time'] else None,
                     "created_at": datetime.now().isoformat()
                 }
                 
-                # Cache summary
-                await redis_set(cache_key, json.dumps(summary), expire=86400)
-                return summary
+                # Cache summary (HASH không lưu được None -> bỏ các field rỗng); script
+                # bỏ qua nếu có lô ghi DB chồng lên query (gen/inflight đã đổi)
+                if cacheable:
+                    fields = [item for k, v in summary.items() if v is not None for item in (k, v)]
+                    await redis_script(_SUMMARY_WARM_SCRIPT)(
+                        keys=[cache_key, guard_key],
+                        args=[generation or "0", 86400, *fields]
+                    )
+                return _decode_summary(summary)
             
             return None
             
@@ -218,7 +457,7 @@ class ConversationService:
             cached_data = await redis_get(cache_key)
             
             if cached_data:
-                return json.loads(cached_data)
+                return json_loads(cached_data)
             
             # Lấy từ database
             query = """
@@ -228,18 +467,12 @@ class ConversationService:
                 WHERE conversation_id = $1
             """
             
-            conversation = await db_fetch_one(query, (conversation_id,))
+            record = await db_fetch_one(query, (conversation_id,))
             
-            if conversation:
-                # Parse metadata
-                if conversation.get('metadata'):
-                    try:
-                        conversation['metadata'] = json.loads(conversation['metadata'])
-                    except:
-                        conversation['metadata'] = None
-                
+            if record:
+                conversation = dict(record)
                 # Cache kết quả
-                await redis_set(cache_key, json.dumps(conversation), expire=3600)
+                await redis_set(cache_key, json_dumps_bytes(conversation), expire=3600)
                 return conversation
             
             return None
@@ -259,7 +492,8 @@ class ConversationService:
             )
             
             # Xóa cache Redis
-            await redis_delete(f"session_summary:{session_id}")
+            await redis_delete(_summary_key(session_id))
+            await ConversationService._invalidate_history((session_id,))
             
             logger.info(f"Session {session_id} deleted successfully")
             return True
@@ -270,55 +504,102 @@ class ConversationService:
     
     @staticmethod
     async def get_conversation_stats() -> Dict[str, Any]:
-        """Lấy thống kê tổng quan về conversations"""
+        """Lấy thống kê tổng quan về conversations (cache Redis STATS_CACHE_TTL giây)
+
+        Khi cache hết hạn chỉ request giữ được lock (SET NX) mới query database, các
+        request khác chờ cache được ghi lại; quá STATS_LOCK_TTL (lock đã hết hạn) thì
+        thử lấy lock thêm một lần, chỉ request lấy được mới tính lại thay vì tất cả.
+        """
         try:
-            # Lấy thống kê tổng quan
+            cached_data = await redis_get(_STATS_CACHE_KEY)
+            if cached_data:
+                return json_loads(cached_data)
+            
+            token = secrets.token_hex(16)
+            have_lock = await redis_setnx_ex(_STATS_LOCK_KEY, token, STATS_LOCK_TTL)
+            if not have_lock:
+                cached_data = await _wait_for_stats_cache()
+                if cached_data:
+                    return json_loads(cached_data)
+                have_lock = await redis_setnx_ex(_STATS_LOCK_KEY, token, STATS_LOCK_TTL)
+                if not have_lock:
+                    # Request khác đã lấy lại lock và đang tính -> chờ thêm một lượt
+                    cached_data = await _wait_for_stats_cache()
+                    if cached_data:
+                        return json_loads(cached_data)
+            
+            try:
+                stats = await ConversationService._compute_conversation_stats()
+                if stats:
+                    await redis_set(_STATS_CACHE_KEY, json_dumps_bytes(stats), expire=STATS_CACHE_TTL)
+                return stats
+            finally:
+                if have_lock:
+                    await redis_script(_STATS_UNLOCK_SCRIPT)(keys=[_STATS_LOCK_KEY], args=[token])
+            
+        except Exception as e:
+            logger.error(f"Error getting conversation stats: {str(e)}")
+            return {}
+    
+    @staticmethod
+    async def _compute_conversation_stats() -> Dict[str, Any]:
+        """Tính thống kê từ database"""
+        try:
+            # Tổng quan, skill dùng nhiều nhất và thống kê 7 ngày trong một query;
+            # daily_stats trả về dạng JSONB (codec của pool decode thành list)
             stats_query = """
+                WITH overall AS (
+                    SELECT 
+                        COUNT(DISTINCT session_id) as total_sessions,
+                        COUNT(*) as total_conversations,
+                        AVG(processing_time) as avg_processing_time,
+                        MAX(created_at) as last_conversation_at
+                    FROM conversations
+                ),
+                skill AS (
+                    SELECT 
+                        skill_used,
+                        COUNT(*) as usage_count
+                    FROM conversations 
+                    WHERE skill_used IS NOT NULL 
+                    GROUP BY skill_used 
+                    ORDER BY usage_count DESC 
+                    LIMIT 1
+                ),
+                daily AS (
+                    SELECT 
+                        DATE(created_at) as date,
+                        COUNT(*) as conversations,
+                        AVG(processing_time) as avg_time
+                    FROM conversations 
+                    WHERE created_at >= NOW() - INTERVAL '7 days'
+                    GROUP BY DATE(created_at)
+                )
                 SELECT 
-                    COUNT(DISTINCT session_id) as total_sessions,
-                    COUNT(*) as total_conversations,
-                    AVG(processing_time) as avg_processing_time,
-                    MAX(created_at) as last_conversation_at
-                FROM conversations
+                    overall.*,
+                    skill.skill_used,
+                    skill.usage_count,
+                    COALESCE(
+                        (SELECT jsonb_agg(
+                            jsonb_build_object('date', date, 'conversations', conversations, 'avg_time', avg_time)
+                            ORDER BY date DESC
+                        ) FROM daily),
+                        '[]'::jsonb
+                    ) as daily_stats
+                FROM overall
+                LEFT JOIN skill ON TRUE
             """
             
             stats = await db_fetch_one(stats_query)
-            
-            # Lấy skill được sử dụng nhiều nhất
-            skill_query = """
-                SELECT 
-                    skill_used,
-                    COUNT(*) as usage_count
-                FROM conversations 
-                WHERE skill_used IS NOT NULL 
-                GROUP BY skill_used 
-                ORDER BY usage_count DESC 
-                LIMIT 1
-            """
-            
-            top_skill = await db_fetch_one(skill_query)
-            
-            # Lấy thống kê theo ngày (7 ngày gần nhất)
-            daily_stats_query = """
-                SELECT 
-                    DATE(created_at) as date,
-                    COUNT(*) as conversations,
-                    AVG(processing_time) as avg_time
-                FROM conversations 
-                WHERE created_at >= NOW() - INTERVAL '7 days'
-                GROUP BY DATE(created_at)
-                ORDER BY date DESC
-            """
-            
-            daily_stats = await db_fetch_all(daily_stats_query)
+            daily_stats = stats['daily_stats'] if stats else []
             
             return {
                 "total_sessions": stats['total_sessions'] if stats else 0,
                 "total_conversations": stats['total_conversations'] if stats else 0,
                 "avg_processing_time": float(stats['avg_processing_time']) if stats and stats['avg_processing_time'] else 0,
                 "last_conversation_at": stats['last_conversation_at'].isoformat() if stats and stats['last_conversation_at'] else None,
-                "most_used_skill": top_skill['skill_used'] if top_skill else None,
-                "skill_usage_count": top_skill['usage_count'] if top_skill else 0,
+                "most_used_skill": stats['skill_used'] if stats else None,
+                "skill_usage_count": (stats['usage_count'] or 0) if stats else 0,
                 "daily_stats": daily_stats,
                 "last_7_days": len(daily_stats)
             }
@@ -345,6 +626,10 @@ async def get_conversation_history(session_id: str, limit: int = 10) -> List[Dic
     """Lấy lịch sử conversation"""
     return await ConversationService.get_conversation_history(session_id, limit)
 
+def stream_conversation_history(session_id: str, limit: int = 10) -> AsyncIterator[bytes]:
+    """Stream lịch sử conversation dạng ND-JSON"""
+    return ConversationService.stream_conversation_history(session_id, limit)
+
 async def get_session_summary(session_id: str) -> Optional[Dict[str, Any]]:
     """Lấy summary của session"""
     return await ConversationService.get_session_summary(session_id)
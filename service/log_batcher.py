@@ -0,0 +1,119 @@
+"""
+Log Batcher - Gom các bản ghi conversation và ghi xuống database theo lô
+"""
+
+import asyncio
+import logging
+import uuid
+from typing import Dict, Any, Optional, List
+
+logger = logging.getLogger(__name__)
+
+# Số bản ghi tối đa cho một lần ghi và thời gian chờ gom lô
+MAX_BATCH = 200
+FLUSH_MS = 20
+MAX_QUEUE_SIZE = 10000
+
+_queue: Optional[asyncio.Queue] = None
+_writer_task: Optional[asyncio.Task] = None
+
+# Sentinel báo writer ghi nốt lô hiện tại rồi dừng
+_STOP = object()
+
+def _get_queue() -> asyncio.Queue:
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue(maxsize=MAX_QUEUE_SIZE)
+    return _queue
+
+def enqueue_log(payload: Dict[str, Any]) -> bool:
+    """
+    Đưa một bản ghi conversation vào hàng đợi, trả về ngay không chờ I/O
+
+    Args:
+        payload: Các tham số giống log_agent_response (session_id, user_message, ...)
+    """
+    row = dict(payload)
+    # Giữ uuid.UUID: asyncpg encode thẳng sang cột UUID, chỉ chuyển str ở Redis/JSON
+    row.setdefault("conversation_id", uuid.uuid4())
+
+    try:
+        _get_queue().put_nowait(row)
+    except asyncio.QueueFull:
+        logger.warning(f"Log queue is full, dropping conversation log for session {row.get('session_id')}")
+        return False
+
+    # Tự khởi động writer nếu chưa chạy (ví dụ khi dùng ngoài FastAPI lifespan)
+    if _writer_task is None or _writer_task.done():
+        start_log_writer()
+    return True
+
+async def _write_batch(batch: List[Dict[str, Any]]):
+    """Ghi một lô bản ghi, không để lỗi làm dừng writer"""
+    # Import ở đây (mỗi lô một lần) vì conversation_service import enqueue_log từ module này
+    from .conversation_service import ConversationService
+    try:
+        await ConversationService.log_conversations_batch(batch)
+    except Exception as e:
+        logger.error(f"Error writing conversation batch ({len(batch)} rows): {str(e)}")
+
+async def log_writer_loop():
+    """Writer chạy nền: gom tối đa MAX_BATCH bản ghi hoặc chờ FLUSH_MS rồi ghi một lần"""
+    queue = _get_queue()
+    loop = asyncio.get_running_loop()
+    stopping = False
+
+    while not stopping:
+        item = await queue.get()
+        queue.task_done()
+        if item is _STOP:
+            break
+
+        batch = [item]
+        deadline = loop.time() + FLUSH_MS / 1000
+
+        while len(batch) < MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            queue.task_done()
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+
+        await _write_batch(batch)
+
+def start_log_writer() -> asyncio.Task:
+    """Khởi động writer task (gọi khi startup)"""
+    global _writer_task
+    if _writer_task is None or _writer_task.done():
+        _writer_task = asyncio.get_running_loop().create_task(log_writer_loop())
+        logger.info("Conversation log writer started")
+    return _writer_task
+
+async def stop_log_writer():
+    """Dừng writer và ghi nốt các bản ghi còn trong hàng đợi (gọi khi shutdown)"""
+    global _writer_task
+    queue = _get_queue()
+
+    if _writer_task is not None and not _writer_task.done():
+        await queue.put(_STOP)
+        await _writer_task
+    _writer_task = None
+
+    # Flush phần còn lại (bản ghi được đưa vào sau sentinel) để tránh mất log
+    while not queue.empty():
+        batch = []
+        while not queue.empty() and len(batch) < MAX_BATCH:
+            item = queue.get_nowait()
+            queue.task_done()
+            if item is not _STOP:
+                batch.append(item)
+        if batch:
+            await _write_batch(batch)
+    logger.info("Conversation log writer stopped")
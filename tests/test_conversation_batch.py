@@ -0,0 +1,90 @@
+"""
+Test ghi conversation theo lô: một dòng lỗi không làm mất cả lô
+"""
+
+import asyncio
+import uuid
+
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("redis")
+
+from service import conversation_service
+from service.conversation_service import ConversationService
+
+
+def _row(session_id: str, conversation_id=None):
+    return {
+        "conversation_id": conversation_id or uuid.uuid4(),
+        "session_id": session_id,
+        "user_message": "hello",
+        "agent_response": "hi",
+        "skill_used": "chat",
+        "processing_time": 0.5,
+        "metadata": {"source": "test"},
+    }
+
+
+def test_batch_drops_only_rows_violating_constraint(monkeypatch):
+    duplicate_id = uuid.uuid4()
+    rows = [_row("s1"), _row("s1", duplicate_id), _row("s2")]
+    written = []
+    summaries = {}
+
+    async def failing_bulk(*args, **kwargs):
+        raise RuntimeError('duplicate key value violates unique constraint "conversations_pkey"')
+
+    async def execute(query, params):
+        if params[0] == duplicate_id:
+            raise RuntimeError('duplicate key value violates unique constraint "conversations_pkey"')
+        written.append(params[0])
+
+    async def noop(*args, **kwargs):
+        return None
+
+    async def update_summaries(session_ids, persisted, now):
+        summaries["session_ids"] = set(session_ids)
+        summaries["persisted"] = [row["conversation_id"] for row in persisted]
+
+    monkeypatch.setattr(conversation_service, "db_copy_records", failing_bulk)
+    monkeypatch.setattr(conversation_service, "db_execute_many", failing_bulk)
+    monkeypatch.setattr(conversation_service, "db_execute", execute)
+    monkeypatch.setattr(ConversationService, "_begin_summary_writes", staticmethod(noop))
+    monkeypatch.setattr(ConversationService, "_cache_conversations", staticmethod(noop))
+    monkeypatch.setattr(ConversationService, "_invalidate_history", staticmethod(noop))
+    monkeypatch.setattr(ConversationService, "_update_summaries", staticmethod(update_summaries))
+
+    ok = asyncio.run(ConversationService.log_conversations_batch(rows))
+
+    # Lô không trọn vẹn -> báo False, nhưng các dòng hợp lệ vẫn được ghi
+    assert ok is False
+    assert written == [rows[0]["conversation_id"], rows[2]["conversation_id"]]
+    # Summary chỉ cộng các dòng đã ghi, vẫn kết thúc lô cho mọi session
+    assert summaries["persisted"] == written
+    assert summaries["session_ids"] == {"s1", "s2"}
+
+
+def test_batch_uses_copy_when_it_succeeds(monkeypatch):
+    rows = [_row("s1"), _row("s1")]
+    calls = []
+
+    async def copy_records(table, records, columns):
+        calls.append(("copy", len(records)))
+
+    async def unexpected(*args, **kwargs):
+        raise AssertionError("fallback should not run")
+
+    async def noop(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(conversation_service, "db_copy_records", copy_records)
+    monkeypatch.setattr(conversation_service, "db_execute_many", unexpected)
+    monkeypatch.setattr(conversation_service, "db_execute", unexpected)
+    monkeypatch.setattr(ConversationService, "_begin_summary_writes", staticmethod(noop))
+    monkeypatch.setattr(ConversationService, "_cache_conversations", staticmethod(noop))
+    monkeypatch.setattr(ConversationService, "_invalidate_history", staticmethod(noop))
+    monkeypatch.setattr(ConversationService, "_update_summaries", staticmethod(noop))
+
+    assert asyncio.run(ConversationService.log_conversations_batch(rows)) is True
+    assert calls == [("copy", 2)]
@@ -0,0 +1,55 @@
+"""
+Test lock tính thống kê: chỉ chủ lock được xoá lock, request chờ quá hạn lấy lại lock
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("redis")
+
+from service import conversation_service
+from service.conversation_service import ConversationService
+
+
+def test_waiter_retakes_lock_and_releases_only_its_token(monkeypatch):
+    lock_attempts = []
+    released = []
+    computed = []
+
+    async def setnx_ex(key, value, expire):
+        lock_attempts.append(value)
+        # Lần đầu lock đang bị giữ; sau khi chờ quá hạn thì lấy được
+        return len(lock_attempts) > 1
+
+    async def get(key):
+        return None
+
+    async def set_(key, value, expire=None):
+        return True
+
+    def script(source):
+        assert source == conversation_service._STATS_UNLOCK_SCRIPT
+
+        async def run(keys, args):
+            released.append((keys, args))
+        return run
+
+    async def compute():
+        computed.append(1)
+        return {"total_conversations": 1}
+
+    monkeypatch.setattr(conversation_service, "STATS_LOCK_TTL", 0.01)
+    monkeypatch.setattr(conversation_service, "_STATS_WAIT_INTERVAL", 0.001)
+    monkeypatch.setattr(conversation_service, "redis_setnx_ex", setnx_ex)
+    monkeypatch.setattr(conversation_service, "redis_get", get)
+    monkeypatch.setattr(conversation_service, "redis_set", set_)
+    monkeypatch.setattr(conversation_service, "redis_script", script)
+    monkeypatch.setattr(ConversationService, "_compute_conversation_stats", staticmethod(compute))
+
+    assert asyncio.run(ConversationService.get_conversation_stats()) == {"total_conversations": 1}
+    assert len(lock_attempts) == 2 and lock_attempts[0] == lock_attempts[1]
+    assert computed == [1]
+    # Xoá lock bằng compare-and-delete với đúng token đã SET
+    assert released == [([conversation_service._STATS_LOCK_KEY], [lock_attempts[0]])]
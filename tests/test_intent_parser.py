@@ -0,0 +1,144 @@
+"""
+Test phân loại intent khi Gemini hết token trước khi sinh nhãn (MAX_TOKENS, candidate rỗng)
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+pytest.importorskip("a2a")
+pytest.importorskip("httpx")
+
+import agent_executor
+from agent_executor import IntentRouterAgentExecutor, _parse_intent_chunk
+from utils import json_dumps, json_loads
+
+# Chunk SSE thực tế khi thinking tiêu hết maxOutputTokens: không có content.parts
+_MAX_TOKENS_CHUNK = {
+    "candidates": [{"content": {"role": "model"}, "finishReason": "MAX_TOKENS", "index": 0}],
+    "usageMetadata": {"promptTokenCount": 120, "thoughtsTokenCount": 2},
+}
+
+
+class _FakeResponse:
+    status_code = 200
+    text = ""
+
+    def __init__(self, lines):
+        self._lines = lines
+
+    async def aread(self):
+        return b""
+
+    async def aiter_lines(self):
+        for line in self._lines:
+            yield line
+
+
+class _FakeClient:
+    def __init__(self, lines):
+        self.lines = lines
+        self.bodies = []
+
+    @asynccontextmanager
+    async def stream(self, method, url, params=None, headers=None, content=None):
+        self.bodies.append(content)
+        yield _FakeResponse(self.lines)
+
+
+def test_parse_chunk_without_parts():
+    assert _parse_intent_chunk(_MAX_TOKENS_CHUNK) == ("", "MAX_TOKENS")
+    assert _parse_intent_chunk({}) == ("", None)
+    chunk = {"candidates": [{"content": {"parts": [{"text": "weather"}]}, "finishReason": "STOP"}]}
+    assert _parse_intent_chunk(chunk) == ("weather", "STOP")
+
+
+def test_rest_stream_returns_empty_on_max_tokens(monkeypatch):
+    client = _FakeClient([f"data: {json_dumps(_MAX_TOKENS_CHUNK)}", ""])
+    monkeypatch.setattr(agent_executor, "_get_http_client", lambda: client)
+    stream = agent_executor._bind_rest_intent("models/gemini-2.5-flash", "key")
+
+    assert asyncio.run(stream('Câu hỏi hiện tại: "abc"\n')) == ""
+    # Thinking tắt cho lời gọi phân loại
+    config = json_loads(client.bodies[0])["generationConfig"]
+    assert config["thinkingConfig"] == {"thinkingBudget": 0}
+
+
+def test_classify_intent_falls_back_to_chat_without_caching(monkeypatch):
+    client = _FakeClient([f"data: {json_dumps(_MAX_TOKENS_CHUNK)}"])
+    monkeypatch.setattr(agent_executor, "_get_http_client", lambda: client)
+    stream = agent_executor._bind_rest_intent("models/gemini-2.5-flash", "key")
+
+    async def classify(prompt):
+        return await stream(prompt)
+
+    monkeypatch.setattr(agent_executor, "_gemini_model", object())
+    monkeypatch.setattr(agent_executor._intent_batcher, "classify", classify)
+    router = IntentRouterAgentExecutor()
+    text = "kể cho tôi nghe một câu chuyện"
+
+    assert asyncio.run(router._classify_intent(text, "ctx-max-tokens")) == "chat"
+    # Không cache kết quả lỗi -> lượt sau vẫn gọi lại Gemini
+    assert agent_executor._INTENT_CACHE.get(("ctx-max-tokens", text)) is agent_executor._MISSING
+    assert len(client.bodies) == 1
+
+
+def _run_batched(monkeypatch, prompts):
+    """Chạy classify đồng thời trên một _BatchClassifier mới, luôn gom lô."""
+    monkeypatch.setattr(agent_executor, "INTENT_BATCH_MIN_PENDING", 1)
+    batcher = agent_executor._BatchClassifier()
+
+    async def run():
+        return await asyncio.gather(*(batcher.classify(p) for p in prompts))
+    return asyncio.run(run())
+
+
+def test_batch_uses_batch_generator_without_single_calls(monkeypatch):
+    payloads = []
+
+    async def batch_generate(payload):
+        payloads.append(json_loads(payload))
+        return '```json\n["weather", "chat"]\n```'
+
+    async def single_call(prompt, history=None, intent=False):
+        raise AssertionError("batch must not fall back to single calls")
+
+    monkeypatch.setattr(agent_executor, "_intent_batch_generate", batch_generate)
+    monkeypatch.setattr(agent_executor, "_generate_text", single_call)
+
+    assert _run_batched(monkeypatch, ["mai có mưa không", "kể chuyện"]) == ["weather", "chat"]
+    assert payloads == [["mai có mưa không", "kể chuyện"]]
+
+
+def test_failed_batch_resolves_callers_with_single_calls(monkeypatch):
+    calls = []
+
+    async def batch_generate(payload):
+        raise RuntimeError("Gemini HTTP 500")
+
+    async def single_call(prompt, history=None, intent=False):
+        calls.append(prompt)
+        return "weather" if "mưa" in prompt else "chat"
+
+    monkeypatch.setattr(agent_executor, "_intent_batch_generate", batch_generate)
+    monkeypatch.setattr(agent_executor, "_generate_text", single_call)
+
+    prompts = ["mai có mưa không", "kể chuyện", "bạn tên gì"]
+    assert _run_batched(monkeypatch, prompts) == ["weather", "chat", "chat"]
+    # Mỗi prompt chỉ gọi lẻ một lần (trong lô), caller không gọi lại
+    assert sorted(calls) == sorted(prompts)
+
+
+def test_batch_of_one_is_a_single_call(monkeypatch):
+    async def batch_generate(payload):
+        raise AssertionError("a lone prompt must not be sent as a batch")
+
+    async def single_call(prompt, history=None, intent=False):
+        assert intent
+        return "weather"
+
+    monkeypatch.setattr(agent_executor, "_intent_batch_generate", batch_generate)
+    monkeypatch.setattr(agent_executor, "_generate_text", single_call)
+
+    assert _run_batched(monkeypatch, ["mai có mưa không"]) == ["weather"]
@@ -8,6 +8,8 @@ from .database_utils import (
     db_fetch_all,
     db_fetch_one,
     db_execute_many,
+    db_copy_records,
+    db_iterate,
     db_transaction
 )
 
@@ -15,29 +17,89 @@ from .database_utils import (
 from .redis_utils import (
     redis_set,
     redis_get,
+    redis_setnx_ex,
+    redis_getex,
     redis_delete,
+    redis_delete_many,
     redis_exists,
+    redis_exists_many,
     redis_set_json,
     redis_get_json,
+    redis_get_cached,
+    redis_get_json_cached,
+    redis_mset_json,
+    redis_mget_json,
+    redis_set_msgpack,
+    redis_get_msgpack,
+    redis_hgetall,
+    redis_hmget,
     redis_expire,
-    redis_ttl
+    redis_ttl,
+    redis_scan_iter,
+    redis_pipeline,
+    redis_script,
+    redis_set_nowait,
+    redis_expire_nowait,
+    redis_delete_nowait,
+    redis_flush,
+    reset_redis_client
 )
 
+# JSON utilities
+from .json_utils import (
+    json_dumps,
+    json_dumps_bytes,
+    json_loads
+)
+
+# Cache utilities
+from .cache_utils import TTLCache
+
 __all__ = [
     # Database
     'db_execute',
     'db_fetch_all', 
     'db_fetch_one',
     'db_execute_many',
+    'db_copy_records',
+    'db_iterate',
     'db_transaction',
     
     # Redis
     'redis_set',
     'redis_get',
+    'redis_setnx_ex',
+    'redis_getex',
     'redis_delete',
+    'redis_delete_many',
     'redis_exists',
+    'redis_exists_many',
     'redis_set_json',
     'redis_get_json',
+    'redis_get_cached',
+    'redis_get_json_cached',
+    'redis_mset_json',
+    'redis_mget_json',
+    'redis_set_msgpack',
+    'redis_get_msgpack',
+    'redis_hgetall',
+    'redis_hmget',
     'redis_expire',
-    'redis_ttl'
+    'redis_ttl',
+    'redis_scan_iter',
+    'redis_pipeline',
+    'redis_script',
+    'redis_set_nowait',
+    'redis_expire_nowait',
+    'redis_delete_nowait',
+    'redis_flush',
+    'reset_redis_client',
+    
+    # JSON
+    'json_dumps',
+    'json_dumps_bytes',
+    'json_loads',
+    
+    # Cache
+    'TTLCache'
 ]
@@ -0,0 +1,48 @@
+"""
+Cache Utilities - Cache in-memory có TTL và giới hạn kích thước (LRU)
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+# Sentinel phân biệt "không có trong cache" với giá trị None được cache
+MISSING = object()
+
+class TTLCache:
+    """Cache LRU có thời gian sống cho từng entry (dùng trong một process)"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Lấy giá trị còn hạn, trả về default nếu không có hoặc đã hết hạn"""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Lưu giá trị, bỏ entry ít dùng nhất khi vượt maxsize"""
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Xóa entry (nếu có), trả về giá trị đã lưu hoặc default"""
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
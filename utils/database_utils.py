@@ -3,32 +3,59 @@ Database Utilities - Các utility functions cho PostgreSQL operations
 """
 
 import logging
-from typing import Optional, List, Dict, Any
-# from initialize import get_postgres_pool
+from contextlib import asynccontextmanager
+from typing import Optional, List, Sequence, AsyncIterator
+from asyncpg import Record
+from initialize import get_postgres_pool
 
 logger = logging.getLogger(__name__)
 
+# Pool của runner, lấy một lần rồi dùng lại; lấy lại sau khi pool cũ bị đóng (restart)
+_pool = None
+
+def _get_pool():
+    global _pool
+    pool = _pool
+    if pool is None or pool.is_closing():
+        pool = _pool = get_postgres_pool()
+    return pool
+
 async def db_execute(query: str, params: tuple = None):
     """Thực thi query database"""
-    logger.warning("Database functions temporarily disabled - install asyncpg first")
-    return None
+    async with _get_pool().acquire() as conn:
+        return await conn.execute(query, *(params or ()))
 
-async def db_fetch_all(query: str, params: tuple = None) -> List[Dict[str, Any]]:
-    """Lấy tất cả kết quả từ database"""
-    logger.warning("Database functions temporarily disabled - install asyncpg first")
-    return []
+async def db_fetch_all(query: str, params: tuple = None) -> List[Record]:
+    """Lấy tất cả kết quả từ database (asyncpg Record: đọc theo record['col'], không copy sang dict)"""
+    async with _get_pool().acquire() as conn:
+        return await conn.fetch(query, *(params or ()))
 
-async def db_fetch_one(query: str, params: tuple = None) -> Optional[Dict[str, Any]]:
-    """Lấy một kết quả từ database"""
-    logger.warning("Database functions temporarily disabled - install asyncpg first")
-    return None
+async def db_fetch_one(query: str, params: tuple = None) -> Optional[Record]:
+    """Lấy một kết quả từ database (asyncpg Record hoặc None)"""
+    async with _get_pool().acquire() as conn:
+        return await conn.fetchrow(query, *(params or ()))
 
 async def db_execute_many(query: str, params_list: List[tuple]):
     """Thực thi nhiều queries cùng lúc"""
-    logger.warning("Database functions temporarily disabled - install asyncpg first")
-    return None
+    async with _get_pool().acquire() as conn:
+        return await conn.executemany(query, params_list)
 
+async def db_copy_records(table: str, records: Sequence[tuple], columns: Sequence[str]):
+    """Ghi nhiều bản ghi bằng COPY (một round-trip, nhanh hơn INSERT từng dòng)"""
+    async with _get_pool().acquire() as conn:
+        return await conn.copy_records_to_table(table, records=records, columns=list(columns))
+
+@asynccontextmanager
 async def db_transaction():
-    """Tạo database transaction context"""
-    logger.warning("Database functions temporarily disabled - install asyncpg first")
-    return None, None
+    """Tạo database transaction context, yield connection đang trong transaction"""
+    async with _get_pool().acquire() as conn:
+        async with conn.transaction():
+            yield conn
+
+async def db_iterate(query: str, params: tuple = None, prefetch: int = 100) -> AsyncIterator[Record]:
+    """Duyệt kết quả bằng server-side cursor (lấy từng đợt prefetch dòng, không nạp hết vào bộ nhớ)"""
+    async with _get_pool().acquire() as conn:
+        # asyncpg chỉ cho dùng cursor trong transaction
+        async with conn.transaction():
+            async for record in conn.cursor(query, *(params or ()), prefetch=prefetch):
+                yield record
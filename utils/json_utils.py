@@ -0,0 +1,39 @@
+"""
+JSON Utilities - Serialize/parse JSON, ưu tiên orjson nếu đã cài
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson là optional
+    orjson = None
+
+# Option của orjson gom một lần khi import (không OR lại mỗi lần gọi)
+_ORJSON_OPTION = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+def _default(obj: Any) -> Any:
+    """Chuyển object không hỗ trợ: Pydantic model -> dict, còn lại -> str()"""
+    model_dump = getattr(obj, "model_dump", None)
+    if model_dump is not None:
+        return model_dump()
+    return str(obj)
+
+def json_dumps(obj: Any) -> str:
+    """Serialize obj thành JSON string, object không hỗ trợ thì chuyển bằng _default"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTION).decode()
+    return json.dumps(obj, default=_default, ensure_ascii=False)
+
+def json_loads(data: Any) -> Any:
+    """Parse JSON từ str/bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps_bytes(obj: Any) -> bytes:
+    """Serialize obj thành JSON bytes UTF-8 (orjson trả bytes sẵn, không cần decode)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTION)
+    return json.dumps(obj, default=_default, ensure_ascii=False).encode('utf-8')
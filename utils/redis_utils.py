@@ -1,49 +1,325 @@
 """
 Redis Utilities - Các utility functions cho Redis operations
+
+Các hàm dùng chung client trên connection pool, mỗi lệnh mượn một connection riêng
+nên có thể gọi đồng thời (asyncio.gather) mà không bị tuần tự hóa.
 """
 
+import asyncio
 import logging
-from typing import Optional
-# from initialize import get_redis_client
+import os
+from typing import Optional, Any, AsyncIterator, Dict, List, Tuple
+from initialize import get_redis_client, get_redis_binary_client
+from .json_utils import json_dumps_bytes, json_loads
+from .cache_utils import TTLCache, MISSING
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - msgspec là optional
+    msgspec = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard là optional
+    zstandard = None
+
+# Value JSON lớn hơn ngưỡng được nén zstd, đánh dấu bằng byte đầu 0x01 (JSON thường
+# không bao giờ bắt đầu bằng byte này nên value cũ/không nén vẫn đọc được như trước)
+JSON_COMPRESS_THRESHOLD = int(os.getenv('REDIS_JSON_COMPRESS_THRESHOLD', 1024))
+_ZSTD_MAGIC = b"\x01"
+_ZSTD_COMPRESSOR = zstandard.ZstdCompressor(level=3) if zstandard is not None else None
+_ZSTD_DECOMPRESSOR = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+def _encode_json_value(value: Any) -> bytes:
+    data = json_dumps_bytes(value)
+    if _ZSTD_COMPRESSOR is not None and len(data) > JSON_COMPRESS_THRESHOLD:
+        return _ZSTD_MAGIC + _ZSTD_COMPRESSOR.compress(data)
+    return data
+
+def _decode_json_value(raw: bytes) -> Any:
+    if raw[:1] == _ZSTD_MAGIC:
+        if _ZSTD_DECOMPRESSOR is None:
+            raise RuntimeError("zstandard is not installed, cannot read compressed value")
+        raw = _ZSTD_DECOMPRESSOR.decompress(raw[1:])
+    return json_loads(raw)
+
+# Encoder/decoder msgpack tạo một lần, dùng lại cho mọi lần gọi
+_MSGPACK_ENCODER = msgspec.msgpack.Encoder() if msgspec is not None else None
+_MSGPACK_DECODER = msgspec.msgpack.Decoder() if msgspec is not None else None
+
+# Client của runner, lấy một lần rồi dùng lại (gọi reset_redis_client sau khi kết nối lại)
+_client = None
+_binary_client = None
+
+def _get_client():
+    global _client
+    client = _client
+    if client is None:
+        client = _client = get_redis_client()
+    return client
+
+def _get_binary_client():
+    global _binary_client
+    client = _binary_client
+    if client is None:
+        client = _binary_client = get_redis_binary_client()
+    return client
+
+# Lua script đã đăng ký trên client hiện tại, theo source
+_scripts: Dict[str, Any] = {}
+
+def reset_redis_client():
+    """Bỏ client đã cache, lần gọi sau sẽ lấy lại từ runner (sau restart/reconnect)"""
+    global _client, _binary_client
+    _client = _binary_client = None
+    _scripts.clear()
+
+def redis_script(source: str):
+    """Lấy Lua script đã đăng ký (EVALSHA, tự nạp lại khi Redis chưa có script)
+
+    Gọi: await script(keys=[...], args=[...]); truyền client=pipe để đưa vào pipeline.
+    """
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = _get_client().register_script(source)
+    return script
+
+# Key msgpack có prefix riêng để không lẫn với value JSON cùng tên
+_MSGPACK_PREFIX = "mp:"
 
 logger = logging.getLogger(__name__)
 
-async def redis_set(key: str, value: str, expire: int = None):
-    """Set giá trị Redis"""
-    logger.warning("Redis functions temporarily disabled - install redis first")
-    return None
+# Cache cục bộ (trong process) cho redis_get_cached/redis_get_json_cached. Chỉ ghi qua
+# process này mới xóa entry ngay; ghi từ process khác thấy được sau tối đa local_ttl giây.
+# Tắt bằng REDIS_LOCAL_CACHE=0 (các hàm *_cached khi đó đọc thẳng Redis)
+LOCAL_CACHE_ENABLED = os.getenv('REDIS_LOCAL_CACHE', '1') != '0'
+_local_cache = TTLCache(maxsize=int(os.getenv('REDIS_LOCAL_CACHE_SIZE', 4096)), ttl=1.0)
+
+def _invalidate_local(*keys: str):
+    for key in keys:
+        _local_cache.pop(key)
+        _local_cache.pop(("json", key))
+
+async def redis_set(key: str, value: str, expire: int = None, nx: bool = False):
+    """Set giá trị Redis (nx=True: chỉ set khi key chưa tồn tại, trả về None nếu đã có)"""
+    _invalidate_local(key)
+    return await _get_client().set(key, value, ex=expire, nx=nx)
 
 async def redis_get(key: str) -> Optional[str]:
     """Lấy giá trị từ Redis"""
-    logger.warning("Redis functions temporarily disabled - install redis first")
-    return None
+    return await _get_client().get(key)
+
+async def redis_setnx_ex(key: str, value: str, expire: int) -> bool:
+    """SET key value NX EX expire trong một lệnh (True nếu đã set, ví dụ lấy được lock)"""
+    _invalidate_local(key)
+    return bool(await _get_client().set(key, value, ex=expire, nx=True))
+
+async def redis_getex(key: str, expire: int) -> Optional[str]:
+    """GETEX: lấy giá trị và gia hạn TTL trong cùng một lệnh"""
+    return await _get_client().getex(key, ex=expire)
+
+async def redis_delete(*keys: str):
+    """Xóa một hoặc nhiều key trong Redis"""
+    if not keys:
+        return 0
+    _invalidate_local(*keys)
+    return await _get_client().delete(*keys)
+
+DELETE_CHUNK_SIZE = 500
+
+async def redis_delete_many(keys: List[str], unlink: bool = True) -> int:
+    """Xóa nhiều key, mặc định bằng UNLINK (Redis giải phóng bộ nhớ ở thread nền)
 
-async def redis_delete(key: str):
-    """Xóa key trong Redis"""
-    logger.warning("Redis functions temporarily disabled - install redis first")
-    return None
+    Danh sách lớn được chia thành các lệnh DELETE_CHUNK_SIZE key, gửi chung một pipeline.
+    """
+    if not keys:
+        return 0
+    _invalidate_local(*keys)
+    client = _get_client()
+    if len(keys) <= DELETE_CHUNK_SIZE:
+        return await (client.unlink(*keys) if unlink else client.delete(*keys))
+    async with client.pipeline(transaction=False) as pipe:
+        command = pipe.unlink if unlink else pipe.delete
+        for start in range(0, len(keys), DELETE_CHUNK_SIZE):
+            command(*keys[start:start + DELETE_CHUNK_SIZE])
+        return sum(await pipe.execute())
 
 async def redis_exists(key: str) -> bool:
     """Kiểm tra key có tồn tại trong Redis không"""
-    logger.warning("Redis functions temporarily disabled - install redis first")
-    return False
+    return await _get_client().exists(key) > 0
+
+async def redis_exists_many(keys: List[str]) -> List[bool]:
+    """Kiểm tra nhiều key trong một round-trip (EXISTS nhiều key chỉ trả về tổng số)"""
+    if not keys:
+        return []
+    async with _get_client().pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.exists(key)
+        return [count > 0 for count in await pipe.execute()]
 
 async def redis_set_json(key: str, value: dict, expire: int = None):
-    """Set JSON value vào Redis"""
-    logger.warning("Redis functions temporarily disabled - install redis first")
-    return None
+    """Set JSON value vào Redis (nén zstd nếu lớn hơn JSON_COMPRESS_THRESHOLD byte)"""
+    _invalidate_local(key)
+    return await _get_binary_client().set(key, _encode_json_value(value), ex=expire)
 
 async def redis_get_json(key: str) -> Optional[dict]:
-    """Lấy JSON value từ Redis"""
-    logger.warning("Redis functions temporarily disabled - install redis first")
-    return None
+    """Lấy JSON value từ Redis (đọc bằng client nhị phân vì value có thể đã nén)"""
+    value = await _get_binary_client().get(key)
+    return _decode_json_value(value) if value is not None else None
+
+async def redis_get_cached(key: str, local_ttl: float = 1.0) -> Optional[str]:
+    """redis_get có cache cục bộ local_ttl giây (cả kết quả None) cho key đọc nhiều"""
+    if not LOCAL_CACHE_ENABLED:
+        return await redis_get(key)
+    value = _local_cache.get(key)
+    if value is MISSING:
+        value = await redis_get(key)
+        _local_cache.set(key, value, ttl=local_ttl)
+    return value
+
+async def redis_get_json_cached(key: str, local_ttl: float = 1.0) -> Optional[Any]:
+    """redis_get_json có cache cục bộ (lưu object đã decode, không parse lại JSON)"""
+    if not LOCAL_CACHE_ENABLED:
+        return await redis_get_json(key)
+    value = _local_cache.get(("json", key))
+    if value is MISSING:
+        value = await redis_get_json(key)
+        _local_cache.set(("json", key), value, ttl=local_ttl)
+    return value
+
+async def redis_mset_json(items: Dict[str, Any], expire: int = None):
+    """Set nhiều JSON value trong một round-trip (pipeline)"""
+    if not items:
+        return []
+    _invalidate_local(*items)
+    async with _get_binary_client().pipeline(transaction=False) as pipe:
+        for key, value in items.items():
+            pipe.set(key, _encode_json_value(value), ex=expire)
+        return await pipe.execute()
+
+async def redis_mget_json(keys: List[str]) -> List[Optional[Any]]:
+    """Lấy nhiều JSON value trong một lệnh MGET (None cho key không tồn tại)"""
+    if not keys:
+        return []
+    values = await _get_binary_client().mget(keys)
+    return [_decode_json_value(value) if value is not None else None for value in values]
+
+async def redis_set_msgpack(key: str, value: Any, expire: int = None):
+    """Set value dạng msgpack (nhị phân, nhỏ và nhanh hơn JSON) vào key mp:{key}"""
+    if _MSGPACK_ENCODER is None:
+        raise RuntimeError("msgspec is not installed")
+    return await _get_binary_client().set(_MSGPACK_PREFIX + key, _MSGPACK_ENCODER.encode(value), ex=expire)
+
+async def redis_get_msgpack(key: str) -> Optional[Any]:
+    """Lấy value msgpack từ key mp:{key}"""
+    if _MSGPACK_DECODER is None:
+        raise RuntimeError("msgspec is not installed")
+    raw = await _get_binary_client().get(_MSGPACK_PREFIX + key)
+    return _MSGPACK_DECODER.decode(raw) if raw is not None else None
+
+async def redis_hgetall(key: str) -> dict:
+    """Lấy toàn bộ field của Redis HASH (dict rỗng nếu key không tồn tại)"""
+    return await _get_client().hgetall(key)
+
+async def redis_hmget(key: str, *fields: str) -> List[Optional[str]]:
+    """Lấy nhiều field của Redis HASH (None cho field không tồn tại)"""
+    return await _get_client().hmget(key, fields)
 
 async def redis_expire(key: str, seconds: int):
     """Set thời gian hết hạn cho key"""
-    logger.warning("Redis functions temporarily disabled - install redis first")
-    return None
+    _invalidate_local(key)
+    return await _get_client().expire(key, seconds)
 
 async def redis_ttl(key: str) -> int:
     """Lấy thời gian còn lại của key (TTL)"""
-    logger.warning("Redis functions temporarily disabled - install redis first")
-    return -1
+    return await _get_client().ttl(key)
+
+async def redis_scan_iter(match: str = "*", count: int = 500) -> AsyncIterator[str]:
+    """Duyệt các key khớp match bằng SCAN (không chặn Redis như KEYS)
+
+    count là gợi ý số key Redis xét mỗi lần SCAN: lớn hơn thì ít round-trip hơn nhưng
+    mỗi lệnh chạy lâu hơn. Module không có wrapper cho KEYS.
+    """
+    async for key in _get_client().scan_iter(match=match, count=count):
+        yield key
+
+def redis_pipeline(transaction: bool = False, binary: bool = False):
+    """Tạo pipeline để gửi nhiều lệnh trong một round-trip (dùng với async with)
+
+        async with redis_pipeline() as pipe:
+            pipe.set(key, json_dumps_bytes(value), ex=ttl)
+            pipe.expire(other_key, ttl)
+            results = await pipe.execute()
+
+    binary=True dùng client nhị phân (kết quả là bytes, cho value msgpack/nén).
+    Lệnh ghi qua pipeline không xóa cache cục bộ của redis_get_cached.
+    """
+    client = _get_binary_client() if binary else _get_client()
+    return client.pipeline(transaction=transaction)
+
+# Ghi fire-and-forget: lệnh được đưa vào hàng đợi, writer chạy nền gom tối đa
+# WRITE_BATCH_MAX lệnh (hoặc chờ WRITE_FLUSH_MS) rồi gửi bằng một pipeline
+WRITE_BATCH_MAX = 256
+WRITE_FLUSH_MS = 5
+WRITE_QUEUE_SIZE = 10000
+
+_write_queue: Optional[asyncio.Queue] = None
+_write_task: Optional[asyncio.Task] = None
+
+def _enqueue_write(command: str, *args, **kwargs) -> bool:
+    global _write_queue, _write_task
+    if _write_queue is None:
+        _write_queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+    try:
+        _write_queue.put_nowait((command, args, kwargs))
+    except asyncio.QueueFull:
+        logger.warning("Redis write queue is full, dropping %s %s", command, args[:1])
+        return False
+    if _write_task is None or _write_task.done():
+        _write_task = asyncio.get_running_loop().create_task(_write_loop(_write_queue))
+    return True
+
+async def _write_loop(queue: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    while True:
+        batch: List[Tuple[str, tuple, dict]] = [await queue.get()]
+        deadline = loop.time() + WRITE_FLUSH_MS / 1000
+        while len(batch) < WRITE_BATCH_MAX:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        try:
+            async with _get_client().pipeline(transaction=False) as pipe:
+                for command, args, kwargs in batch:
+                    getattr(pipe, command)(*args, **kwargs)
+                await pipe.execute()
+        except Exception as e:
+            logger.error("Error writing Redis batch (%d commands): %s", len(batch), e)
+        finally:
+            # task_done sau khi đã gửi để redis_flush() chờ đến khi lệnh thực sự tới Redis
+            for _ in batch:
+                queue.task_done()
+
+def redis_set_nowait(key: str, value: Any, expire: int = None) -> bool:
+    """Set giá trị Redis không chờ phản hồi (False nếu hàng đợi đầy)"""
+    _invalidate_local(key)
+    return _enqueue_write("set", key, value, ex=expire)
+
+def redis_expire_nowait(key: str, seconds: int) -> bool:
+    """Set thời gian hết hạn không chờ phản hồi"""
+    _invalidate_local(key)
+    return _enqueue_write("expire", key, seconds)
+
+def redis_delete_nowait(*keys: str) -> bool:
+    """Xóa key không chờ phản hồi"""
+    _invalidate_local(*keys)
+    return _enqueue_write("delete", *keys) if keys else True
+
+async def redis_flush():
+    """Chờ đến khi mọi lệnh ghi fire-and-forget đã được gửi tới Redis"""
+    if _write_queue is not None:
+        await _write_queue.join()